@@ -3,119 +3,1930 @@
 Lightweight receipt sharing web app using only the standard library.
 Run: python3 app.py  (serves on http://localhost:8000)
 """
-import cgi
+import atexit
+import base64
+import binascii
+import bisect
+import contextlib
+import contextvars
+import cProfile
+import csv
 import datetime as dt
+import gzip
+import hashlib
+import hmac
+import importlib
+import importlib.util
+import itertools
 import json
+import logging
+import logging.handlers
+import math
 import os
+import queue
+import random
 import re
+import selectors
 import ssl
 import sys
+import tempfile
 import threading
 import time
+import unicodedata
 import urllib.parse
-import urllib.request
 import urllib.error
 import uuid
+import weakref
+import zlib
 import os
+from array import array
 import html as html_lib
-from email import message_from_bytes, policy
-from io import BytesIO
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from collections import OrderedDict, defaultdict, deque
+from io import BytesIO, StringIO
 from http.server import SimpleHTTPRequestHandler
 from pathlib import Path
-from socketserver import ThreadingMixIn
 from http.server import HTTPServer
 
+# FastAPI is imported by create_fastapi_app() only; the stdlib server never loads it.
+FASTAPI_AVAILABLE = importlib.util.find_spec("fastapi") is not None
+
 try:
-    from fastapi import Body, FastAPI, File, Form, HTTPException, Request, UploadFile
-    from fastapi.middleware.cors import CORSMiddleware
-    from fastapi.responses import FileResponse
-    from fastapi.staticfiles import StaticFiles
-except ImportError:  # fastapi/uvicorn not installed in non-ASGI runs
-    FastAPI = None  # type: ignore
+    import orjson  # type: ignore
+except ImportError:  # optional fast encoder; the stdlib json module covers everything it does
+    orjson = None
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+# NumPy (optional; ItemColumns falls back to plain loops over array columns) costs
+# tens of milliseconds to import, so numpy_module() loads it on first use.
+_numpy = False
+
+
+def numpy_module():
+    """The numpy module, imported on first call; None when it is not installed."""
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy  # type: ignore
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+
+try:
+    import zstandard  # type: ignore
+except ImportError:  # optional; uploaded blobs are gzip-compressed without it
+    zstandard = None
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 DATA_DIR = BASE_DIR / "data"
 UPLOAD_DIR = BASE_DIR / "uploads"
+# Legacy single-trip snapshot; migrated into the default trip shard on first load.
 DATA_FILE = DATA_DIR / "state.json"
+TRIPS_DIR = DATA_DIR / "trips"
+TRIPS_INDEX_FILE = DATA_DIR / "trips.json"
+# Uploaded receipt sources, stored once per SHA-256 (see BlobStore).
+BLOB_DIR = DATA_DIR / "blobs"
 
 
 def ensure_dirs():
     DATA_DIR.mkdir(parents=True, exist_ok=True)
+    TRIPS_DIR.mkdir(parents=True, exist_ok=True)
     UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-def debug(msg):
-    prefix = "\033[96m---- DEBUG ----\033[0m"
-    line = f"{prefix} {msg}"
-    # Print to stdout so terminals (and VS Code) show it immediately
-    print(line, flush=True)
-    sys.stderr.write(line + "\n")
-    sys.stderr.flush()
+
+# Regexes are declared once as LazyPattern constants: nothing is compiled at import,
+# and warm_patterns() compiles them all on the start-up thread (see Startup).
+PATTERNS = []
+
+
+class LazyPattern:
+    """A ``re.Pattern`` stand-in that compiles on first use; registered in PATTERNS."""
+
+    __slots__ = ("source", "flags", "_compiled")
+
+    def __init__(self, source, flags=0):
+        self.source = source
+        self.flags = flags
+        self._compiled = None
+        PATTERNS.append(self)
+
+    def compile(self):
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compiled = re.compile(self.source, self.flags)
+        return compiled
+
+    def match(self, string, *args):
+        return self.compile().match(string, *args)
+
+    def search(self, string, *args):
+        return self.compile().search(string, *args)
+
+    def sub(self, repl, string, count=0):
+        return self.compile().sub(repl, string, count)
+
+    def findall(self, string, *args):
+        return self.compile().findall(string, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.compile(), name)
+
+
+def warm_patterns():
+    """Compile every registered pattern; returns how many there were."""
+    for pattern in list(PATTERNS):
+        pattern.compile()
+    return len(PATTERNS)
+
+
+# Logging: LOG_LEVEL (default INFO) and LOG_FORMAT ("text" or "json").
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+LOG_QUEUE_SIZE = 10_000
+
+logger = logging.getLogger("trip_splitter")
+_sample_counters = defaultdict(itertools.count)
+
+
+def log_event(event, msg=None, *args, level=logging.DEBUG, sample=1, **fields):
+    """
+    Emit a structured log record. ``event`` is a stable snake_case name, ``fields``
+    become key/value pairs (callables are evaluated only if the record is written)
+    and ``msg % args`` is formatted lazily by the handler. ``sample=N`` keeps one in
+    N records of a chatty event.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample > 1 and next(_sample_counters[event]) % sample:
+        return
+    if sample > 1:
+        fields["sample"] = sample
+    logger.log(level, msg or event, *args, extra={"event": event, "fields": fields})
+
+
+def _log_fields(record):
+    fields = {}
+    for key, value in (getattr(record, "fields", None) or {}).items():
+        if callable(value):
+            try:
+                value = value()
+            except Exception as e:  # a broken lazy field must not kill the log line
+                value = f"<error {e}>"
+        fields[key] = value
+    return fields
+
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, event, msg plus the record's fields."""
+
+    def format(self, record):
+        event = getattr(record, "event", None)
+        payload = {
+            "ts": dt.datetime.fromtimestamp(record.created, dt.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "event": event or record.name,
+        }
+        message = record.getMessage()
+        if message != event:
+            payload["msg"] = message
+        for key, value in _log_fields(record).items():
+            payload[key] = value if isinstance(value, (str, int, float, bool, type(None))) else repr(value)
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json_dumps(payload).decode("utf-8")
+
+
+class TextLogFormatter(logging.Formatter):
+    """Human-readable ``time LEVEL event msg key=value ...`` lines for terminals."""
+
+    def format(self, record):
+        event = getattr(record, "event", None) or record.name
+        parts = [self.formatTime(record, "%H:%M:%S"), record.levelname, event]
+        message = record.getMessage()
+        if message != event:
+            parts.append(message)
+        parts.extend(f"{key}={value!r}" if isinstance(value, str) and " " in value else f"{key}={value}"
+                     for key, value in _log_fields(record).items())
+        line = " ".join(str(part) for part in parts)
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to the listener thread without formatting them on the request path.
+    When the queue is full the record is dropped (and counted) instead of blocking.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Attach the queue-backed handler to ``logger`` (idempotent; returns the listener)."""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonLogFormatter() if fmt == "json" else TextLogFormatter())
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    logger.addHandler(NonBlockingQueueHandler(log_queue))
+    logger.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    logger.propagate = False
+    _log_listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _log_listener.start()
+    return _log_listener
+
+
+def flush_logging(restart=True):
+    """
+    Drain queued records so the last lines are not lost: called when run() shuts the
+    servers down, and at exit with ``restart=False`` to stop the listener for good.
+    """
+    if _log_listener is not None:
+        _log_listener.stop()
+        if restart:
+            _log_listener.start()
+
+
+_log_listener = None
+configure_logging()
+atexit.register(flush_logging, restart=False)
+
+
+# Metrics: Prometheus text exposition on /metrics.
+METRICS_PREFIX = "tripsplitter_"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics:
+    """
+    Counters and histograms kept in per-thread shards, so recording a sample never
+    takes a lock on the request path. A scrape merges the shards; shards of finished
+    threads are folded into ``_base`` (also when many threads come and go unscraped).
+    Gauges are computed at scrape time by registered collector callbacks.
+    """
+
+    FOLD_EVERY = 64
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._base = {}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def add_collector(self, fn):
+        """``fn()`` yields ``(name, labels_dict, value)`` gauge samples at scrape time."""
+        self._collectors.append(fn)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) % self.FOLD_EVERY == 0:
+                    self._fold_dead()
+        return shard
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        shard = self._shard()
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        shard = self._shard()
+        series = shard.get(key)
+        if series is None:
+            # [bucket counts..., +Inf count, sum]
+            series = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def timer(self, name, **labels):
+        return _MetricTimer(self, name, labels)
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in shard.items():
+            if isinstance(value, list):
+                current = into.get(key)
+                into[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def _fold_dead(self):
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._merge(self._base, shard.copy())
+        self._shards = alive
+
+    def snapshot(self):
+        with self._lock:
+            self._fold_dead()
+            merged = {}
+            self._merge(merged, self._base)
+            for _thread, shard in self._shards:
+                self._merge(merged, shard.copy())
+        return merged
+
+    def value(self, name, **labels):
+        """Current value of one counter series (mainly for tests and benchmarks)."""
+        return self.snapshot().get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self):
+        """Render every series in the Prometheus text format (version 0.0.4)."""
+        series = defaultdict(list)
+        for (name, labels), value in self.snapshot().items():
+            series[name].append((labels, value))
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    series[name].append((tuple(sorted(labels.items())), value))
+            except Exception as e:  # a failing collector must not break the scrape
+                log_event("metrics_collector_failed", level=logging.WARNING, error=str(e))
+        lines = []
+        for name in sorted(series):
+            kind, help_text = self._help.get(name, ("untyped", name))
+            full = METRICS_PREFIX + name
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            for labels, value in sorted(series[name], key=lambda lv: lv[0]):
+                if isinstance(value, list):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float("inf"),), value[:-1]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{full}_bucket{_label_str(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{full}_sum{_label_str(labels)} {value[-1]:.6f}")
+                    lines.append(f"{full}_count{_label_str(labels)} {cumulative}")
+                else:
+                    lines.append(f"{full}{_label_str(labels)} {value}")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _MetricTimer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        text = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{text}"')
+    return "{" + ",".join(parts) + "}"
+
+
+METRICS = Metrics()
+for _name, _kind, _help in (
+    ("http_request_duration_seconds", "histogram", "Request latency by route, method and status."),
+    ("stage_duration_seconds", "histogram", "Latency of internal stages (QR decode, fetches, state load/save, ...)."),
+    ("cache_requests_total", "counter", "Cache lookups by cache and result (hit/miss)."),
+    ("qr_variant_success_total", "counter", "Local QR decodes by the image variant that succeeded."),
+    ("qr_decode_total", "counter", "QR decode attempts by source and result."),
+    ("parser_selected_total", "counter", "Invoice parser chosen by detect_parser."),
+    ("outbound_requests_total", "counter", "Outbound HTTP requests by target and result."),
+    ("trips_loaded", "gauge", "Trips resident in memory."),
+    ("trip_receipts", "gauge", "Receipts per resident trip."),
+    ("trip_items", "gauge", "Items per resident trip."),
+    ("trip_state_bytes", "gauge", "Size of each resident trip's last written shard."),
+    ("http_shed_total", "counter", "Connections refused with 503 because the accept queue was full."),
+    ("http_workers", "gauge", "Stdlib server worker threads."),
+    ("http_workers_busy", "gauge", "Stdlib server workers currently serving a connection."),
+    ("http_accept_queue_depth", "gauge", "Accepted connections waiting for a worker."),
+    ("blob_puts_total", "counter", "Uploads stored in the blob store by result (stored/deduplicated)."),
+    ("blob_deletes_total", "counter", "Blobs deleted after their last receipt reference went away."),
+    ("outbound_breaker_state", "gauge", "Outbound circuit breaker per host (0 closed, 1 half-open, 2 open)."),
+    ("outbound_short_circuit_total", "counter", "Outbound calls skipped by target and reason (circuit_open/negative_cache)."),
+):
+    METRICS.describe(_name, _kind, _help)
+
+
+def track_stage(stage):
+    """Context manager timing an internal stage into stage_duration_seconds."""
+    return METRICS.timer("stage_duration_seconds", stage=stage)
+
+
+ROUTE_TRIP_RE = LazyPattern(r"^/api/trips/[^/]+(?=/|$)")
+ROUTE_RECEIPT_RE = LazyPattern(r"/receipts/[^/]+")
+ROUTE_PROFILE_RE = LazyPattern(r"^/api/admin/profiles/[^/]+")
+
+
+def route_template(path):
+    """Collapse ids out of a request path so route labels stay low-cardinality."""
+    if path.startswith("/static/"):
+        return "/static/*"
+    if path.startswith("/uploads/"):
+        return "/uploads/*"
+    path = path.rstrip("/") or "/"
+    path = ROUTE_TRIP_RE.sub("/api/trips/{trip}", path)
+    path = ROUTE_RECEIPT_RE.sub("/receipts/{id}", path)
+    path = ROUTE_PROFILE_RE.sub("/api/admin/profiles/{id}", path)
+    if path.startswith("/api/") or path in ("/", "/metrics", "/healthz", "/readyz"):
+        return path
+    return "other"
+
+
+# Opt-in request profiling. ADMIN_TOKEN unlocks ``X-Profile: 1`` / ``?profile=1`` per
+# request and the /api/admin endpoints; PROFILE_SAMPLE_RATE profiles a random share of
+# /api requests without any flag. Profiles land in a ring of PROFILE_KEEP files.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0") or 0)
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR") or DATA_DIR / "profiles")
+PROFILE_KEEP = max(1, int(os.environ.get("PROFILE_KEEP", "50") or 50))
+PROFILE_ID_RE = LazyPattern(r"^[0-9A-Za-z_.-]{1,128}$")
+PROFILE_TRIP_RE = LazyPattern(r"^/api/trips/([^/]+)")
+PROFILE_RECEIPT_RE = LazyPattern(r"/receipts/([^/]+)")
+PROFILE_NAME_UNSAFE_RE = LazyPattern(r"[^0-9A-Za-z]+")
+# Labels of the request being profiled (route, trip, receipt, parser, ...); None otherwise.
+_PROFILE_LABELS = contextvars.ContextVar("profile_labels", default=None)
+
+
+def profile_label(**labels):
+    """Attach labels (receipt id, parser, QR source, ...) to the profile of the current request, if any."""
+    current = _PROFILE_LABELS.get()
+    if current is not None:
+        current.update({k: v for k, v in labels.items() if v is not None})
+
+
+def is_admin(token):
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(str(token), ADMIN_TOKEN)
+
+
+def require_admin(token):
+    if not ADMIN_TOKEN:
+        raise ApiError(404, "Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if not is_admin(token):
+        raise ApiError(403, "Admin token required")
+
+
+class RequestProfiler:
+    """
+    Wraps single requests in cProfile and keeps the newest ``keep`` profiles on disk as
+    ``<id>.prof`` (pstats/snakeviz format) with a ``<id>.json`` sidecar of labels.
+    Only one request is profiled at a time: cProfile hooks are per thread (and global
+    from Python 3.12), and on the ASGI event loop concurrent requests would share them.
+    """
+
+    def __init__(self, directory, keep=PROFILE_KEEP, sample_rate=PROFILE_SAMPLE_RATE):
+        self.directory = Path(directory)
+        self.keep = keep
+        self.sample_rate = sample_rate
+        self._active = threading.Lock()
+        self._ring_lock = threading.Lock()
+
+    def reason(self, path, header_flag, query_flag, token):
+        """Why this request should be profiled ("header", "query", "sample"), or None."""
+        header_flag = (header_flag or "").lower() in {"1", "true", "yes", "on"}
+        query_flag = (query_flag or "").lower() in {"1", "true", "yes", "on"}
+        if (header_flag or query_flag) and is_admin(token):
+            return "header" if header_flag else "query"
+        if self.sample_rate > 0 and path.startswith("/api/") and not path.startswith("/api/admin/"):
+            if random.random() < self.sample_rate:
+                return "sample"
+        return None
+
+    def start(self, method, path, reason):
+        """Begin profiling; returns a session to ``stop()``, or None if another profile is running."""
+        if not self._active.acquire(blocking=False):
+            log_event("profile_skipped", "another request is being profiled", path=path, reason=reason)
+            return None
+        labels = {"route": route_template(path), "method": method, "path": path, "reason": reason}
+        match = PROFILE_TRIP_RE.match(path)
+        if match:
+            labels["trip"] = match.group(1)
+        match = PROFILE_RECEIPT_RE.search(path)
+        if match:
+            labels["receipt"] = match.group(1)
+        # Ids sort by creation time, which is what the ring relies on when trimming.
+        profile_id = "{}-{}-{}".format(
+            dt.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f"),
+            uuid.uuid4().hex[:6],
+            PROFILE_NAME_UNSAFE_RE.sub("_", labels["route"]).strip("_") or "root",
+        )
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:  # another profiler (e.g. a debugger) owns the hooks
+            self._active.release()
+            log_event("profile_skipped", level=logging.WARNING, path=path, error=str(e))
+            return None
+        return _ProfileSession(self, profile_id, profiler, labels)
+
+    def _save(self, session, status, duration):
+        meta = {
+            "id": session.id,
+            "created_at": dt.datetime.utcnow().isoformat() + "Z",
+            "status": status,
+            "duration_ms": round(duration * 1e3, 3),
+            **session.labels,
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        prof_path = self.directory / f"{session.id}.prof"
+        tmp_path = prof_path.with_suffix(".prof.tmp")
+        session.profiler.dump_stats(str(tmp_path))
+        os.replace(tmp_path, prof_path)
+        write_json_atomic(self.directory / f"{session.id}.json", meta)
+        with self._ring_lock:
+            stale = sorted(self.directory.glob("*.prof"))[: -self.keep]
+            for old in stale:
+                for suffix in (".prof", ".json"):
+                    try:
+                        old.with_suffix(suffix).unlink()
+                    except FileNotFoundError:
+                        pass
+        log_event("profile_saved", level=logging.INFO, profile_id=session.id, **session.labels)
+        return meta
+
+    def list(self):
+        profiles = []
+        if not self.directory.exists():
+            return profiles
+        for meta_path in sorted(self.directory.glob("*.json"), reverse=True):
+            try:
+                profiles.append(read_json_file(meta_path))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def path_for(self, profile_id):
+        path = self.directory / f"{profile_id}.prof"
+        if not PROFILE_ID_RE.match(profile_id or "") or not path.exists():
+            raise ApiError(404, "Profile not found")
+        return path
+
+    def report(self, profile_id, sort="cumulative", limit=50):
+        """Human-readable pstats table for one saved profile."""
+        if sort not in ("cumulative", "tottime", "ncalls"):
+            raise ApiError(400, "Invalid sort (cumulative, tottime or ncalls)")
+        try:
+            limit = max(1, min(int(limit), 500))
+        except (TypeError, ValueError):
+            raise ApiError(400, "Invalid limit")
+        import pstats
+
+        out = StringIO()
+        stats = pstats.Stats(str(self.path_for(profile_id)), stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+class _ProfileSession:
+    __slots__ = ("owner", "id", "profiler", "labels", "start", "token")
+
+    def __init__(self, owner, profile_id, profiler, labels):
+        self.owner = owner
+        self.id = profile_id
+        self.profiler = profiler
+        self.labels = labels
+        self.start = time.perf_counter()
+        self.token = _PROFILE_LABELS.set(labels)
+
+    def stop(self, status):
+        self.profiler.disable()
+        duration = time.perf_counter() - self.start
+        try:
+            _PROFILE_LABELS.reset(self.token)
+        except ValueError:  # stopped from a different context than it started in
+            _PROFILE_LABELS.set(None)
+        try:
+            return self.owner._save(self, status, duration)
+        except OSError as e:
+            log_event("profile_save_failed", level=logging.WARNING, profile_id=self.id, error=str(e))
+            return None
+        finally:
+            self.owner._active.release()
+
+
+PROFILER = RequestProfiler(PROFILE_DIR)
 
 
 DEFAULT_PEOPLE = ["Yiannos", "Ntinos", "Ari", "Eva", "Athanasia", "Spiros", "Rozina", "Anna"]
 DEFAULT_STATE = {"people": list(DEFAULT_PEOPLE), "receipts": []}
+DEFAULT_TRIP_ID = "default"
+TRIP_ID_RE = LazyPattern(r"^[A-Za-z0-9_-]{1,64}$")
+# Responses smaller than this are sent uncompressed; the framing overhead is not worth it.
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024") or 1024)
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+UPLOAD_CACHE_CONTROL = "private, max-age=86400"
+# Static files up to this size are held in memory with their encodings and headers
+# precomputed; larger files (and uploads) are streamed from disk with sendfile().
+HOT_ASSET_MAX_BYTES = int(os.environ.get("HOT_ASSET_MAX_BYTES", str(256 * 1024)) or 0)
+HOT_ASSETS_TOTAL_BYTES = int(os.environ.get("HOT_ASSETS_TOTAL_BYTES", str(8 * 1024 * 1024)) or 0)
+# Upload limits for the stdlib server's multipart/JSON bodies (bytes).
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", str(20 * 1024 * 1024)) or 0)
+MAX_FILE_BYTES = int(os.environ.get("MAX_FILE_BYTES", str(15 * 1024 * 1024)) or 0)
+MAX_FIELD_BYTES = int(os.environ.get("MAX_FIELD_BYTES", str(8 * 1024 * 1024)) or 0)
+# Parts larger than this move from memory to a temp file while they are received.
+UPLOAD_SPOOL_BYTES = 256 * 1024
+# How many trips stay resident in memory before the least recently used one is dropped.
+TRIP_CACHE_SIZE = max(1, int(os.environ.get("TRIP_CACHE_SIZE", "8") or 8))
+# Stdlib server concurrency: a fixed worker pool fed by a bounded accept queue. Connections
+# arriving while the queue is full get a 503 with Retry-After instead of a new thread.
+HTTP_WORKERS = max(1, int(os.environ.get("HTTP_WORKERS", "32") or 32))
+HTTP_ACCEPT_QUEUE = max(1, int(os.environ.get("HTTP_ACCEPT_QUEUE", "64") or 64))
+HTTP_RETRY_AFTER = 2
+# Keep-alive: idle connections are closed after this many seconds, and after
+# HTTP_KEEPALIVE_MAX requests. An idle connection holds its worker, so the wait for the
+# next request is polled every HTTP_KEEPALIVE_POLL seconds and given up as soon as
+# connections are queued for a worker. HTTP_REQUEST_TIMEOUT bounds stalls mid-request.
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", "5") or 5)
+HTTP_KEEPALIVE_POLL = 0.1
+HTTP_KEEPALIVE_MAX = max(1, int(os.environ.get("HTTP_KEEPALIVE_MAX", "100") or 100))
+HTTP_REQUEST_TIMEOUT = float(os.environ.get("HTTP_REQUEST_TIMEOUT", "30") or 30)
 
-QR_API = "https://api.qrserver.com/v1/read-qr-code/?outputformat=json"
+# QR_API_URL points the remote decoder elsewhere (e.g. a local stand-in server in tests).
+QR_API = os.environ.get("QR_API_URL") or "https://api.qrserver.com/v1/read-qr-code/?outputformat=json"
+# Outbound circuit breakers, one per host: when at least BREAKER_MIN_CALLS calls in the
+# last BREAKER_WINDOW seconds failed at BREAKER_FAILURE_RATE or more, the host is skipped
+# for BREAKER_COOLDOWN seconds, after which a single trial call decides whether to close.
+BREAKER_WINDOW = float(os.environ.get("BREAKER_WINDOW", "60") or 60)
+BREAKER_MIN_CALLS = max(1, int(os.environ.get("BREAKER_MIN_CALLS", "4") or 4))
+BREAKER_FAILURE_RATE = float(os.environ.get("BREAKER_FAILURE_RATE", "0.5") or 0.5)
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", "30") or 30)
+# A URL (or QR image) whose call just failed is not retried for this many seconds.
+NEGATIVE_CACHE_TTL = float(os.environ.get("NEGATIVE_CACHE_TTL", "30") or 0)
+# Fail-fast mode for flaky networks: outbound timeouts are capped at
+# OUTBOUND_FAST_TIMEOUT and a single failure opens the host's breaker.
+OUTBOUND_FAIL_FAST = os.environ.get("OUTBOUND_FAIL_FAST", "0").lower() in {"1", "true", "yes", "on"}
+OUTBOUND_FAST_TIMEOUT = float(os.environ.get("OUTBOUND_FAST_TIMEOUT", "2") or 2)
 USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 HEADLESS_FETCH = os.environ.get("HEADLESS_FETCH", "0").lower() in {"1", "true", "yes", "on"}
 
 
-def load_state():
-    ensure_dirs()
-    raw = {}
-    if DATA_FILE.exists():
-        try:
-            with DATA_FILE.open("r", encoding="utf-8") as fh:
-                raw = json.load(fh)
-        except json.JSONDecodeError:
-            debug("state file contained invalid JSON; recreating from defaults")
-            raw = {}
-    state = normalize_state(raw)
-    if (not DATA_FILE.exists()) or state != raw:
-        save_state(state)
-    return state
+class ApiError(Exception):
+    """Request-level failure shared by the stdlib handler and the FastAPI routes."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
 
 
-def normalize_state(raw_state):
+def normalize_state(raw_state, seed_people=()):
     """
-    Ensure required keys exist, defaults are present, and names are de-duped/cleaned.
+    Ensure required keys exist, seed people are present, and names are de-duped/cleaned.
+    A person's id is their position in ``people``; items keep their participants as a
+    ``mask`` over those ids. Legacy ``participants`` name lists are converted, and masks
+    are renumbered if cleaning or seeding moved people around.
     """
     people = []
-    seen = set()
+    ids = {}
 
     def add_person(name):
         cleaned = clean(name)
-        if cleaned and cleaned not in seen:
-            seen.add(cleaned)
+        if cleaned and cleaned not in ids:
+            ids[cleaned] = len(people)
             people.append(cleaned)
+        return ids.get(cleaned)
 
-    # Always seed with defaults in the requested order
-    for default_name in DEFAULT_PEOPLE:
-        add_person(default_name)
+    # Seed people come first, in the requested order
+    for seed_name in seed_people:
+        add_person(seed_name)
 
     raw_people = raw_state.get("people") if isinstance(raw_state, dict) else []
+    remap = []
     if isinstance(raw_people, list):
         for name in raw_people:
-            add_person(name)
+            remap.append(add_person(name))
+    renumber = any(new_id != old_id for old_id, new_id in enumerate(remap))
 
     receipts = raw_state.get("receipts") if isinstance(raw_state, dict) else []
     if not isinstance(receipts, list):
         receipts = []
 
-    return {"people": people, "receipts": receipts}
+    normalized = []
+    for receipt in receipts:
+        items = receipt.get("items") if isinstance(receipt, dict) else None
+        if not isinstance(items, list):
+            normalized.append(receipt)
+            continue
+        new_items = []
+        changed = False
+        for item in items:
+            if not isinstance(item, dict):
+                new_items.append(item)
+                continue
+            if "participants" in item:
+                item = dict(item)
+                names = item.pop("participants") or []
+                item["mask"] = people_mask((clean(name) for name in names), ids)
+                changed = True
+            elif not isinstance(item.get("mask"), int):
+                item = {**item, "mask": 0}
+                changed = True
+            elif renumber and item["mask"]:
+                item = {**item, "mask": remap_mask(item["mask"], remap)}
+                changed = True
+            new_items.append(item)
+        normalized.append({**receipt, "items": new_items} if changed else receipt)
 
+    return {"people": people, "receipts": normalized}
 
-def save_state(state):
-    ensure_dirs()
-    with DATA_FILE.open("w", encoding="utf-8") as fh:
-        json.dump(state, fh, ensure_ascii=False, indent=2)
+
+def people_mask(names, person_ids):
+    """Bitmask of ``names`` (bit i is person id i); names not in ``person_ids`` are dropped."""
+    mask = 0
+    for name in names or ():
+        person_id = person_ids.get(name)
+        if person_id is not None:
+            mask |= 1 << person_id
+    return mask
+
+
+def mask_ids(mask):
+    """Person ids set in ``mask``, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def mask_names(mask, people):
+    return [people[person_id] for person_id in mask_ids(mask) if person_id < len(people)]
+
+
+def remap_mask(mask, remap):
+    """Renumber ``mask`` through ``remap[old_id] -> new_id``; ids without a mapping are dropped."""
+    out = 0
+    for old_id in mask_ids(mask):
+        new_id = remap[old_id] if old_id < len(remap) else None
+        if new_id is not None:
+            out |= 1 << new_id
+    return out
+
+
+def json_dumps(data):
+    """
+    Encode ``data`` as compact UTF-8 JSON bytes, using orjson when it is installed.
+    Values orjson refuses (e.g. ints wider than 64 bits) fall back to the stdlib.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_loads(raw):
+    """Decode JSON bytes/str; raises json.JSONDecodeError (orjson's error subclasses it)."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        raw = bytes(raw).decode("utf-8")
+    return json.loads(raw)
+
+
+def read_json_file(path):
+    with Path(path).open("rb") as fh:
+        return json_loads(fh.read())
+
+
+def write_json_atomic(path, data):
+    """Write compact JSON next to ``path`` and rename it into place so readers never see half a file."""
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:6]}.tmp")
+    encoded = json_dumps(data)
+    with tmp_path.open("wb") as fh:
+        fh.write(encoded)
+    os.replace(tmp_path, path)
+    return len(encoded)
+
+
+RECEIPT_SORT_KEYS = {
+    "created_at": lambda r: r.get("created_at") or "",
+    "total_amount": lambda r: float(r.get("total_amount") or 0),
+    "title": lambda r: (r.get("title") or "").lower(),
+}
+RECEIPT_FILTER_FIELDS = ("paid_by", "supplier", "parser", "participant")
+RECEIPT_HEADER_FIELDS = (
+    "id", "title", "supplier", "paid_by", "currency", "total_amount",
+    "payment_method", "notes", "parser", "raw_html_file", "created_at",
+)
+RECEIPT_PAGE_DEFAULT = 50
+RECEIPT_PAGE_MAX = 200
+
+
+def receipt_filter_values(receipt):
+    """
+    Index terms of a receipt per filter field; supplier is matched case-insensitively
+    and participants are indexed by person id.
+    """
+    mask = 0
+    for item in receipt.get("items") or []:
+        mask |= item.get("mask") or 0
+    participants = set(mask_ids(mask))
+    supplier = (receipt.get("supplier") or "").strip().lower()
+    return {
+        "paid_by": {receipt["paid_by"]} if receipt.get("paid_by") else set(),
+        "supplier": {supplier} if supplier else set(),
+        "parser": {receipt["parser"]} if receipt.get("parser") else set(),
+        "participant": participants,
+    }
+
+
+def parse_fields(raw, default="headers"):
+    """
+    Turn a ``fields`` query value into a projection: None means the full receipt,
+    otherwise a tuple of keys. ``headers`` expands to every field except items.
+    """
+    raw = (raw or default).strip()
+    if raw == "full":
+        return None
+    fields = []
+    for name in raw.split(","):
+        name = name.strip()
+        if name == "headers":
+            fields.extend(RECEIPT_HEADER_FIELDS + ("item_count",))
+        elif name:
+            fields.append(name)
+    return tuple(dict.fromkeys(fields)) or None
+
+
+def project_receipt(receipt, fields):
+    if fields is None:
+        return receipt
+    out = {}
+    for name in fields:
+        if name == "item_count":
+            out[name] = len(receipt.get("items") or [])
+        elif name in receipt:
+            out[name] = receipt[name]
+    return out
+
+
+def encode_cursor(entry, sort_name):
+    raw = json.dumps([sort_name, entry[0], entry[1]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, sort_name):
+    """
+    ``(key, seq)`` of a cursor issued for ``sort_name``. Cursors from another sort or
+    with a key of the wrong type are rejected, since bisecting with them would compare
+    mismatched types.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, key, seq = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        seq = int(seq)
+    except Exception:
+        raise ApiError(400, "Invalid cursor")
+    expected = type(RECEIPT_SORT_KEYS[sort_name]({}))
+    if expected is float and isinstance(key, int) and not isinstance(key, bool):
+        key = float(key)
+    if cursor_sort != sort_name or type(key) is not expected:
+        raise ApiError(400, "Invalid cursor")
+    return key, seq
+
+
+class ReceiptIndex:
+    """
+    Secondary indexes over one trip's receipts: id lookup, one sorted list of
+    ``(key, seq, id)`` per sort key, and posting sets per filter value. Queries
+    intersect posting sets and bisect into the sorted lists, so a page costs
+    O(log n + matches) instead of a scan over every receipt.
+    """
+
+    def __init__(self, receipts=()):
+        self.by_id = {}
+        self._seq = {}
+        self._next_seq = 0
+        self._entries = {}
+        self._terms = {}
+        self._sorted = {name: [] for name in RECEIPT_SORT_KEYS}
+        self._postings = {field: defaultdict(set) for field in RECEIPT_FILTER_FIELDS}
+        for receipt in receipts:
+            self.add(receipt)
+
+    def add(self, receipt):
+        receipt_id = receipt.get("id")
+        if receipt_id is None:
+            return
+        if receipt_id in self.by_id:
+            self.remove(receipt_id)
+        seq = self._seq.get(receipt_id)
+        if seq is None:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._seq[receipt_id] = seq
+        self.by_id[receipt_id] = receipt
+        entries = {}
+        for name, key_fn in RECEIPT_SORT_KEYS.items():
+            entry = (key_fn(receipt), seq, receipt_id)
+            bisect.insort(self._sorted[name], entry)
+            entries[name] = entry
+        self._entries[receipt_id] = entries
+        terms = receipt_filter_values(receipt)
+        for field, values in terms.items():
+            for value in values:
+                self._postings[field][value].add(receipt_id)
+        self._terms[receipt_id] = terms
+
+    def remove(self, receipt_id, forget=False):
+        if self.by_id.pop(receipt_id, None) is None:
+            return
+        for name, entry in self._entries.pop(receipt_id).items():
+            order = self._sorted[name]
+            pos = bisect.bisect_left(order, entry)
+            if pos < len(order) and order[pos] == entry:
+                del order[pos]
+        for field, values in self._terms.pop(receipt_id).items():
+            postings = self._postings[field]
+            for value in values:
+                bucket = postings.get(value)
+                if bucket is not None:
+                    bucket.discard(receipt_id)
+                    if not bucket:
+                        del postings[value]
+        if forget:
+            self._seq.pop(receipt_id, None)
+
+    def update(self, receipt):
+        """Re-index a receipt after its fields or participants changed (keeps its position)."""
+        self.add(receipt)
+
+    def query(self, filters=None, sort="created_at", cursor=None, limit=RECEIPT_PAGE_DEFAULT,
+              date_from=None, date_to=None):
+        descending = sort.startswith("-")
+        sort_name = sort.lstrip("-")
+        if sort_name not in RECEIPT_SORT_KEYS:
+            raise ApiError(400, f"Unsupported sort: {sort}")
+        candidates = None
+        for field, value in sorted((filters or {}).items(), key=lambda kv: self._posting_size(*kv)):
+            if field == "supplier":
+                value = value.strip().lower()
+            ids = self._postings[field].get(value, set())
+            candidates = set(ids) if candidates is None else candidates & ids
+            if not candidates:
+                return [], None
+        if candidates is None:
+            entries = self._sorted[sort_name]
+        else:
+            entries = sorted(self._entries[rid][sort_name] for rid in candidates)
+
+        lo, hi = 0, len(entries)
+        date_check = bool(date_from or date_to)
+        if sort_name == "created_at" and date_check:
+            # created_at is the sort key here, so the date range is just two bisections.
+            if date_from:
+                lo = bisect.bisect_left(entries, (date_from,))
+            if date_to:
+                hi = bisect.bisect_left(entries, (date_to + "\uffff",))
+            date_check = False
+        if cursor:
+            key, seq = decode_cursor(cursor, sort_name)
+            if descending:
+                hi = min(hi, bisect.bisect_left(entries, (key, seq)))
+            else:
+                lo = max(lo, bisect.bisect_left(entries, (key, seq + 0.5)))
+
+        positions = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+        page = []
+        last_entry = None
+        has_more = False
+        for pos in positions:
+            entry = entries[pos]
+            receipt = self.by_id[entry[2]]
+            if date_check and not created_in_range(receipt, date_from, date_to):
+                continue
+            if len(page) == limit:
+                has_more = True
+                break
+            page.append(receipt)
+            last_entry = entry
+        return page, (encode_cursor(last_entry, sort_name) if has_more else None)
+
+    def _posting_size(self, field, value):
+        if field not in self._postings:
+            raise ApiError(400, f"Unsupported filter: {field}")
+        if field == "supplier":
+            value = value.strip().lower()
+        return len(self._postings[field].get(value, ()))
+
+
+def created_in_range(receipt, date_from=None, date_to=None):
+    created = receipt.get("created_at") or ""
+    if date_from and created < date_from:
+        return False
+    if date_to and created[: len(date_to)] > date_to:
+        return False
+    return True
+
+
+# Full-text search over a trip (/api/search). Item descriptions and participants are
+# indexed per item, supplier and notes per receipt.
+SEARCH_FIELDS = ("description", "participants", "supplier", "notes")
+SEARCH_FIELD_BITS = {field: 1 << pos for pos, field in enumerate(SEARCH_FIELDS)}
+SEARCH_FIELD_WEIGHTS = {"description": 1.0, "participants": 0.8, "supplier": 0.6, "notes": 0.5}
+# Exact terms outrank completions of a prefix, which outrank one-typo matches.
+SEARCH_MATCH_WEIGHTS = {"exact": 1.0, "prefix": 0.7, "fuzzy": 0.5}
+SEARCH_PREFIX_MIN = 2
+SEARCH_FUZZY_MIN = 4
+# Index terms a single query token may expand to through prefix and fuzzy matching.
+SEARCH_MAX_EXPANSIONS = 64
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+SEARCH_RECEIPT_FIELDS = ("id", "title", "supplier", "paid_by", "currency", "total_amount", "notes", "created_at")
+SEARCH_ITEM_FIELDS = ("id", "description", "quantity", "price", "total")
+SEARCH_TOKEN_RE = LazyPattern(r"\w+")
+# Combining marks left by NFD: Greek tonos/dialytika/breathings and Latin diacritics.
+_COMBINING_MARKS = dict.fromkeys(range(0x0300, 0x0370))
+
+
+def fold_text(text):
+    """Case- and accent-fold ``text``: "Ελαιόλαδο", "ΕΛΑΙΟΛΑΔΟ" and "ελαιολαδο" fold alike."""
+    return unicodedata.normalize("NFD", (text or "").casefold()).translate(_COMBINING_MARKS)
+
+
+def search_terms(text):
+    return SEARCH_TOKEN_RE.findall(fold_text(text))
+
+
+def term_deletions(term):
+    """``term`` with each one of its characters dropped."""
+    return {term[:pos] + term[pos + 1:] for pos in range(len(term))}
+
+
+def within_one_edit(a, b):
+    """True when ``b`` is ``a`` with at most one insertion, deletion, substitution or adjacent swap."""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    pos = 0
+    while pos < la and pos < lb and a[pos] == b[pos]:
+        pos += 1
+    if la > lb:
+        return a[pos + 1:] == b[pos:]
+    if la < lb:
+        return a[pos:] == b[pos + 1:]
+    if a[pos + 1:] == b[pos + 1:]:
+        return True
+    return pos + 1 < la and a[pos] == b[pos + 1] and a[pos + 1] == b[pos] and a[pos + 2:] == b[pos + 2:]
+
+
+def parse_search_fields(raw):
+    """Field bitmask for a ``fields`` query value (comma separated); all fields when empty."""
+    bits = 0
+    for name in (raw or "").split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in SEARCH_FIELD_BITS:
+            raise ApiError(400, f"Unsupported search field: {name}")
+        bits |= SEARCH_FIELD_BITS[name]
+    return bits or (1 << len(SEARCH_FIELDS)) - 1
+
+
+def field_names(bits):
+    return [field for field in SEARCH_FIELDS if bits & SEARCH_FIELD_BITS[field]]
+
+
+class SearchIndex:
+    """
+    Inverted index over one trip's receipts. Postings map a folded term of an item
+    description, supplier or notes to ``{receipt_id: {item_id: field_bits}}``, with
+    item_id None for the receipt-level fields. A sorted vocabulary answers prefix
+    lookups by bisection, and a deletion index (each term with one character
+    dropped) finds one-typo matches without scanning the vocabulary. Participants
+    are indexed by person id, like ReceiptIndex does: query tokens are matched
+    against the (short) people list and items are picked from the receipts those
+    people joined by their ``mask``. Receipts are re-indexed as a whole when they
+    change, which keeps updates O(terms in the receipt).
+    """
+
+    def __init__(self, receipts=(), people=()):
+        self.people = people
+        self._postings = {}
+        self._vocab = []
+        self._deletes = defaultdict(set)
+        self._receipts = {}
+        self._receipt_terms = {}
+        self._receipt_people = {}
+        self._people_receipts = defaultdict(set)
+        self._person_terms = {}
+        self._seq = {}
+        self._next_seq = 0
+        for receipt in receipts:
+            self.add(receipt)
+
+    def __len__(self):
+        return len(self._postings)
+
+    def _terms_of_person(self, person_id):
+        terms = self._person_terms.get(person_id)
+        if terms is None:
+            # People are append-only, so a person id always names the same person.
+            terms = tuple(search_terms(self.people[person_id]))
+            self._person_terms[person_id] = terms
+        return terms
+
+    def add(self, receipt):
+        receipt_id = receipt.get("id")
+        if receipt_id is None:
+            return
+        if receipt_id in self._receipts:
+            self.remove(receipt_id)
+        if receipt_id not in self._seq:
+            self._seq[receipt_id] = self._next_seq
+            self._next_seq += 1
+        docs = defaultdict(int)
+        for field in ("supplier", "notes"):
+            for term in search_terms(receipt.get(field)):
+                docs[term, None] |= SEARCH_FIELD_BITS[field]
+        joined = 0
+        for item in receipt.get("items") or []:
+            item_id = item.get("id")
+            joined |= item.get("mask") or 0
+            for term in search_terms(item.get("description")):
+                docs[term, item_id] |= SEARCH_FIELD_BITS["description"]
+        terms = set()
+        for (term, item_id), bits in docs.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._add_term(term)
+            postings.setdefault(receipt_id, {})[item_id] = bits
+            terms.add(term)
+        people = tuple(mask_ids(joined))
+        for person_id in people:
+            self._people_receipts[person_id].add(receipt_id)
+        self._receipts[receipt_id] = receipt
+        self._receipt_terms[receipt_id] = terms
+        self._receipt_people[receipt_id] = people
+
+    def remove(self, receipt_id, forget=False):
+        if forget:
+            self._seq.pop(receipt_id, None)
+        if self._receipts.pop(receipt_id, None) is None:
+            return
+        for term in self._receipt_terms.pop(receipt_id):
+            postings = self._postings[term]
+            postings.pop(receipt_id, None)
+            if not postings:
+                del self._postings[term]
+                self._drop_term(term)
+        for person_id in self._receipt_people.pop(receipt_id):
+            self._people_receipts[person_id].discard(receipt_id)
+
+    def update(self, receipt):
+        """Re-index a receipt after its items, participants, supplier or notes changed."""
+        self.add(receipt)
+
+    def _add_term(self, term):
+        bisect.insort(self._vocab, term)
+        if len(term) >= SEARCH_FUZZY_MIN - 1:
+            for variant in term_deletions(term):
+                self._deletes[variant].add(term)
+
+    def _drop_term(self, term):
+        pos = bisect.bisect_left(self._vocab, term)
+        if pos < len(self._vocab) and self._vocab[pos] == term:
+            del self._vocab[pos]
+        if len(term) >= SEARCH_FUZZY_MIN - 1:
+            for variant in term_deletions(term):
+                bucket = self._deletes.get(variant)
+                if bucket is not None:
+                    bucket.discard(term)
+                    if not bucket:
+                        del self._deletes[variant]
+
+    @staticmethod
+    def match_weight(token, term, prefix=True, fuzzy=True):
+        """How well ``term`` matches query ``token``: an exact, prefix or fuzzy weight, or 0."""
+        if term == token:
+            return SEARCH_MATCH_WEIGHTS["exact"]
+        if prefix and len(token) >= SEARCH_PREFIX_MIN and term.startswith(token):
+            return SEARCH_MATCH_WEIGHTS["prefix"]
+        if fuzzy and len(token) >= SEARCH_FUZZY_MIN and within_one_edit(token, term):
+            return SEARCH_MATCH_WEIGHTS["fuzzy"]
+        return 0.0
+
+    def expand(self, token, prefix=True, fuzzy=True):
+        """Index terms matching one folded query token, mapped to their match weight."""
+        matches = {}
+        if token in self._postings:
+            matches[token] = SEARCH_MATCH_WEIGHTS["exact"]
+        if prefix and len(token) >= SEARCH_PREFIX_MIN:
+            vocab = self._vocab
+            pos = bisect.bisect_left(vocab, token)
+            while pos < len(vocab) and len(matches) < SEARCH_MAX_EXPANSIONS and vocab[pos].startswith(token):
+                matches.setdefault(vocab[pos], SEARCH_MATCH_WEIGHTS["prefix"])
+                pos += 1
+        if fuzzy and len(token) >= SEARCH_FUZZY_MIN:
+            candidates = set(self._deletes.get(token, ()))
+            for variant in term_deletions(token):
+                if variant in self._postings:
+                    candidates.add(variant)
+                candidates.update(self._deletes.get(variant, ()))
+            for term in sorted(candidates):
+                if len(matches) >= SEARCH_MAX_EXPANSIONS:
+                    break
+                if term not in matches and within_one_edit(token, term):
+                    matches[term] = SEARCH_MATCH_WEIGHTS["fuzzy"]
+        return matches
+
+    def match_people(self, token, prefix=True, fuzzy=True):
+        """Person ids whose name has a term matching ``token``, mapped to the best match weight."""
+        matches = {}
+        for person_id in range(len(self.people)):
+            weight = max((self.match_weight(token, term, prefix, fuzzy) for term in self._terms_of_person(person_id)), default=0.0)
+            if weight:
+                matches[person_id] = weight
+        return matches
+
+    def _token_hits(self, token, field_mask, weights, prefix, fuzzy):
+        """``{receipt_id: {item_id: (score, bits)}}`` for one query token."""
+        hits = {}
+
+        def record(receipt_id, item_id, score, bits):
+            receipt_hits = hits.get(receipt_id)
+            if receipt_hits is None:
+                receipt_hits = hits[receipt_id] = {}
+            best = receipt_hits.get(item_id)
+            receipt_hits[item_id] = (score, bits) if best is None else (max(score, best[0]), bits | best[1])
+
+        for term, weight in self.expand(token, prefix, fuzzy).items():
+            for receipt_id, docs in self._postings[term].items():
+                for item_id, bits in docs.items():
+                    bits &= field_mask
+                    if bits:
+                        record(receipt_id, item_id, weight * weights[bits], bits)
+        if field_mask & SEARCH_FIELD_BITS["participants"]:
+            bit = SEARCH_FIELD_BITS["participants"]
+            for person_id, weight in self.match_people(token, prefix, fuzzy).items():
+                score = weight * SEARCH_FIELD_WEIGHTS["participants"]
+                flag = 1 << person_id
+                for receipt_id in self._people_receipts.get(person_id, ()):
+                    for item in self._receipts[receipt_id].get("items") or []:
+                        if (item.get("mask") or 0) & flag:
+                            record(receipt_id, item.get("id"), score, bit)
+        return hits
+
+    def search(self, query, fields=None, limit=SEARCH_LIMIT_DEFAULT, prefix=True, fuzzy=True):
+        """
+        Receipts matching every token of ``query``; each token may hit any searched
+        field of the receipt or of one of its items. Returns ``(total, results)``
+        where results are the best ``limit`` ``(score, receipt_id, receipt_bits,
+        items)`` tuples and ``items`` ranks ``(score, item_id, bits)`` for the items
+        that matched at least one token. Ties go to the newest receipt.
+        """
+        field_mask = fields or (1 << len(SEARCH_FIELDS)) - 1
+        weights = [max((SEARCH_FIELD_WEIGHTS[f] for f in field_names(bits)), default=0.0) for bits in range(field_mask + 1)]
+        per_token = []
+        for token in dict.fromkeys(search_terms(query)):
+            hits = self._token_hits(token, field_mask, weights, prefix, fuzzy)
+            if not hits:
+                return 0, []
+            per_token.append(hits)
+        if not per_token:
+            return 0, []
+        per_token.sort(key=len)
+        candidates = set(per_token[0])
+        for hits in per_token[1:]:
+            candidates &= hits.keys()
+        scored = sorted(
+            ((sum(max(score for score, _bits in hits[rid].values()) for hits in per_token), self._seq[rid], rid)
+             for rid in candidates),
+            reverse=True,
+        )
+        results = []
+        for total, _seq, receipt_id in scored[:limit]:
+            receipt_bits = 0
+            items = {}
+            for hits in per_token:
+                for item_id, (score, bits) in hits[receipt_id].items():
+                    if item_id is None:
+                        receipt_bits |= bits
+                        continue
+                    seen = items.get(item_id)
+                    items[item_id] = (score, bits) if seen is None else (seen[0] + score, seen[1] | bits)
+            ranked = sorted(((score, item_id, bits) for item_id, (score, bits) in items.items()), key=lambda hit: -hit[0])
+            results.append((total, receipt_id, receipt_bits, ranked))
+        return len(candidates), results
+
+
+class Trip:
+    """
+    One trip's people and receipts, backed by its own shard file under data/trips/.
+    Callers hold ``trip.lock`` while reading or mutating ``trip.state``.
+    People are append-only, so a person's position in ``people`` is a stable id; item
+    participants are stored as ``mask`` bitsets over those ids and only turned into
+    names by ``receipt_view`` on the way out.
+    """
+
+    def __init__(self, trip_id, path, state):
+        self.id = trip_id
+        self.path = path
+        self.state = state
+        self.lock = threading.RLock()
+        self.person_ids = {name: person_id for person_id, name in enumerate(state["people"])}
+        self.index = ReceiptIndex(state["receipts"])
+        # Bumped on every mutation; receipts keep their encoded JSON until they change.
+        # ``generation`` changes whenever the trip is (re)loaded or its state replaced, so
+        # ETags never repeat and clients know receipt versions started over.
+        self.revision = 0
+        self.generation = uuid.uuid4().hex[:8]
+        self.modified_at = path.stat().st_mtime if path.exists() else time.time()
+        self.stored_bytes = path.stat().st_size if path.exists() else 0
+        self._encoded = {}
+        self._columns = {}
+        self._summary_json = None
+        # Built by the first search, then kept current by _changed()/delete_receipt().
+        self._search = None
+
+    @property
+    def people(self):
+        return self.state["people"]
+
+    @property
+    def receipts(self):
+        return self.state["receipts"]
+
+    def save(self):
+        with track_stage("save_state"):
+            self.stored_bytes = write_json_atomic(self.path, self.state)
+
+    def replace_state(self, state):
+        with self.lock:
+            self.state = state
+            self.person_ids = {name: person_id for person_id, name in enumerate(state["people"])}
+            self.index = ReceiptIndex(state["receipts"])
+            self._encoded.clear()
+            self._columns.clear()
+            self._search = None
+            self.generation = uuid.uuid4().hex[:8]
+            self._changed()
+
+    def _changed(self, receipt=None):
+        """
+        Record a mutation: bump ``receipt``'s version (clients re-render a receipt only
+        when it changes), refresh its indexes and cached encodings, then persist.
+        """
+        self.revision += 1
+        self.modified_at = time.time()
+        self._summary_json = None
+        if receipt is not None:
+            receipt["version"] = receipt.get("version", 0) + 1
+            self.index.update(receipt)
+            if self._search is not None:
+                self._search.update(receipt)
+            self._encoded.pop(receipt.get("id"), None)
+            self._columns.pop(receipt.get("id"), None)
+        self.save()
+
+    @property
+    def etag(self):
+        return f'W/"{self.id}-{self.generation}-{self.revision}"'
+
+    def receipt_view(self, receipt):
+        """The API shape of ``receipt``: item masks become ``participants`` name lists."""
+        people = self.people
+        items = [
+            {**{k: v for k, v in item.items() if k != "mask"}, "participants": mask_names(item.get("mask") or 0, people)}
+            for item in receipt.get("items") or []
+        ]
+        return {**receipt, "version": receipt.get("version", 0), "items": items}
+
+    def encode_receipt(self, receipt):
+        receipt_id = receipt.get("id")
+        encoded = self._encoded.get(receipt_id)
+        METRICS.inc("cache_requests_total", cache="receipt_json", result="miss" if encoded is None else "hit")
+        if encoded is None:
+            # People are append-only, so a cached encoding stays valid when someone joins the trip.
+            encoded = json_dumps(self.receipt_view(receipt))
+            if receipt_id is not None:
+                self._encoded[receipt_id] = encoded
+        return encoded
+
+    def item_columns(self):
+        """ItemColumns for every receipt, rebuilt only for receipts changed since the last call."""
+        parts = []
+        for receipt in self.receipts:
+            receipt_id = receipt.get("id")
+            columns = self._columns.get(receipt_id)
+            if columns is None:
+                columns = ItemColumns.from_items(receipt.get("items") or [], cent_seed(receipt_id))
+                if receipt_id is not None:
+                    self._columns[receipt_id] = columns
+            parts.append(columns)
+        return ItemColumns.concat(parts)
+
+    def find_receipt(self, receipt_id):
+        receipt = self.index.by_id.get(receipt_id)
+        if not receipt:
+            raise ApiError(404, "Receipt not found")
+        return receipt
+
+    def list_receipts(self, params):
+        """
+        Page through receipts. ``params`` is a mapping of query-string values:
+        filters (paid_by, supplier, parser, participant), date_from/date_to on
+        created_at, sort (optionally ``-`` prefixed), cursor, limit and fields.
+        """
+        filters = {field: params[field] for field in RECEIPT_FILTER_FIELDS if params.get(field)}
+        try:
+            limit = int(params.get("limit") or RECEIPT_PAGE_DEFAULT)
+        except (TypeError, ValueError):
+            raise ApiError(400, "Invalid limit")
+        limit = max(1, min(limit, RECEIPT_PAGE_MAX))
+        fields = parse_fields(params.get("fields"))
+        with self.lock:
+            if "participant" in filters:
+                filters["participant"] = self.person_ids.get(filters["participant"], -1)
+            page, next_cursor = self.index.query(
+                filters,
+                sort=params.get("sort") or "created_at",
+                cursor=params.get("cursor"),
+                limit=limit,
+                date_from=params.get("date_from"),
+                date_to=params.get("date_to"),
+            )
+            if fields is None or "items" in fields:
+                page = [self.receipt_view(r) for r in page]
+            receipts = [project_receipt(r, fields) for r in page]
+        return {"receipts": receipts, "next_cursor": next_cursor}
+
+    def search_index(self):
+        """The trip's SearchIndex, built on first use; callers hold ``self.lock``."""
+        if self._search is None:
+            with track_stage("search_index_build"):
+                self._search = SearchIndex(self.receipts, self.people)
+        return self._search
+
+    def search(self, params):
+        """
+        Full-text search (``q``) over item descriptions, participants, supplier and
+        notes. ``fields`` narrows the searched fields, ``prefix=0``/``fuzzy=0`` turn
+        off completion and one-typo matching, ``limit`` caps the receipts returned.
+        """
+        query = (params.get("q") or "").strip()
+        if not query:
+            raise ApiError(400, "Query required")
+        try:
+            limit = int(params.get("limit") or SEARCH_LIMIT_DEFAULT)
+        except (TypeError, ValueError):
+            raise ApiError(400, "Invalid limit")
+        limit = max(1, min(limit, SEARCH_LIMIT_MAX))
+        fields = parse_search_fields(params.get("fields"))
+        prefix = params.get("prefix", "1") not in ("0", "false", "no")
+        fuzzy = params.get("fuzzy", "1") not in ("0", "false", "no")
+        start = time.perf_counter()
+        with self.lock:
+            index = self.search_index()
+            with track_stage("search"):
+                total, hits = index.search(query, fields, limit=limit, prefix=prefix, fuzzy=fuzzy)
+            results = []
+            for score, receipt_id, receipt_bits, item_hits in hits:
+                receipt = self.index.by_id[receipt_id]
+                items = {item.get("id"): item for item in receipt.get("items") or []}
+                results.append({
+                    "receipt": project_receipt(receipt, SEARCH_RECEIPT_FIELDS),
+                    "score": round(score, 4),
+                    "fields": field_names(receipt_bits),
+                    "items": [
+                        {
+                            **project_receipt(items[item_id], SEARCH_ITEM_FIELDS),
+                            "participants": mask_names(items[item_id].get("mask") or 0, self.people),
+                            "score": round(item_score, 4),
+                            "fields": field_names(bits),
+                        }
+                        for item_score, item_id, bits in item_hits
+                        if item_id in items
+                    ],
+                })
+        return {
+            "query": query,
+            "total": total,
+            "results": results,
+            "took_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+
+    def receipt_detail(self, receipt_id, fields=None):
+        """Return the receipt as JSON byte chunks (the full receipt comes from the encoding cache)."""
+        with self.lock:
+            receipt = self.find_receipt(receipt_id)
+            projection = parse_fields(fields, default="full")
+            if projection is None:
+                return [b'{"receipt":', self.encode_receipt(receipt), b"}"]
+            if "items" in projection:
+                receipt = self.receipt_view(receipt)
+            return [json_dumps({"receipt": project_receipt(receipt, projection)})]
+
+    def snapshot_json(self):
+        """
+        The /api/state payload as a list of JSON byte chunks. Receipts are spliced in
+        from their cached encodings and the summary is reused until the next mutation.
+        """
+        with self.lock:
+            METRICS.inc("cache_requests_total", cache="summary_json", result="miss" if self._summary_json is None else "hit")
+            if self._summary_json is None:
+                with track_stage("compute_summary"):
+                    self._summary_json = json_dumps(compute_summary(self.state, self.item_columns()))
+            chunks = [b'{"generation":', json_dumps(self.generation), b',"people":', json_dumps(self.people), b',"receipts":[']
+            for pos, receipt in enumerate(self.receipts):
+                if pos:
+                    chunks.append(b",")
+                chunks.append(self.encode_receipt(receipt))
+            chunks.extend((b'],"summary":', self._summary_json, b"}"))
+            return chunks
+
+    def add_person(self, name):
+        name = (name or "").strip()
+        if not name:
+            raise ApiError(400, "Name required")
+        with self.lock:
+            if name not in self.person_ids:
+                self.person_ids[name] = len(self.people)
+                self.people.append(name)
+                self._changed()
+            return list(self.people)
+
+    def add_receipt(self, receipt):
+        """Store a receipt given in API shape (items with ``participants`` names); returns its API view."""
+        with self.lock:
+            if not receipt.get("paid_by"):
+                receipt["paid_by"] = self.people[0] if self.people else None
+            items = []
+            for item in receipt.get("items") or []:
+                item = dict(item)
+                item["mask"] = people_mask(item.pop("participants", None), self.person_ids)
+                items.append(item)
+            receipt["items"] = items
+            self.receipts.append(receipt)
+            self._changed(receipt)
+            return self.receipt_view(receipt)
+
+    def delete_receipt(self, receipt_id):
+        with self.lock:
+            removed = next((r for r in self.receipts if r.get("id") == receipt_id), None)
+            if removed is None:
+                raise ApiError(404, "Receipt not found")
+            self.state["receipts"] = [r for r in self.receipts if r is not removed]
+            self.index.remove(receipt_id, forget=True)
+            if self._search is not None:
+                self._search.remove(receipt_id, forget=True)
+            self._encoded.pop(receipt_id, None)
+            self._columns.pop(receipt_id, None)
+            self._changed()
+        # The shard no longer references the upload; drop the blob if this was its last receipt.
+        BLOBS.release(removed.get("raw_blob"))
+
+    def blob_refs(self):
+        with self.lock:
+            return [r["raw_blob"] for r in self.receipts if r.get("raw_blob")]
+
+    def migrate_uploads(self, store):
+        """Move this trip's legacy upload files into ``store``; returns the paths to remove."""
+        moved = []
+        with self.lock:
+            for receipt in self.receipts:
+                if receipt.get("raw_blob") or not receipt.get("raw_html_file"):
+                    continue
+                path = upload_path(receipt["raw_html_file"])
+                if path is None:
+                    continue
+                receipt["raw_blob"] = store.put(path.read_bytes())
+                receipt["raw_html_file"] = store.name(receipt["raw_blob"])
+                receipt["version"] = receipt.get("version", 0) + 1
+                self._encoded.pop(receipt.get("id"), None)
+                moved.append(path)
+            if moved:
+                self._changed()
+        return moved
+
+    def set_participants(self, receipt_id, item_id, participants):
+        with self.lock:
+            receipt = self.find_receipt(receipt_id)
+            item = next((i for i in receipt.get("items", []) if i["id"] == item_id), None)
+            if not item:
+                raise ApiError(404, "Item not found")
+            # Unknown names are dropped
+            item["mask"] = people_mask(participants, self.person_ids)
+            self._changed(receipt)
+
+    def set_paid_by(self, receipt_id, paid_by):
+        paid_by = (paid_by or "").strip()
+        with self.lock:
+            receipt = self.find_receipt(receipt_id)
+            if paid_by and paid_by in self.person_ids and receipt.get("paid_by") != paid_by:
+                receipt["paid_by"] = paid_by
+                self._changed(receipt)
+
+    def bulk_participants(self, receipt_id, mode):
+        if mode not in ("all", "none"):
+            raise ApiError(400, "Invalid mode")
+        with self.lock:
+            receipt = self.find_receipt(receipt_id)
+            mask = (1 << len(self.people)) - 1 if mode == "all" else 0
+            for item in receipt.get("items", []):
+                item["mask"] = mask
+            self._changed(receipt)
+
+    def export(self, kind, fmt="csv"):
+        """
+        Start an export: returns ``(content_type, filename, chunks)``. ``chunks`` is a
+        lazy iterator of bytes; it takes the lock for one receipt at a time, so a slow
+        download never holds up writers.
+        """
+        if kind not in EXPORT_COLUMNS:
+            raise ApiError(404, f"Unknown export: {kind}")
+        if fmt not in EXPORT_FORMATS:
+            raise ApiError(400, f"Unsupported export format: {fmt}")
+        columns = EXPORT_COLUMNS[kind]
+        if columns is None and fmt != "jsonl":
+            raise ApiError(400, "The trip export is JSON Lines only (format=jsonl)")
+        chunks = encode_export(self._export_rows(kind, columns), columns, fmt)
+        return EXPORT_FORMATS[fmt], f"{self.id}-{kind}.{fmt}", chunks
+
+    def _export_rows(self, kind, columns):
+        if kind == "balances":
+            with self.lock:
+                summary = compute_summary(self.state, self.item_columns())
+            yield [tuple(person[key] for key in columns) for person in summary]
+            return
+        with self.lock:
+            receipts = list(self.receipts)
+            if kind == "trip":
+                yield [{"type": "trip", "id": self.id, "people": list(self.people)}]
+        for receipt in receipts:
+            with self.lock:
+                receipt_id = receipt.get("id")
+                if receipt_id is not None and self.index.by_id.get(receipt_id) is not receipt:
+                    continue  # deleted (or the state replaced) since the export started
+                if kind == "ledger":
+                    rows = ledger_rows(receipt, self.people)
+                elif kind == "receipts":
+                    header = project_receipt(receipt, columns)
+                    rows = [tuple(header.get(key) for key in columns)]
+                else:
+                    rows = [b'{"type":"receipt","receipt":' + self.encode_receipt(receipt) + b"}"]
+            yield rows
+
+    def import_state(self, raw, mode="replace"):
+        """
+        Restore from a parsed ``trip`` export (see TripImport). ``replace`` swaps the
+        whole state; ``merge`` adds new people and the receipts whose ids are new.
+        Upload blobs are kept only when this server still stores them.
+        """
+        if mode not in IMPORT_MODES:
+            raise ApiError(400, "Invalid mode")
+        with track_stage("import_state"), self.lock:
+            if mode == "merge":
+                state = normalize_state(raw, seed_people=self.people)
+                added = [r for r in state["receipts"] if r.get("id") not in self.index.by_id]
+                state = {"people": state["people"], "receipts": self.receipts + added}
+                released = []
+            else:
+                state = normalize_state(raw, seed_people=DEFAULT_PEOPLE if self.id == DEFAULT_TRIP_ID else ())
+                added = state["receipts"]
+                released = [r.get("raw_blob") for r in self.receipts]
+            retained = BLOBS.retain(r["raw_blob"] for r in added if r.get("raw_blob"))
+            for receipt in added:
+                if receipt.get("raw_blob") and receipt["raw_blob"] not in retained:
+                    receipt["raw_blob"] = receipt["raw_html_file"] = None
+            self.replace_state(state)
+        BLOBS.release(*released)
+        log_event("trip_imported", level=logging.INFO, trip=self.id, mode=mode, receipts=len(added))
+        return {"people": len(state["people"]), "imported": len(added), "skipped": len(raw["receipts"]) - len(added)}
+
+
+class TripStore:
+    """
+    Lazily loads trip shards and keeps at most ``capacity`` of them in memory (LRU).
+    A trip evicted while a request still holds it is found again through ``_live`` so
+    two copies of the same trip are never mutated side by side. Shards are read outside
+    the store lock, so a cold load only holds up requests for that trip; concurrent
+    requests for it wait on its entry in ``_loading`` instead of loading it twice.
+    """
+
+    def __init__(self, trips_dir, index_file, capacity=TRIP_CACHE_SIZE):
+        self.trips_dir = Path(trips_dir)
+        self.index_file = Path(index_file)
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._live = weakref.WeakValueDictionary()
+        self._loading = {}
+
+    def _shard_path(self, trip_id):
+        return self.trips_dir / f"{trip_id}.json"
+
+    def _read_index(self):
+        if not self.index_file.exists():
+            return {}
+        try:
+            raw = read_json_file(self.index_file)
+        except json.JSONDecodeError:
+            log_event("trip_index_invalid", "trip index contained invalid JSON; rebuilding from shards", level=logging.WARNING)
+            raw = {}
+        return raw if isinstance(raw, dict) else {}
+
+    def list_trips(self):
+        ensure_dirs()
+        with self._lock:
+            index = self._read_index()
+            changed = False
+            for shard in self.trips_dir.glob("*.json"):
+                if shard.stem not in index:
+                    index[shard.stem] = {"name": shard.stem, "created_at": None}
+                    changed = True
+            if DEFAULT_TRIP_ID not in index:
+                index[DEFAULT_TRIP_ID] = {"name": "Default trip", "created_at": None}
+                changed = True
+            if changed:
+                write_json_atomic(self.index_file, index)
+        return [{"id": trip_id, **meta} for trip_id, meta in sorted(index.items())]
+
+    def create_trip(self, name="", people=None, trip_id=None):
+        trip_id = trip_id or uuid.uuid4().hex[:8]
+        if not TRIP_ID_RE.match(trip_id):
+            raise ApiError(400, "Invalid trip id")
+        ensure_dirs()
+        with self._lock:
+            if self._shard_path(trip_id).exists():
+                raise ApiError(409, "Trip already exists")
+            index = self._read_index()
+            index[trip_id] = {
+                "name": (name or "").strip() or trip_id,
+                "created_at": dt.datetime.utcnow().isoformat() + "Z",
+            }
+            state = normalize_state({"people": people or []})
+            write_json_atomic(self._shard_path(trip_id), state)
+            write_json_atomic(self.index_file, index)
+        return {"id": trip_id, **index[trip_id]}
+
+    def get(self, trip_id=DEFAULT_TRIP_ID):
+        trip_id = trip_id or DEFAULT_TRIP_ID
+        if not TRIP_ID_RE.match(trip_id):
+            raise ApiError(400, "Invalid trip id")
+        counted = False
+        while True:
+            with self._lock:
+                trip = self._cache.get(trip_id)
+                if not counted:
+                    METRICS.inc("cache_requests_total", cache="trip", result="miss" if trip is None else "hit")
+                    counted = True
+                if trip is not None:
+                    self._cache.move_to_end(trip_id)
+                    return trip
+                trip = self._live.get(trip_id)
+                if trip is not None:
+                    self._insert(trip_id, trip)
+                    return trip
+                loading = self._loading.get(trip_id)
+                if loading is None:
+                    loading = self._loading[trip_id] = threading.Event()
+                    break
+            # Another request is loading this trip; look again once it is done (or failed).
+            loading.wait()
+        try:
+            with track_stage("load_state"):
+                trip = self._load(trip_id)
+            with self._lock:
+                self._insert(trip_id, trip)
+        finally:
+            with self._lock:
+                del self._loading[trip_id]
+            loading.set()
+        return trip
+
+    def _insert(self, trip_id, trip):
+        # Caller holds self._lock.
+        self._cache[trip_id] = trip
+        self._live[trip_id] = trip
+        while len(self._cache) > self.capacity:
+            evicted_id, _evicted = self._cache.popitem(last=False)
+            log_event("trip_evicted", trip=evicted_id)
+
+    def _load(self, trip_id):
+        ensure_dirs()
+        path = self._shard_path(trip_id)
+        raw = None
+        if path.exists():
+            try:
+                raw = read_json_file(path)
+            except json.JSONDecodeError:
+                log_event("trip_shard_invalid", "shard contained invalid JSON; recreating from defaults", level=logging.WARNING, shard=path.name)
+                raw = {}
+        elif trip_id == DEFAULT_TRIP_ID:
+            raw = self._migrate_legacy_state()
+        else:
+            raise ApiError(404, "Trip not found")
+        # The default trip keeps the original crew so existing deployments look unchanged.
+        seed = DEFAULT_PEOPLE if trip_id == DEFAULT_TRIP_ID else ()
+        state = normalize_state(raw, seed_people=seed)
+        trip = Trip(trip_id, path, state)
+        if (not path.exists()) or state != raw:
+            trip.save()
+        log_event("trip_loaded", trip=trip_id, receipts=len(state["receipts"]))
+        return trip
+
+    def _migrate_legacy_state(self):
+        if not DATA_FILE.exists():
+            return {}
+        try:
+            raw = read_json_file(DATA_FILE)
+        except json.JSONDecodeError:
+            log_event("legacy_state_invalid", "legacy state file contained invalid JSON; starting default trip empty", level=logging.WARNING)
+            return {}
+        log_event("legacy_state_migrated", level=logging.INFO, file=DATA_FILE.name, trip=DEFAULT_TRIP_ID)
+        return raw
+
+    def resident(self):
+        with self._lock:
+            return list(self._cache.values())
+
+    def evict_all(self):
+        with self._lock:
+            self._cache.clear()
+
+
+TRIPS = TripStore(TRIPS_DIR, TRIPS_INDEX_FILE)
+
+
+def collect_trip_metrics():
+    trips = TRIPS.resident()
+    yield "trips_loaded", {}, len(trips)
+    for trip in trips:
+        receipts = trip.receipts
+        yield "trip_receipts", {"trip": trip.id}, len(receipts)
+        yield "trip_items", {"trip": trip.id}, sum(len(r.get("items") or []) for r in receipts)
+        yield "trip_state_bytes", {"trip": trip.id}, trip.stored_bytes
+
+
+METRICS.add_collector(collect_trip_metrics)
+
+
+def get_trip(trip_id=DEFAULT_TRIP_ID):
+    return TRIPS.get(trip_id)
+
+
+def load_state(trip_id=DEFAULT_TRIP_ID):
+    """Return the live state dict of a trip (default trip unless given)."""
+    return get_trip(trip_id).state
+
+
+def save_state(state, trip_id=DEFAULT_TRIP_ID):
+    get_trip(trip_id).replace_state(state)
+
+
+TAG_RE = LazyPattern(r"<[^>]+>")
+WHITESPACE_RE = LazyPattern(r"\s+")
+NUMBER_JUNK_RE = LazyPattern(r"[^\d,.\-]")
 
 
 def clean(text):
     if not text:
         return None
-    stripped = re.sub(r"<[^>]+>", "", str(text))
-    stripped = re.sub(r"\s+", " ", stripped).strip()
+    stripped = TAG_RE.sub("", str(text))
+    stripped = WHITESPACE_RE.sub(" ", stripped).strip()
     return stripped or None
 
 
@@ -124,7 +1935,7 @@ def parse_number(text):
         return None
     raw = str(text)
     raw = raw.replace("\xa0", "").replace(" ", "")
-    raw = re.sub(r"[^\d,.\-]", "", raw)
+    raw = NUMBER_JUNK_RE.sub("", raw)
     if not raw:
         return None
     # Handle common formats:
@@ -143,12 +1954,33 @@ def parse_number(text):
         return None
 
 
+def mymarket_field_re(field):
+    return LazyPattern(
+        rf'<span class="field field-{re.escape(field)}[\s\S]*?<span class="value">([\s\S]*?)<\/span>', re.IGNORECASE
+    )
+
+
+MYMARKET_FIELD_RES = {
+    field: mymarket_field_re(field)
+    for field in (
+        "RegisteredName", "Vat", "IssuerFormatedInvoiceSeriesNumber", "DateIssued",
+        "CurrencyCode", "TotalGrossValue", "PaymentMethodType",
+    )
+}
+
+
 def extract_single(field, html):
-    pattern = rf'<span class="field field-{re.escape(field)}[\s\S]*?<span class="value">([\s\S]*?)<\/span>'
-    match = re.search(pattern, html, re.IGNORECASE)
+    pattern = MYMARKET_FIELD_RES.get(field) or MYMARKET_FIELD_RES.setdefault(field, mymarket_field_re(field))
+    match = pattern.search(html)
     return clean(match.group(1)) if match else None
 
 
+MYMARKET_ROW_RE = LazyPattern(r"<tr>[\s\S]*?<\/tr>", re.IGNORECASE)
+MYMARKET_DESCRIPTION_RE = LazyPattern(r"field-Description1[\s\S]*?<span class=\"value\">([\s\S]*?)<\/span>", re.IGNORECASE)
+MYMARKET_QUANTITY_RE = LazyPattern(r"field-Quantity[\s\S]*?<span class=\"value\">([\s\S]*?)<\/span>", re.IGNORECASE)
+MYMARKET_UNIT_PRICE_RE = LazyPattern(r"field-UnitPrice[\s\S]*?<span class=\"value\">([\s\S]*?)<\/span>", re.IGNORECASE)
+
+
 # Parser: Supermarket "MyMarket" (original HTML format)
 def parse_invoice_mymarket(html_text):
     html = html_text or ""
@@ -163,11 +1995,11 @@ def parse_invoice_mymarket(html_text):
         "items": []
     }
 
-    rows = re.findall(r"<tr>[\s\S]*?<\/tr>", html, re.IGNORECASE) or []
+    rows = MYMARKET_ROW_RE.findall(html) or []
     for row in rows:
-        desc = re.search(r"field-Description1[\s\S]*?<span class=\"value\">([\s\S]*?)<\/span>", row, re.IGNORECASE)
-        qty = re.search(r"field-Quantity[\s\S]*?<span class=\"value\">([\s\S]*?)<\/span>", row, re.IGNORECASE)
-        price = re.search(r"field-UnitPrice[\s\S]*?<span class=\"value\">([\s\S]*?)<\/span>", row, re.IGNORECASE)
+        desc = MYMARKET_DESCRIPTION_RE.search(row)
+        qty = MYMARKET_QUANTITY_RE.search(row)
+        price = MYMARKET_UNIT_PRICE_RE.search(row)
         if desc and qty and price:
             quantity = parse_number(clean(qty.group(1)))
             unit_price = parse_number(clean(price.group(1)))
@@ -190,43 +2022,58 @@ def parse_invoice_mymarket(html_text):
     return invoice
 
 
+ENTERSOFT_SUPPLIER_RE = LazyPattern(r'BoldBlueHeader[^>]*>([^<]+)</div>', re.IGNORECASE)
+ENTERSOFT_NUMBER_RE = LazyPattern(r"Αρ\.?\s*Παραστατικού:\s*([^<]+)", re.IGNORECASE)
+ENTERSOFT_DATE_RE = LazyPattern(r"Ημ/νία\s*έκδοσης:\s*([^<]+)", re.IGNORECASE)
+ENTERSOFT_VAT_RE = LazyPattern(r"Α\.?Φ\.?Μ:\s*([0-9]+)", re.IGNORECASE)
+ENTERSOFT_PAYMENT_RE = LazyPattern(r"Τρόπος\s+πληρωμής:[\s\S]*?<div[^>]*>\s*([^<]+)\s*</div>", re.IGNORECASE)
+ENTERSOFT_PAYMENT_ALT_RE = LazyPattern(r"Τρόπος\s+Πληρωμής[\s\S]*?<div[^>]*>\s*([^<]+)\s*</div>", re.IGNORECASE)
+ENTERSOFT_TBODY_RE = LazyPattern(r"<tbody[^>]*>([\s\S]*?)</tbody>", re.IGNORECASE)
+ENTERSOFT_ROW_RE = LazyPattern(r"<tr[^>]*>([\s\S]*?)</tr>", re.IGNORECASE)
+ENTERSOFT_DESCRIPTION_RE = LazyPattern(r'data-title="Περιγραφή"[^>]*>([\s\S]*?)</td>', re.IGNORECASE)
+ENTERSOFT_QUANTITY_RE = LazyPattern(r'data-title="Ποσότητα"[^>]*>([\s\S]*?)</td>', re.IGNORECASE)
+ENTERSOFT_UNIT_PRICE_RE = LazyPattern(r'data-title="Τιμή[^"]*"[^>]*>([\s\S]*?)</td>', re.IGNORECASE)
+ENTERSOFT_LINE_TOTAL_RE = LazyPattern(r'data-title="Συνολική Αξία"[^>]*>([\s\S]*?)</td>', re.IGNORECASE)
+ENTERSOFT_PAYMENT_AMOUNT_RE = LazyPattern(r"Ποσ[όο]\s+Πληρωμής[\s\S]*?<div[^>]*>\s*([0-9.,]+)\s*EUR", re.IGNORECASE)
+
+
 def parse_invoice_entersoft(html_text):
     """Parser for Entersoft-hosted Sklavenitis invoices."""
     html = html_text or ""
     supplier_name = None
-    header_names = re.findall(r'BoldBlueHeader[^>]*>([^<]+)</div>', html, re.IGNORECASE)
+    header_names = ENTERSOFT_SUPPLIER_RE.findall(html)
     for name in header_names:
         supplier_name = clean(name)
         if supplier_name:
             break
     invoice_number = None
-    match_num = re.search(r"Αρ\.?\s*Παραστατικού:\s*([^<]+)", html, re.IGNORECASE)
+    match_num = ENTERSOFT_NUMBER_RE.search(html)
     if match_num:
         invoice_number = clean(match_num.group(1))
     invoice_date = None
-    match_date = re.search(r"Ημ/νία\s*έκδοσης:\s*([^<]+)", html, re.IGNORECASE)
+    match_date = ENTERSOFT_DATE_RE.search(html)
     if match_date:
         invoice_date = clean(match_date.group(1))
     supplier_vat = None
-    match_vat = re.search(r"Α\.?Φ\.?Μ:\s*([0-9]+)", html, re.IGNORECASE)
+    match_vat = ENTERSOFT_VAT_RE.search(html)
     if match_vat:
         supplier_vat = clean(match_vat.group(1))
     payment_method = None
-    match_payment = re.search(r"Τρόπος\s+πληρωμής:[\s\S]*?<div[^>]*>\s*([^<]+)\s*</div>", html, re.IGNORECASE)
+    match_payment = ENTERSOFT_PAYMENT_RE.search(html)
     if not match_payment:
-        match_payment = re.search(r"Τρόπος\s+Πληρωμής[\s\S]*?<div[^>]*>\s*([^<]+)\s*</div>", html, re.IGNORECASE)
+        match_payment = ENTERSOFT_PAYMENT_ALT_RE.search(html)
     if match_payment:
         payment_method = clean(match_payment.group(1))
 
     items = []
-    tbody_match = re.search(r"<tbody[^>]*>([\s\S]*?)</tbody>", html, re.IGNORECASE)
+    tbody_match = ENTERSOFT_TBODY_RE.search(html)
     body_html = tbody_match.group(1) if tbody_match else ""
-    rows = re.findall(r"<tr[^>]*>([\s\S]*?)</tr>", body_html, re.IGNORECASE)
+    rows = ENTERSOFT_ROW_RE.findall(body_html)
     for row in rows:
-        desc = re.search(r'data-title="Περιγραφή"[^>]*>([\s\S]*?)</td>', row, re.IGNORECASE)
-        qty = re.search(r'data-title="Ποσότητα"[^>]*>([\s\S]*?)</td>', row, re.IGNORECASE)
-        price = re.search(r'data-title="Τιμή[^"]*"[^>]*>([\s\S]*?)</td>', row, re.IGNORECASE)
-        total = re.search(r'data-title="Συνολική Αξία"[^>]*>([\s\S]*?)</td>', row, re.IGNORECASE)
+        desc = ENTERSOFT_DESCRIPTION_RE.search(row)
+        qty = ENTERSOFT_QUANTITY_RE.search(row)
+        price = ENTERSOFT_UNIT_PRICE_RE.search(row)
+        total = ENTERSOFT_LINE_TOTAL_RE.search(row)
         description = clean(desc.group(1)) if desc else None
         quantity = parse_number(clean(qty.group(1)) if qty else None)
         unit_price = parse_number(clean(price.group(1)) if price else None)
@@ -247,7 +2094,7 @@ def parse_invoice_entersoft(html_text):
     if items:
         running = sum((it.get("total") or 0) for it in items)
         total_amount = round(running, 2)
-    payment_amount_match = re.search(r"Ποσ[όο]\s+Πληρωμής[\s\S]*?<div[^>]*>\s*([0-9.,]+)\s*EUR", html, re.IGNORECASE)
+    payment_amount_match = ENTERSOFT_PAYMENT_AMOUNT_RE.search(html)
     if payment_amount_match:
         total_amount = parse_number(payment_amount_match.group(1)) or total_amount
 
@@ -283,14 +2130,314 @@ def detect_parser(html_text):
 def parse_invoice(html_text):
     html_clean = ensure_plain_html(html_text or "")
     parser_key = detect_parser(html_clean)
+    METRICS.inc("parser_selected_total", parser=parser_key)
+    profile_label(parser=parser_key)
     parser_fn = PARSERS.get(parser_key, parse_invoice_mymarket)
-    invoice = parser_fn(html_clean or "")
+    with track_stage("parse_invoice"):
+        invoice = parser_fn(html_clean or "")
     invoice["parser"] = parser_key
     return invoice
 
 
-def create_receipt_entry(html_text="", paid_by="", title="", notes="", file_bytes=None):
+class BlobStore:
+    """
+    Content-addressed storage for uploaded receipt sources. Each distinct upload is
+    written once, compressed, to ``<root>/<sha[:2]>/<sha>.zst`` (``.gz`` without the
+    zstandard package). Reference counts (receipts pointing at each blob, plus its
+    original size) are a ``refs.json`` snapshot and an append-only journal of changes
+    (``refs.<seq>.log``), so an upload or delete appends one line instead of rewriting
+    every count. The journal is folded into a new snapshot every ``COMPACT_EVERY``
+    lines and by :meth:`recount`. A blob is deleted when its last reference goes.
+    """
+
+    SUFFIXES = (".zst", ".gz")
+    NAME_RE = LazyPattern(r"^(?P<digest>[0-9a-f]{64})\.html$")
+    CHUNK_BYTES = 64 * 1024
+    COMPACT_EVERY = 1000
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.refs_file = self.root / "refs.json"
+        self._lock = threading.Lock()
+        self._refs = None
+        self._seq = 0
+        self._journal_lines = 0
+
+    @staticmethod
+    def name(digest):
+        """The ``/uploads/`` file name a receipt's ``raw_html_file`` uses for a blob."""
+        return f"{digest}.html"
+
+    def digest_for(self, name):
+        match = self.NAME_RE.match(name or "")
+        return match.group("digest") if match else None
+
+    def _journal_path(self, seq):
+        return self.root / f"refs.{seq}.log"
+
+    def _load_refs(self):
+        # Caller holds self._lock.
+        if self._refs is None:
+            try:
+                raw = read_json_file(self.refs_file)
+            except FileNotFoundError:
+                raw = {}
+            except json.JSONDecodeError:
+                log_event("blob_refs_invalid", "blob refcounts contained invalid JSON; they are recounted at startup", level=logging.WARNING)
+                raw = {}
+            raw = raw if isinstance(raw, dict) else {}
+            if isinstance(raw.get("blobs"), dict):
+                self._refs, self._seq = raw["blobs"], int(raw.get("seq") or 0)
+            else:
+                # A plain digest -> entry mapping predates the journal.
+                self._refs, self._seq = raw, 0
+            self._journal_lines = self._replay(self._journal_path(self._seq))
+        return self._refs
+
+    def _replay(self, path):
+        """Apply the journal at ``path`` to ``self._refs``; returns its line count."""
+        try:
+            with path.open("rb") as fh:
+                lines = fh.read().splitlines()
+        except FileNotFoundError:
+            return 0
+        for line in lines:
+            try:
+                digest, delta, *created = json_loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            self._apply(digest, delta, created)
+        return len(lines)
+
+    def _apply(self, digest, delta, created=()):
+        # Caller holds self._lock. ``created`` is (size, stored) for a newly written blob.
+        entry = self._refs.get(digest)
+        if created:
+            entry = {"refs": 0, "size": created[0], "stored": created[1]}
+        if entry is None:
+            return None
+        entry["refs"] += delta
+        if entry["refs"] > 0:
+            self._refs[digest] = entry
+        else:
+            self._refs.pop(digest, None)
+        return entry
+
+    def _journal(self, records):
+        """Append ``[digest, delta(, size, stored)]`` records; compacts a long journal."""
+        # Caller holds self._lock.
+        if not records:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._journal_path(self._seq).open("ab") as fh:
+            fh.write(b"".join(json_dumps(record) + b"\n" for record in records))
+        self._journal_lines += len(records)
+        if self._journal_lines >= self.COMPACT_EVERY:
+            self._save_refs()
+
+    def _save_refs(self):
+        """Write a snapshot under a new journal sequence, then drop the folded journal."""
+        # Caller holds self._lock. A crash before the unlink leaves an old journal that
+        # the new snapshot's sequence number no longer points at, so it is never replayed.
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._seq += 1
+        write_json_atomic(self.refs_file, {"seq": self._seq, "blobs": self._refs})
+        self._journal_lines = 0
+        current = self._journal_path(self._seq).name
+        for path in self.root.glob("refs.*.log"):
+            if path.name != current:
+                path.unlink(missing_ok=True)
+
+    def _path(self, digest, suffix):
+        return self.root / digest[:2] / f"{digest}{suffix}"
+
+    def locate(self, digest):
+        """``(path, suffix)`` of the stored blob, or None."""
+        for suffix in self.SUFFIXES:
+            path = self._path(digest, suffix)
+            if path.is_file():
+                return path, suffix
+        return None
+
+    @staticmethod
+    def _encode(data):
+        with track_stage("blob_compress"):
+            if zstandard is not None:
+                return zstandard.ZstdCompressor(level=10).compress(data), ".zst"
+            return gzip.compress(data, compresslevel=6, mtime=0), ".gz"
+
+    def put(self, data):
+        """Store ``data`` unless an identical blob exists, add a reference, and return the digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            exists = digest in self._load_refs() and self.locate(digest) is not None
+        # Compress and write outside the lock; the file name is the content hash, so a
+        # concurrent identical upload at worst writes the same bytes twice.
+        encoded = None if exists else self._write(digest, data)
+        with self._lock:
+            entry = self._load_refs().get(digest)
+            written = entry is None or self.locate(digest) is None
+            if written:
+                # Also covers a blob deleted by a release() since the check above.
+                encoded = encoded if encoded and self.locate(digest) else self._write(digest, data)
+                entry = self._apply(digest, 1, (len(data), len(encoded)))
+                self._journal([[digest, 1, len(data), len(encoded)]])
+            else:
+                entry = self._apply(digest, 1)
+                self._journal([[digest, 1]])
+        METRICS.inc("blob_puts_total", result="stored" if written else "deduplicated")
+        log_event("blob_put", digest=digest[:12], size=len(data), stored=entry["stored"], refs=entry["refs"])
+        return digest
+
+    def _write(self, digest, data):
+        encoded, suffix = self._encode(data)
+        path = self._path(digest, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:6]}.tmp")
+        tmp_path.write_bytes(encoded)
+        os.replace(tmp_path, path)
+        return encoded
+
+    def retain(self, digests):
+        """Add a reference to each stored blob in ``digests``; returns the set that exists."""
+        records = []
+        with self._lock:
+            refs = self._load_refs()
+            for digest in digests:
+                if refs.get(digest) is None or self.locate(digest) is None:
+                    continue
+                self._apply(digest, 1)
+                records.append([digest, 1])
+            self._journal(records)
+        return {digest for digest, _delta in records}
+
+    def release(self, *digests):
+        """Drop one reference per digest; a blob is deleted when none remain."""
+        digests = [digest for digest in digests if digest]
+        if not digests:
+            return
+        records = []
+        with self._lock:
+            refs = self._load_refs()
+            for digest in digests:
+                if refs.get(digest) is None:
+                    continue
+                if self._apply(digest, -1)["refs"] <= 0:
+                    self._unlink(digest)
+                records.append([digest, -1])
+            self._journal(records)
+
+    def _unlink(self, digest):
+        located = self.locate(digest)
+        if located is not None:
+            located[0].unlink(missing_ok=True)
+            METRICS.inc("blob_deletes_total")
+            log_event("blob_deleted", digest=digest[:12])
+
+    def size(self, digest):
+        """Original (decompressed) size, or None for an unknown blob."""
+        with self._lock:
+            entry = self._load_refs().get(digest)
+        return entry["size"] if entry else None
+
+    def open(self, digest):
+        """A binary file object over the original bytes, decompressed as it is read."""
+        located = self.locate(digest)
+        if located is None:
+            raise FileNotFoundError(digest)
+        path, suffix = located
+        if suffix == ".gz":
+            return gzip.open(path, "rb")
+        if zstandard is None:
+            raise ApiError(500, "zstandard is required to read this upload")
+        return zstandard.ZstdDecompressor().stream_reader(path.open("rb"), closefd=True)
+
+    def read(self, digest):
+        with self.open(digest) as fh:
+            return fh.read()
+
+    @classmethod
+    def iter_chunks(cls, fh, count=None):
+        """Read ``fh`` in CHUNK_BYTES pieces, stopping after ``count`` bytes when given."""
+        remaining = count
+        while remaining is None or remaining > 0:
+            data = fh.read(cls.CHUNK_BYTES if remaining is None else min(cls.CHUNK_BYTES, remaining))
+            if not data:
+                return
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+    def recount(self, counts):
+        """
+        Replace the reference counts with ``counts`` (digest -> receipts) and delete
+        every stored blob nobody references. Returns the number of blobs deleted.
+        """
+        removed = 0
+        with self._lock:
+            refs = self._load_refs()
+            for path in self.root.glob("??/*"):
+                if path.name.startswith(".") or path.name.partition(".")[0] in counts:
+                    continue
+                path.unlink(missing_ok=True)
+                removed += 1
+            for digest in list(refs):
+                if digest not in counts:
+                    del refs[digest]
+            for digest, count in counts.items():
+                entry = refs.get(digest)
+                located = self.locate(digest)
+                if located is None:
+                    refs.pop(digest, None)
+                    continue
+                if entry is None:
+                    with self.open(digest) as fh:
+                        size = sum(len(chunk) for chunk in iter(lambda: fh.read(self.CHUNK_BYTES), b""))
+                    entry = {"refs": 0, "size": size, "stored": located[0].stat().st_size}
+                entry["refs"] = count
+                refs[digest] = entry
+            self._save_refs()
+        return removed
+
+
+BLOBS = BlobStore(BLOB_DIR)
+
+
+def upload_path(name):
+    """Resolve a legacy ``/uploads/`` file name inside UPLOAD_DIR, or None."""
+    root = UPLOAD_DIR.resolve()
+    path = (root / (name or "").lstrip("/")).resolve()
+    if root not in path.parents or not path.is_file():
+        return None
+    return path
+
+
+def migrate_uploads():
+    """
+    Move legacy ``uploads/receipt-<id>.html`` files into BLOBS, point their receipts
+    at the blobs, then recount blob references from every trip and delete blobs no
+    receipt uses. Runs at every startup, before requests are served: the recount also
+    repairs references leaked by a crash between ``BLOBS.put`` and the shard save.
+    """
+    legacy = any(UPLOAD_DIR.glob("receipt-*.html"))
+    moved = []
+    counts = defaultdict(int)
+    for meta in TRIPS.list_trips():
+        trip = get_trip(meta["id"])
+        if legacy:
+            moved.extend(trip.migrate_uploads(BLOBS))
+        for digest in trip.blob_refs():
+            counts[digest] += 1
+    removed = BLOBS.recount(counts)
+    for path in set(moved):
+        path.unlink(missing_ok=True)
+    log_event("uploads_migrated", level=logging.INFO, files=len(set(moved)), blobs=len(counts), orphans_removed=removed)
+    return {"files": len(set(moved)), "blobs": len(counts), "orphans_removed": removed}
+
+
+def create_receipt_entry(html_text="", paid_by="", title="", notes="", file_bytes=None, trip_id=DEFAULT_TRIP_ID):
     ensure_dirs()
+    trip = get_trip(trip_id)
     if isinstance(html_text, bytes):
         try:
             html_text = html_text.decode("utf-8", errors="ignore")
@@ -298,19 +2445,18 @@ def create_receipt_entry(html_text="", paid_by="", title="", notes="", file_byte
             html_text = ""
     invoice = parse_invoice(html_text or "")
     receipt_id = uuid.uuid4().hex[:8]
+    profile_label(receipt=receipt_id)
     filename_saved = None
+    blob = None
     if file_bytes:
-        filename_saved = f"receipt-{receipt_id}.html"
-        with (UPLOAD_DIR / filename_saved).open("wb") as fh:
-            fh.write(file_bytes)
+        blob = BLOBS.put(file_bytes)
+        filename_saved = BLOBS.name(blob)
 
-    state = load_state()
-    paid_by_final = paid_by or (state["people"][0] if state["people"] else None)
     receipt = {
         "id": receipt_id,
         "title": (title or "").strip() or invoice.get("invoice_number") or f"Receipt {dt.date.today()}",
         "supplier": invoice.get("supplier_name"),
-        "paid_by": paid_by_final,
+        "paid_by": paid_by or None,
         "currency": invoice.get("currency") or "EUR",
         "total_amount": invoice.get("total_amount") or 0,
         "items": invoice.get("items", []),
@@ -318,11 +2464,195 @@ def create_receipt_entry(html_text="", paid_by="", title="", notes="", file_byte
         "notes": (notes or "").strip(),
         "parser": invoice.get("parser"),
         "raw_html_file": filename_saved,
+        "raw_blob": blob,
         "created_at": dt.datetime.utcnow().isoformat() + "Z",
     }
-    state["receipts"].append(receipt)
-    save_state(state)
-    return receipt
+    try:
+        return trip.add_receipt(receipt)
+    except Exception:
+        BLOBS.release(blob)
+        raise
+
+
+class CircuitOpenError(urllib.error.URLError):
+    """
+    An outbound call skipped without touching the network, because the host's breaker
+    is open or the same call failed moments ago. Subclasses URLError so existing
+    network-error handling applies unchanged.
+    """
+
+    def __init__(self, host, retry_after, reason="circuit open"):
+        super().__init__(f"{reason} for {host} (retry in {max(1, math.ceil(retry_after))}s)")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Failure-rate breaker for one host. ``closed``: calls go through and outcomes are
+    kept for ``window`` seconds; once at least ``min_calls`` of them failed at
+    ``failure_rate`` or more it turns ``open`` and rejects calls for ``cooldown``
+    seconds. Then it is ``half_open``: one trial call is let through, and its outcome
+    closes the breaker or opens it for another cooldown.
+    """
+
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, host, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_rate=BREAKER_FAILURE_RATE, cooldown=BREAKER_COOLDOWN, clock=time.monotonic):
+        self.host = host
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._outcomes = deque()
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(self.clock())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def before_call(self):
+        """Admit a call or raise :class:`CircuitOpenError`."""
+        with self._lock:
+            now = self.clock()
+            state = self._state(now)
+            if state == "open":
+                raise CircuitOpenError(self.host, self._opened_at + self.cooldown - now)
+            if state == "half_open":
+                if self._trial_running:
+                    raise CircuitOpenError(self.host, self.cooldown, reason="circuit half-open, trial in flight")
+                self._trial_running = True
+
+    def record(self, ok):
+        with self._lock:
+            now = self.clock()
+            if self._opened_at is not None:
+                # Outcome of the half-open trial (or a call admitted before the breaker opened).
+                if self._trial_running:
+                    self._trial_running = False
+                    self._outcomes.clear()
+                    self._opened_at = None if ok else now
+                    log_event("breaker_trial", level=logging.INFO, host=self.host, ok=ok)
+                return
+            self._outcomes.append((now, ok))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _t, good in self._outcomes if not good)
+            if not ok and failures >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+                self._opened_at = now
+                log_event("breaker_opened", level=logging.WARNING, host=self.host, failures=failures, calls=len(self._outcomes))
+
+
+class OutboundGuard:
+    """
+    Per-host :class:`CircuitBreaker` registry plus a negative cache of calls that
+    failed within the last ``negative_ttl`` seconds. Wrap each outbound call in
+    :meth:`call`; network errors (and 5xx responses) count as failures.
+    """
+
+    NEGATIVE_CACHE_SIZE = 256
+
+    def __init__(self, fail_fast=OUTBOUND_FAIL_FAST, negative_ttl=NEGATIVE_CACHE_TTL, clock=time.monotonic):
+        self.fail_fast = fail_fast
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._failures = OrderedDict()
+
+    def breaker(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                min_calls = 1 if self.fail_fast else BREAKER_MIN_CALLS
+                breaker = self._breakers[host] = CircuitBreaker(host, min_calls=min_calls, clock=self.clock)
+            return breaker
+
+    def timeout(self, timeout):
+        return min(timeout, OUTBOUND_FAST_TIMEOUT) if self.fail_fast else timeout
+
+    def states(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.host: breaker.state for breaker in breakers}
+
+    def reset(self):
+        with self._lock:
+            self._breakers.clear()
+            self._failures.clear()
+
+    def _recent_failure(self, key, now):
+        with self._lock:
+            expires = self._failures.get(key)
+            if expires is not None and expires <= now:
+                del self._failures[key]
+                expires = None
+            return expires
+
+    def _remember_failure(self, key, now):
+        if self.negative_ttl <= 0:
+            return
+        with self._lock:
+            self._failures[key] = now + self.negative_ttl
+            self._failures.move_to_end(key)
+            while len(self._failures) > self.NEGATIVE_CACHE_SIZE:
+                self._failures.popitem(last=False)
+
+    @contextlib.contextmanager
+    def call(self, url, target, key=None):
+        """Guard one outbound call to ``url``; ``key`` names it in the negative cache (default: url)."""
+        host = urllib.parse.urlsplit(url).hostname or url
+        key = key or url
+        now = self.clock()
+        expires = self._recent_failure(key, now)
+        if expires is not None:
+            METRICS.inc("outbound_short_circuit_total", target=target, reason="negative_cache")
+            raise CircuitOpenError(host, expires - now, reason="recent failure")
+        breaker = self.breaker(host)
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            METRICS.inc("outbound_short_circuit_total", target=target, reason="circuit_open")
+            raise
+        try:
+            yield
+        except urllib.error.HTTPError as e:
+            breaker.record(e.code < 500)
+            if e.code >= 500:
+                self._remember_failure(key, self.clock())
+            raise
+        except OSError:
+            # URLError, timeouts and resets mid-read all derive from OSError.
+            breaker.record(False)
+            self._remember_failure(key, self.clock())
+            raise
+        except BaseException:
+            breaker.record(True)
+            raise
+        breaker.record(True)
+
+
+OUTBOUND = OutboundGuard()
+
+
+def collect_outbound_metrics():
+    for host, state in OUTBOUND.states().items():
+        yield "outbound_breaker_state", {"host": host}, CircuitBreaker.STATES[state]
+
+
+METRICS.add_collector(collect_outbound_metrics)
 
 
 def post_qr_for_data(file_bytes, filename="qr.png", timeout=10):
@@ -341,6 +2671,8 @@ def post_qr_for_data(file_bytes, filename="qr.png", timeout=10):
     # close
     body.append(f"--{boundary}--\r\n".encode("utf-8"))
     payload = b"".join(body)
+    import urllib.request
+
     req = urllib.request.Request(
         QR_API,
         data=payload,
@@ -350,21 +2682,31 @@ def post_qr_for_data(file_bytes, filename="qr.png", timeout=10):
             "User-Agent": "trip-splitter/1.0",
         },
     )
+    # The same image failing again right away is not worth another full timeout.
+    guard_key = f"{QR_API}#{hashlib.sha256(file_bytes).hexdigest()}"
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
+        with OUTBOUND.call(QR_API, "qr_api", key=guard_key), track_stage("post_qr_for_data"), \
+                urllib.request.urlopen(req, timeout=OUTBOUND.timeout(timeout)) as resp:
             raw = resp.read()
-            debug(f"qr api status={getattr(resp, 'status', None)} len={len(raw) if raw else 0}")
+            log_event("qr_api_response", status=getattr(resp, "status", None), length=len(raw) if raw else 0)
+        METRICS.inc("outbound_requests_total", target="qr_api", result="ok")
+    except CircuitOpenError as e:
+        METRICS.inc("outbound_requests_total", target="qr_api", result="skipped")
+        log_event("qr_api_skipped", level=logging.WARNING, error=str(e))
+        raise
     except urllib.error.HTTPError as e:
+        METRICS.inc("outbound_requests_total", target="qr_api", result="error")
         body = e.read() if hasattr(e, "read") else b""
-        debug(f"qr api HTTPError status={getattr(e, 'code', None)} reason={getattr(e, 'reason', None)} body={body[:200]!r}")
+        log_event("qr_api_http_error", level=logging.WARNING, status=getattr(e, "code", None), reason=getattr(e, "reason", None), body=body[:200])
         raise
     except urllib.error.URLError as e:
-        debug(f"qr api URLError {e}")
+        METRICS.inc("outbound_requests_total", target="qr_api", result="error")
+        log_event("qr_api_url_error", level=logging.WARNING, error=str(e))
         raise
     try:
         decoded = json.loads(raw.decode("utf-8", errors="ignore"))
     except Exception as e:
-        debug(f"qr api decode error: {e} raw={raw[:200]!r}")
+        log_event("qr_api_bad_json", level=logging.WARNING, error=str(e), raw=raw[:200])
         raise
     # expected structure: [{ symbol: [{ data: "..." }]}]
     data = None
@@ -384,12 +2726,12 @@ def decode_qr_locally(file_bytes):
         from PIL import Image, ImageOps  # type: ignore
         from pyzbar.pyzbar import decode as zbar_decode  # type: ignore
     except ImportError:
-        debug("qr decode local: optional deps (Pillow/pyzbar) not installed")
+        log_event("qr_local_unavailable", "optional deps (Pillow/pyzbar) not installed", sample=100)
         return None, "missing dependencies"
     try:
         img = Image.open(BytesIO(file_bytes))
     except Exception as e:
-        debug(f"qr decode local: failed to open image: {e}")
+        log_event("qr_local_open_failed", error=str(e))
         return None, f"open error: {e}"
     variants = []
     # Base variants: RGB, grayscale autocontrast, hard-threshold
@@ -428,41 +2770,202 @@ def decode_qr_locally(file_bytes):
         try:
             results = zbar_decode(candidate)
         except Exception as e:
-            debug(f"qr decode local: zbar decode raised {e} on {label}")
+            log_event("qr_local_variant_error", sample=20, variant=label, error=str(e))
             continue
         count = len(results) if results else 0
         attempts.append(f"{label}:{count}")
         if results:
             data_bytes = getattr(results[0], "data", b"") or b""
             decoded = data_bytes.decode("utf-8", errors="ignore")
-            debug(f"qr decode local: success variant={label} size={candidate.size} symbols={count} payload_len={len(decoded)}")
+            METRICS.inc("qr_variant_success_total", variant=label.split("-w")[0], resized="-w" in label)
+            log_event("qr_local_success", level=logging.INFO, variant=label, size=candidate.size, symbols=count, payload_len=len(decoded))
             return decoded, None
-    debug(f"qr decode local: no QR symbols found after variants {attempts}")
+    log_event("qr_local_no_symbols", attempts=lambda: ",".join(attempts))
     return None, "no qr found"
 
 
+def decode_qr_builtin(file_bytes):
+    """
+    Decode with the pure-Python decoder in qrdecode.py (NumPy-accelerated when
+    installed). Returns tuple of (data_str or None, error_reason or None).
+    """
+    import qrdecode
+
+    try:
+        return qrdecode.decode(file_bytes), None
+    except qrdecode.QRDecodeError as e:
+        log_event("qr_builtin_failed", sample=20, error=str(e))
+        return None, str(e)
+    except Exception as e:
+        # A malformed image must not take the remote fallback down with it.
+        log_event("qr_builtin_error", level=logging.WARNING, error=repr(e))
+        return None, f"decoder error: {e}"
+
+
 def decode_qr_best_effort(file_bytes, filename="qr.png"):
     """
-    Try local QR decode first (Pillow/pyzbar). Fall back to remote API if needed.
-    Returns tuple: (decoded_data or None, source: 'local'|'remote'|None, local_error or None)
+    Try local QR decode first (Pillow/pyzbar), then the built-in decoder, and fall
+    back to the remote API if both fail.
+    Returns tuple: (decoded_data or None, source: 'local'|'builtin'|'remote'|'remote_skipped'|'remote_error'|None, local_error or None).
+    'remote_skipped' means the API's circuit breaker (or negative cache) refused the
+    call; ``local_error`` then ends with the reason and retry time. 'remote_error'
+    means the call failed with a network error, whose reason ends ``local_error``.
     """
     decoded_data = None
     decode_source = None
     local_err = None
-    local_data, local_err = decode_qr_locally(file_bytes)
+    with track_stage("decode_qr_locally"):
+        local_data, local_err = decode_qr_locally(file_bytes)
+    METRICS.inc("qr_decode_total", source="local", result="ok" if local_data else "fail")
     if local_data:
+        profile_label(qr_source="local")
         return local_data, "local", local_err
-    debug(f"qr decode: local decode unavailable/failed ({local_err}); will try remote API")
-    decoded_data = post_qr_for_data(file_bytes, filename=filename)
+    with track_stage("decode_qr_builtin"):
+        builtin_data, builtin_err = decode_qr_builtin(file_bytes)
+    METRICS.inc("qr_decode_total", source="builtin", result="ok" if builtin_data else "fail")
+    if builtin_data:
+        profile_label(qr_source="builtin", qr_local_error=local_err)
+        log_event("qr_decoded", level=logging.INFO, source="builtin", local_error=local_err, preview=lambda: builtin_data[:120])
+        return builtin_data, "builtin", local_err
+    local_err = f"{local_err}; builtin: {builtin_err}" if local_err else f"builtin: {builtin_err}"
+    profile_label(qr_source="remote", qr_local_error=local_err)
+    log_event("qr_local_fallback", "local decode unavailable/failed; will try remote API", local_error=local_err)
+    try:
+        decoded_data = post_qr_for_data(file_bytes, filename=filename)
+    except CircuitOpenError as e:
+        # Answer at once instead of waiting out a timeout the breaker expects to hit.
+        METRICS.inc("qr_decode_total", source="remote", result="skipped")
+        local_err = f"{local_err}; remote skipped: {e.reason}" if local_err else f"remote skipped: {e.reason}"
+        profile_label(qr_source="remote_skipped", qr_local_error=local_err)
+        return None, "remote_skipped", local_err
+    except urllib.error.URLError as e:
+        METRICS.inc("qr_decode_total", source="remote", result="error")
+        local_err = f"{local_err}; remote: {e.reason}" if local_err else f"remote: {e.reason}"
+        profile_label(qr_source="remote_error", qr_local_error=local_err)
+        return None, "remote_error", local_err
+    except Exception:
+        METRICS.inc("qr_decode_total", source="remote", result="error")
+        raise
     decode_source = "remote"
-    debug(f"qr decoded data preview={str(decoded_data)[:120]!r} source={decode_source}")
+    METRICS.inc("qr_decode_total", source="remote", result="ok" if decoded_data else "fail")
+    log_event(
+        "qr_decoded",
+        level=logging.INFO,
+        source=decode_source,
+        local_error=local_err,
+        preview=lambda: str(decoded_data)[:120],
+    )
     return decoded_data, decode_source, local_err
 
 
-def extract_html_from_mhtml(raw_bytes):
+MHTML_HEADER_END_RE = LazyPattern(rb"\n\r?\n")
+
+
+def _mime_headers(block):
+    """Unfold a raw MIME header block into ``{lower-cased name: value}``; the first occurrence wins."""
+    headers = {}
+    name = None
+    for line in block.decode("latin-1").splitlines():
+        if line[:1] in (" ", "\t"):
+            if name:
+                headers[name] += " " + line.strip()
+            continue
+        key, sep, value = line.partition(":")
+        key = key.strip().lower()
+        name = key if sep and key not in headers else None
+        if name:
+            headers[name] = value.strip()
+    return headers
+
+
+def scan_mhtml_parts(raw_bytes):
+    """
+    Yield ``(headers, start, end)`` for each body part of an MHTML blob, where
+    ``raw_bytes[start:end]`` is the still-encoded body. Only header blocks are parsed;
+    bodies are skipped by searching for the next boundary line.
+    """
+    match = MHTML_HEADER_END_RE.search(raw_bytes)
+    if not match:
+        return
+    top = _mime_headers(raw_bytes[:match.start()])
+    ctype, params = parse_header_params(top.get("content-type", ""))
+    boundary = params.get("boundary")
+    if not ctype.startswith("multipart/") or not boundary:
+        yield top, match.end(), len(raw_bytes)
+        return
+    delimiter = b"--" + boundary.encode("latin-1")
+    pos = raw_bytes.find(delimiter, match.start())
+    while pos != -1:
+        pos += len(delimiter)
+        if raw_bytes.startswith(b"--", pos):
+            return
+        line_end = raw_bytes.find(b"\n", pos)
+        if line_end == -1:
+            return
+        match = MHTML_HEADER_END_RE.search(raw_bytes, line_end)
+        if not match:
+            return
+        headers = _mime_headers(raw_bytes[line_end + 1:match.start()])
+        start = match.end()
+        pos = raw_bytes.find(b"\n" + delimiter, start - 1)
+        if pos == -1:
+            yield headers, start, len(raw_bytes)
+            return
+        end = pos - 1 if raw_bytes[pos - 1:pos] == b"\r" else pos
+        yield headers, start, max(start, end)
+        pos += 1
+
+
+def decode_mime_body(body, headers):
+    """Undo the part's Content-Transfer-Encoding and charset; None if it cannot be decoded."""
+    encoding = headers.get("content-transfer-encoding", "").strip().lower()
+    try:
+        if encoding == "quoted-printable":
+            body = binascii.a2b_qp(body)
+        elif encoding == "base64":
+            body = binascii.a2b_base64(body)
+    except binascii.Error:
+        return None
+    charset = parse_header_params(headers.get("content-type", ""))[1].get("charset") or "utf-8"
+    try:
+        return body.decode(charset)
+    except (LookupError, UnicodeDecodeError):
+        return body.decode("utf-8", errors="ignore")
+
+
+def extract_html_from_mhtml(raw_bytes):
+    """
+    Extract the largest text/html part from an MHTML (multipart/related) blob.
+    Parts are located with :func:`scan_mhtml_parts`, so embedded images and
+    stylesheets are never decoded; only the chosen part is. Falls back to the
+    email package when the scan finds no usable HTML part. Returns HTML string or None.
+    """
+    best = None
+    found = 0
+    try:
+        for headers, start, end in scan_mhtml_parts(raw_bytes):
+            if parse_header_params(headers.get("content-type", ""))[0] != "text/html":
+                continue
+            found += 1
+            if best is None or end - start > best[2] - best[1]:
+                best = (headers, start, end)
+    except Exception as e:
+        log_event("mhtml_scan_failed", level=logging.WARNING, error=str(e))
+        best = None
+    if best is not None:
+        html = decode_mime_body(raw_bytes[best[1]:best[2]], best[0])
+        if html:
+            log_event("mhtml_html_parts", found=found, using_len=len(html))
+            return html
+    return extract_html_from_mhtml_email(raw_bytes)
+
+
+def extract_html_from_mhtml_email(raw_bytes):
     """
-    Attempt to extract the first text/html part from an MHTML (multipart/related) blob.
-    Returns HTML string or None.
+    Reference implementation on top of the email package: builds the whole message
+    tree (decoding every part it touches) and returns the largest text/html part.
+    Kept as the fallback for snapshots the boundary scanner cannot handle, and as
+    the baseline in bench/micro.py.
     """
     def _decode_part(part):
         payload = part.get_payload(decode=True)
@@ -477,19 +2980,22 @@ def extract_html_from_mhtml(raw_bytes):
             except Exception:
                 return None
 
+    from email import message_from_bytes, policy
+
     try:
         msg = message_from_bytes(raw_bytes, policy=policy.default)
     except Exception as e:
-        debug(f"mhtml parse failed: {e}")
+        log_event("mhtml_parse_failed", level=logging.WARNING, error=str(e))
         return None
 
     best_html = None
     best_len = -1
+    found = 0
     try:
-        parts = list(msg.walk()) if msg.is_multipart() else [msg]
-        for part in parts:
+        for part in msg.walk() if msg.is_multipart() else [msg]:
             if part.get_content_type() != "text/html":
                 continue
+            found += 1
             decoded = _decode_part(part)
             if decoded:
                 dlen = len(decoded)
@@ -497,10 +3003,10 @@ def extract_html_from_mhtml(raw_bytes):
                     best_len = dlen
                     best_html = decoded
         if best_html:
-            debug(f"mhtml html parts found={len([p for p in parts if p.get_content_type()=='text/html'])} using_len={best_len}")
+            log_event("mhtml_html_parts", found=found, using_len=best_len)
             return best_html
     except Exception as e:
-        debug(f"mhtml walk failed: {e}")
+        log_event("mhtml_walk_failed", level=logging.WARNING, error=str(e))
         return None
     return best_html
 
@@ -521,12 +3027,15 @@ def ensure_plain_html(html_input):
     if looks_mhtml:
         extracted = extract_html_from_mhtml(raw_bytes)
         if extracted:
-            debug(f"mhtml detected -> extracted html len={len(extracted)}")
+            log_event("mhtml_extracted", length=len(extracted))
             return extracted
-        debug("mhtml detected but html extraction failed; falling back to raw text")
+        log_event("mhtml_extract_failed", "mhtml detected but html extraction failed; falling back to raw text", level=logging.WARNING)
     return hint
 
 
+ENTERSOFT_IFRAME_RE = LazyPattern(r'<iframe[^>]+src=["\']([^"\']*GetInvoice[^"\']+)["\']', re.IGNORECASE)
+
+
 def maybe_follow_entersoft_iframe(html_text, url, timeout=10):
     """
     Entersoft invoices load the real document inside an iframe. When we fetch the outer
@@ -537,21 +3046,22 @@ def maybe_follow_entersoft_iframe(html_text, url, timeout=10):
     lower = html_text.lower()
     if "getinvoice" not in lower or ("entersoft" not in lower and "e-invoicing" not in lower):
         return html_text
-    match = re.search(r'<iframe[^>]+src=["\']([^"\']*GetInvoice[^"\']+)["\']', html_text, re.IGNORECASE)
+    match = ENTERSOFT_IFRAME_RE.search(html_text)
     if not match:
         return html_text
     iframe_src = html_lib.unescape(match.group(1))
     iframe_url = urllib.parse.urljoin(url, iframe_src)
     try:
-        inner_html = fetch_html(iframe_url, timeout=timeout, follow_entersoft=False)
+        with track_stage("follow_entersoft_iframe"):
+            inner_html = fetch_html(iframe_url, timeout=timeout, follow_entersoft=False)
         if inner_html:
-            debug(f"fetch_html entersoft iframe resolved url={iframe_url} len={len(inner_html)}")
+            log_event("fetch_iframe_resolved", url=iframe_url, length=len(inner_html))
             return inner_html
-        debug(f"fetch_html entersoft iframe empty content url={iframe_url}")
+        log_event("fetch_iframe_empty", level=logging.WARNING, url=iframe_url)
     except urllib.error.URLError as e:
-        debug(f"fetch_html entersoft iframe URLError {e}")
+        log_event("fetch_iframe_url_error", level=logging.WARNING, error=str(e))
     except Exception as e:
-        debug(f"fetch_html entersoft iframe unexpected error {e}")
+        log_event("fetch_iframe_error", level=logging.WARNING, error=str(e))
     return html_text
 
 
@@ -560,6 +3070,8 @@ def fetch_html(url, timeout=10, *, follow_entersoft=True):
     Fetch HTML via simple GET; optionally fall back to headless Playwright if enabled.
     Enable fallback with env HEADLESS_FETCH=1 (requires playwright + chromium installed).
     """
+    import urllib.request
+
     req = urllib.request.Request(
         url,
         headers={
@@ -568,103 +3080,1603 @@ def fetch_html(url, timeout=10, *, follow_entersoft=True):
             "Accept-Language": "en-US,en;q=0.9",
         },
     )
-    html = None
-    try:
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            charset = resp.headers.get_content_charset() or "utf-8"
-            html = resp.read().decode(charset, errors="ignore")
-            debug(f"fetch_html basic len={len(html) if html else 0}")
-    except urllib.error.URLError as e:
-        debug(f"fetch_html basic URLError {e}")
-    if HEADLESS_FETCH and (not html or len(html) <= 8000):
-        try:
-            from playwright.sync_api import sync_playwright  # type: ignore
-        except ImportError:
-            debug("headless fetch requested but playwright not installed")
-        else:
-            try:
-                with sync_playwright() as p:
-                    browser = p.chromium.launch(headless=True)
-                    page = browser.new_page(user_agent=USER_AGENT)
-                    page.goto(url, wait_until="networkidle", timeout=timeout * 1000)
-                    page.wait_for_timeout(1000)
-                    html = page.content()
-                    debug(f"headless fetch len={len(html) if html else 0}")
-                    browser.close()
-            except Exception as e:
-                debug(f"headless fetch failed: {e}")
-    if follow_entersoft:
-        html = maybe_follow_entersoft_iframe(html, url, timeout=timeout)
-    return html
+    html = None
+    skipped = False
+    try:
+        with OUTBOUND.call(url, "invoice"), track_stage("fetch_html"), \
+                urllib.request.urlopen(req, timeout=OUTBOUND.timeout(timeout)) as resp:
+            charset = resp.headers.get_content_charset() or "utf-8"
+            html = resp.read().decode(charset, errors="ignore")
+            log_event("fetch_html", mode="basic", length=len(html) if html else 0)
+        METRICS.inc("outbound_requests_total", target="invoice", result="ok")
+    except CircuitOpenError as e:
+        METRICS.inc("outbound_requests_total", target="invoice", result="skipped")
+        log_event("fetch_html_skipped", level=logging.WARNING, error=str(e))
+        skipped = True
+    except (urllib.error.URLError, TimeoutError) as e:
+        METRICS.inc("outbound_requests_total", target="invoice", result="error")
+        log_event("fetch_html_url_error", level=logging.WARNING, mode="basic", error=str(e))
+    if HEADLESS_FETCH and not skipped and (not html or len(html) <= 8000):
+        try:
+            from playwright.sync_api import sync_playwright  # type: ignore
+        except ImportError:
+            log_event("fetch_headless_unavailable", "headless fetch requested but playwright not installed", level=logging.WARNING)
+        else:
+            try:
+                with track_stage("fetch_headless"), sync_playwright() as p:
+                    browser = p.chromium.launch(headless=True)
+                    page = browser.new_page(user_agent=USER_AGENT)
+                    page.goto(url, wait_until="networkidle", timeout=OUTBOUND.timeout(timeout) * 1000)
+                    page.wait_for_timeout(1000)
+                    html = page.content()
+                    log_event("fetch_html", mode="headless", length=len(html) if html else 0)
+                    browser.close()
+                METRICS.inc("outbound_requests_total", target="headless", result="ok")
+            except Exception as e:
+                METRICS.inc("outbound_requests_total", target="headless", result="error")
+                log_event("fetch_headless_failed", level=logging.WARNING, error=str(e))
+    if follow_entersoft:
+        html = maybe_follow_entersoft_iframe(html, url, timeout=timeout)
+    return html
+
+
+def to_cents(amount):
+    return int(round(float(amount or 0) * 100))
+
+
+def item_total(item):
+    total = item.get("total")
+    if total is None:
+        total = (item.get("quantity") or 0) * (item.get("price") or 0)
+    return total
+
+
+def cent_seed(receipt_id):
+    """
+    Where a receipt's leftover-cent rotation starts. Derived from the receipt id so it
+    is stable across rebuilds but differs between receipts; otherwise the first
+    participant of every receipt's first item would always get the extra cent.
+    """
+    return zlib.crc32(str(receipt_id).encode("utf-8")) if receipt_id is not None else 0
+
+
+class ItemColumns:
+    """
+    Columnar view of receipt items for the split computation: item amounts in integer
+    cents plus a sparse person x item incidence matrix in CSR form (item ``i`` is shared
+    by ``person_ids[indptr[i]:indptr[i + 1]]``). Items nobody shares or worth nothing
+    are left out. Columns are ``array('q')`` so NumPy can view them without copying.
+    """
+
+    __slots__ = ("cents", "offsets", "indptr", "person_ids")
+
+    def __init__(self):
+        self.cents = array("q")
+        # Receipt seed plus item position; rotates which participants get leftover cents.
+        self.offsets = array("q")
+        self.indptr = array("q", [0])
+        self.person_ids = array("q")
+
+    def __len__(self):
+        return len(self.cents)
+
+    @classmethod
+    def from_items(cls, items, seed=0):
+        """Columns for one receipt's items; ``seed`` is its :func:`cent_seed`."""
+        columns = cls()
+        for pos, item in enumerate(items):
+            mask = item.get("mask") or 0
+            cents = to_cents(item_total(item)) if mask else 0
+            if not cents:
+                continue
+            columns.cents.append(cents)
+            columns.offsets.append(seed + pos)
+            columns.person_ids.extend(mask_ids(mask))
+            columns.indptr.append(len(columns.person_ids))
+        return columns
+
+    @classmethod
+    def concat(cls, parts):
+        columns = cls()
+        for part in parts:
+            base = len(columns.person_ids)
+            columns.cents.extend(part.cents)
+            columns.offsets.extend(part.offsets)
+            columns.person_ids.extend(part.person_ids)
+            columns.indptr.extend(base + end for end in part.indptr[1:])
+        return columns
+
+    def consumption(self, num_people):
+        """
+        Cents consumed per person id. Each item is split exactly: every participant gets
+        ``cents // n`` and the ``cents % n`` leftover cents go one each to participants
+        in turn, starting at the item's offset, so shares always add up to the item total.
+        """
+        np = numpy_module()
+        if np is not None and len(self.cents):
+            return self._consumption_numpy(np, num_people)
+        consumed = [0] * (num_people + 1)
+        indptr, person_ids = self.indptr, self.person_ids
+        # Out-of-range ids (shouldn't happen) land in a spare slot that is dropped.
+        ids = [pid if pid < num_people else num_people for pid in person_ids]
+        for i, (cents, offset) in enumerate(zip(self.cents, self.offsets)):
+            start, end = indptr[i], indptr[i + 1]
+            count = end - start
+            base, extra = divmod(cents, count)
+            sharers = ids[start:end]
+            for person_id in sharers:
+                consumed[person_id] += base
+            first = offset % count
+            for rank in range(first, first + extra):
+                consumed[sharers[rank % count]] += 1
+        return consumed[:num_people]
+
+    def _consumption_numpy(self, np, num_people):
+        cents = np.frombuffer(self.cents, dtype=np.int64)
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        indptr = np.frombuffer(self.indptr, dtype=np.int64)
+        person_ids = np.frombuffer(self.person_ids, dtype=np.int64)
+        counts = np.diff(indptr)
+        base, extra = np.divmod(cents, counts)
+        item_of = np.repeat(np.arange(len(cents)), counts)
+        rank = np.arange(len(person_ids)) - indptr[:-1][item_of]
+        rotated = (rank - offsets[item_of]) % counts[item_of]
+        shares = base[item_of] + (rotated < extra[item_of])
+        keep = person_ids < num_people
+        # Incidence-matrix product: sum each person's column of shares.
+        totals = np.bincount(person_ids[keep], weights=shares[keep], minlength=num_people)
+        return [int(v) for v in np.rint(totals[:num_people])]
+
+
+def compute_summary(state, columns=None):
+    """
+    Paid/consumed/net per person, computed in integer cents. ``columns`` may carry a
+    prebuilt ``ItemColumns`` for the state's items (Trip caches one per receipt).
+    """
+    people = state.get("people", [])
+    person_ids = {name: person_id for person_id, name in enumerate(people)}
+    paid = [0] * len(people)
+    receipts = state.get("receipts", [])
+    for receipt in receipts:
+        payer = person_ids.get(receipt.get("paid_by"))
+        if payer is not None:
+            paid[payer] += to_cents(receipt.get("total_amount"))
+    if columns is None:
+        columns = ItemColumns.concat(
+            ItemColumns.from_items(receipt.get("items") or [], cent_seed(receipt.get("id"))) for receipt in receipts
+        )
+    consumed = columns.consumption(len(people))
+    summary = []
+    for person_id, name in enumerate(people):
+        summary.append(
+            {
+                "name": name,
+                "paid": paid[person_id] / 100,
+                "consumed": consumed[person_id] / 100,
+                "net": (paid[person_id] - consumed[person_id]) / 100
+            }
+        )
+    summary.sort(key=lambda x: x["name"].lower())
+    return summary
+
+
+# Streaming exports (/api/export/<kind>) and the matching bulk import (/api/import).
+# ``trip`` is the lossless dump: a {"type": "trip"} record with the people, then one
+# {"type": "receipt"} record per receipt in API shape. It is JSON Lines only.
+EXPORT_FORMATS = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson"}
+EXPORT_COLUMNS = {
+    "ledger": (
+        "receipt_id", "created_at", "title", "supplier", "paid_by", "currency",
+        "item_id", "description", "quantity", "price", "item_total", "participant", "share", "shared_by",
+    ),
+    "balances": ("name", "paid", "consumed", "net"),
+    "receipts": RECEIPT_HEADER_FIELDS + ("item_count",),
+    "trip": None,
+}
+EXPORT_CHUNK_BYTES = 64 * 1024
+IMPORT_MODES = ("replace", "merge")
+
+
+def split_cents(cents, count, offset):
+    """Per-participant shares of ``cents``, split exactly as ``ItemColumns.consumption`` does."""
+    base, extra = divmod(cents, count)
+    shares = [base] * count
+    first = offset % count
+    for rank in range(first, first + extra):
+        shares[rank % count] += 1
+    return shares
+
+
+def ledger_rows(receipt, people):
+    """
+    Ledger rows (tuples in EXPORT_COLUMNS["ledger"] order), one per item and participant
+    with that participant's share. Items nobody shares get a single row without a
+    participant, so every item shows up.
+    """
+    head = tuple(receipt.get(key) for key in ("id", "created_at", "title", "supplier", "paid_by", "currency"))
+    seed = cent_seed(receipt.get("id"))
+    rows = []
+    for pos, item in enumerate(receipt.get("items") or []):
+        total = item_total(item)
+        row = head + (item.get("id"), item.get("description"), item.get("quantity"), item.get("price"), total)
+        sharers = list(mask_ids(item.get("mask") or 0))
+        if not sharers:
+            rows.append(row + (None, 0, 0))
+            continue
+        for person_id, share in zip(sharers, split_cents(to_cents(total), len(sharers), seed + pos)):
+            if person_id < len(people):
+                rows.append(row + (people[person_id], share / 100, len(sharers)))
+    return rows
+
+
+def encode_export(batches, columns, fmt):
+    """
+    Encode batches of rows as CSV (header first) or JSON Lines, yielding chunks of about
+    EXPORT_CHUNK_BYTES. Rows are tuples in ``columns`` order; without columns (the trip
+    export) they are JSON values or pre-encoded JSON bytes.
+    """
+    if fmt == "csv":
+        buf = StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+            if buf.tell() >= EXPORT_CHUNK_BYTES:
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+        if buf.tell():
+            yield buf.getvalue().encode("utf-8")
+        return
+    pending = []
+    size = 0
+    for rows in batches:
+        for row in rows:
+            if columns is not None:
+                row = dict(zip(columns, row))
+            line = row if isinstance(row, (bytes, bytearray)) else json_dumps(row)
+            pending.append(line)
+            pending.append(b"\n")
+            size += len(line) + 1
+        if size >= EXPORT_CHUNK_BYTES:
+            yield b"".join(pending)
+            pending = []
+            size = 0
+    if pending:
+        yield b"".join(pending)
+
+
+class TripImport:
+    """
+    Rebuilds a trip from the JSON Lines of a ``trip`` export. Body bytes are fed in as
+    they arrive and parsed a line at a time; ``state()`` returns raw state for
+    ``normalize_state``.
+    """
+
+    def __init__(self):
+        self.people = None
+        self.receipts = []
+        self.lines = 0
+        self._ids = set()
+        self._pending = bytearray()
+
+    def feed(self, data):
+        self._pending += data
+        start = 0
+        while True:
+            end = self._pending.find(b"\n", start)
+            if end < 0:
+                break
+            self._add_line(bytes(self._pending[start:end]))
+            start = end + 1
+        del self._pending[:start]
+
+    def _add_line(self, line):
+        self.lines += 1
+        line = line.strip()
+        if not line:
+            return
+        try:
+            record = json_loads(line)
+        except ValueError:
+            raise ApiError(400, f"Invalid JSON on line {self.lines}")
+        kind = record.get("type") if isinstance(record, dict) else None
+        if kind == "trip":
+            if self.people is not None or not isinstance(record.get("people"), list):
+                raise ApiError(400, f"Unexpected trip record on line {self.lines}")
+            self.people = [name for name in record["people"] if isinstance(name, str)]
+        elif kind == "receipt":
+            receipt = record.get("receipt")
+            if self.people is None:
+                raise ApiError(400, f"Receipt before the trip record on line {self.lines}")
+            if not isinstance(receipt, dict) or not receipt.get("id"):
+                raise ApiError(400, f"Invalid receipt on line {self.lines}")
+            if receipt["id"] in self._ids:
+                raise ApiError(400, f"Duplicate receipt {receipt['id']} on line {self.lines}")
+            self._ids.add(receipt["id"])
+            self.receipts.append(receipt)
+        else:
+            raise ApiError(400, f"Unknown record on line {self.lines}")
+
+    def state(self):
+        if self._pending:
+            self._add_line(bytes(self._pending))
+            self._pending.clear()
+        if self.people is None:
+            raise ApiError(400, "Not a trip export (no trip record)")
+        # Someone who joined after the export's people snapshot still keeps their items.
+        people = list(self.people)
+        known = set(people)
+        for receipt in self.receipts:
+            for item in receipt.get("items") or []:
+                for name in (item.get("participants") if isinstance(item, dict) else None) or []:
+                    if isinstance(name, str) and name not in known:
+                        known.add(name)
+                        people.append(name)
+        return {"people": people, "receipts": self.receipts}
+
+
+def choose_encoding(accept_encoding, available=None):
+    """
+    Pick the best response encoding the client accepts: brotli (if installed), then gzip.
+    ``available`` narrows the choice to encodings a precompressed body exists for.
+    """
+    accepted = {}
+    for token in (accept_encoding or "").split(","):
+        name, _, params = token.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0 and (available is None or "br" in available):
+        return "br"
+    if accepted.get("gzip", 0) > 0 and (available is None or "gzip" in available):
+        return "gzip"
+    return None
+
+
+def is_compressible(content_type):
+    return any((content_type or "").startswith(prefix) for prefix in COMPRESSIBLE_TYPES)
+
+
+def compress_chunks(chunks, encoding):
+    """Compress a list of byte chunks; gzip is streamed chunk by chunk without joining."""
+    if encoding == "br":
+        return brotli.compress(b"".join(chunks), quality=5)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    out = [compressor.compress(chunk) for chunk in chunks]
+    out.append(compressor.flush())
+    return b"".join(out)
+
+
+class BrotliStream:
+    """``zlib.compressobj``-style wrapper (compress/flush) over ``brotli.Compressor``."""
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def stream_compressor(encoding):
+    """An incremental compressor for ``encoding``, for bodies sent as they are produced."""
+    if encoding == "br":
+        return BrotliStream()
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def file_content_type(path):
+    content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    if content_type.startswith("text/") or content_type == "application/javascript":
+        content_type += "; charset=utf-8"
+    return content_type
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def precompressed_sibling(path):
+    """Return ``<path>.gz`` when it exists and is at least as new as ``path``."""
+    sibling = path.with_name(path.name + ".gz")
+    try:
+        if sibling.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+            return sibling
+    except OSError:
+        pass
+    return None
+
+
+def parse_range(header, size):
+    """
+    Parse a single ``bytes=`` range against a representation of ``size`` bytes.
+    Returns ``(start, end)`` (inclusive), None when the header should be ignored
+    (missing, malformed, other units or multiple ranges), or False when it is
+    syntactically fine but unsatisfiable (416).
+    """
+    unit, _, spec = (header or "").partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if not first:
+            length = int(last)
+            if length < 0:
+                return None
+            if length == 0 or size == 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start < 0 or (last and end < start):
+        return None
+    if start >= size:
+        return False
+    return start, min(end, size - 1)
+
+
+ENCODING_ETAG_SUFFIXES = {"gzip": "gz", "br": "br"}
+
+
+def variant_etag(etag, encoding):
+    """
+    The strong ETag of one content coding of a representation (``"<tag>-gz"``,
+    ``"<tag>-br"``); identity keeps ``etag``. Each coding needs its own validator
+    so ``If-Range`` can never splice identity bytes onto a compressed body.
+    """
+    if not encoding:
+        return etag
+    return f'{etag[:-1]}-{ENCODING_ETAG_SUFFIXES[encoding]}"'
+
+
+def if_range_matches(if_range, etag, last_modified):
+    """``If-Range`` is an entity tag (strong comparison) or an exact HTTP date."""
+    if_range = (if_range or "").strip()
+    if if_range.startswith(("W/", '"')):
+        return if_range == etag
+    return last_modified is not None and if_range == http_date(last_modified)
+
+
+def is_not_modified(if_none_match, if_modified_since, etag, last_modified=None):
+    """
+    Evaluate conditional request headers. If-None-Match wins when present (weak
+    comparison, as RFC 9110 requires for GET); otherwise fall back to If-Modified-Since.
+    """
+    if if_none_match:
+        wanted = etag.removeprefix("W/")
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*" or tag.removeprefix("W/") == wanted:
+                return True
+        return False
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError):
+            return False
+        return int(last_modified) <= since
+    return False
+
+
+class HotAsset:
+    """
+    A small response held in memory: the identity body, its gzip/brotli encodings
+    (a fresh ``.gz`` sibling on disk is used instead of compressing), and the header
+    set for each encoding, so serving it is a dict lookup and a single write. Each
+    encoding has its own ETag; only the identity body is offered for Range requests.
+    """
+
+    __slots__ = ("key", "etag", "last_modified", "bodies", "headers", "nbytes")
+
+    def __init__(self, key, body, content_type, etag, last_modified=None, gzip_body=None):
+        self.key = key
+        self.etag = etag
+        self.last_modified = last_modified
+        self.bodies = {None: body}
+        base = {"Content-Type": content_type}
+        if last_modified is not None:
+            base["Last-Modified"] = http_date(last_modified)
+        if is_compressible(content_type):
+            base["Vary"] = "Accept-Encoding"
+            if len(body) >= COMPRESS_MIN_BYTES:
+                self.bodies["gzip"] = gzip_body or compress_chunks([body], "gzip")
+                if brotli is not None:
+                    self.bodies["br"] = compress_chunks([body], "br")
+        self.headers = {}
+        for encoding, encoded in self.bodies.items():
+            headers = dict(base, **{"Content-Length": str(len(encoded)), "ETag": variant_etag(etag, encoding)})
+            if encoding:
+                headers["Content-Encoding"] = encoding
+            else:
+                headers["Accept-Ranges"] = "bytes"
+            self.headers[encoding] = headers
+        self.nbytes = sum(len(encoded) for encoded in self.bodies.values())
+
+    def encoding_for(self, accept_encoding):
+        """The best encoding of this asset the client accepts (None for identity)."""
+        return choose_encoding(accept_encoding, self.bodies)
+
+    def validators(self, encoding, cache_control):
+        """Headers for a 304 of the ``encoding`` variant."""
+        headers = {"ETag": self.headers[encoding]["ETag"], "Cache-Control": cache_control}
+        if self.last_modified is not None:
+            headers["Last-Modified"] = http_date(self.last_modified)
+        if "Vary" in self.headers[encoding]:
+            headers["Vary"] = "Accept-Encoding"
+        return headers
+
+
+class StaticAssets:
+    """
+    Content-hashed URLs for files under static/. ``index.html`` is rendered with
+    ``/static/app.<hash>.js``-style links; a request for a hashed name whose hash
+    matches the current file is safe to cache forever (``immutable``).
+    """
+
+    HASHED_NAME_RE = LazyPattern(r"^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[A-Za-z0-9]+)$")
+    STATIC_LINK_RE = LazyPattern(r'(?:src|href)="/static/([^"?#]+)"')
+
+    def __init__(self, root):
+        self.root = Path(root).resolve()
+        self._lock = threading.Lock()
+        self._digests = {}
+        self._index = None
+        self._index_asset = None
+        self._hot = {}
+        self._hot_bytes = 0
+        # path -> digest of files that didn't fit HOT_ASSETS_TOTAL_BYTES; streamed instead.
+        self._cold = {}
+
+    def _path(self, rel_path):
+        path = (self.root / rel_path.lstrip("/")).resolve()
+        if path != self.root and self.root not in path.parents:
+            return None
+        return path if path.is_file() else None
+
+    def digest(self, path):
+        stat = path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._digests.get(path)
+            if cached and cached[0] == key:
+                return cached[1]
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+        with self._lock:
+            self._digests[path] = (key, digest)
+        return digest
+
+    def url(self, rel_path):
+        path = self._path(rel_path)
+        if path is None:
+            return f"/static/{rel_path}"
+        digest = self.digest(path)
+        stem, dot, ext = rel_path.rpartition(".")
+        if not dot:
+            return f"/static/{rel_path}"
+        return f"/static/{stem}.{digest}.{ext}"
+
+    def resolve(self, rel_path):
+        """Map a request path (hashed or plain) to ``(path, digest, immutable)`` or None."""
+        rel_path = urllib.parse.unquote(rel_path).lstrip("/")
+        folder, _, name = rel_path.rpartition("/")
+        match = self.HASHED_NAME_RE.match(name)
+        if match:
+            plain = f"{folder}/" if folder else ""
+            plain += match.group("stem") + match.group("ext")
+            path = self._path(plain)
+            if path is not None:
+                digest = self.digest(path)
+                # A stale hash still gets the current file, just without the forever-cache promise.
+                return path, digest, digest == match.group("digest")
+        path = self._path(rel_path)
+        if path is None:
+            return None
+        return path, self.digest(path), False
+
+    def hot(self, path, digest):
+        """The in-memory copy of a small static file, or None if it should be streamed."""
+        with self._lock:
+            asset = self._hot.get(path)
+            cold = self._cold.get(path) == digest
+        if asset is not None and asset.key == digest:
+            METRICS.inc("cache_requests_total", cache="static", result="hit")
+            return asset
+        METRICS.inc("cache_requests_total", cache="static", result="miss")
+        if cold:
+            return None
+        stat = path.stat()
+        if stat.st_size > HOT_ASSET_MAX_BYTES:
+            return None
+        sibling = precompressed_sibling(path)
+        asset = HotAsset(
+            digest,
+            path.read_bytes(),
+            file_content_type(path),
+            f'"{digest}"',
+            stat.st_mtime,
+            gzip_body=sibling.read_bytes() if sibling else None,
+        )
+        with self._lock:
+            previous = self._hot.pop(path, None)
+            if previous is not None:
+                self._hot_bytes -= previous.nbytes
+                # Freed room: files turned away earlier may fit now.
+                self._cold.clear()
+            if self._hot_bytes + asset.nbytes > HOT_ASSETS_TOTAL_BYTES:
+                # Building it again on every request would cost more than sendfile.
+                self._cold[path] = digest
+                return None
+            self._hot[path] = asset
+            self._hot_bytes += asset.nbytes
+        return asset
+
+    def hot_index(self):
+        """The rendered index.html as a :class:`HotAsset` (encodings computed once per render)."""
+        body, etag = self.render_index()
+        with self._lock:
+            asset = self._index_asset
+        if asset is None or asset.key != etag:
+            asset = HotAsset(etag, body, "text/html; charset=utf-8", etag)
+            with self._lock:
+                # Kept apart from _hot: the index is always in memory, outside the file budget.
+                self._index_asset = asset
+        return asset
+
+    def render_index(self):
+        """Return ``(html_bytes, etag)`` of index.html with hashed asset links."""
+        index_path = self.root / "index.html"
+        digest = self.digest(index_path)
+        with self._lock:
+            cached = self._index
+        if cached and cached[0] == digest:
+            if tuple(self.url(rel) for rel in cached[1]) == cached[2]:
+                return cached[3], cached[4]
+        text = index_path.read_text(encoding="utf-8")
+        links = tuple(dict.fromkeys(self.STATIC_LINK_RE.findall(text)))
+        urls = tuple(self.url(rel) for rel in links)
+        for rel, url in zip(links, urls):
+            text = text.replace(f'"/static/{rel}"', f'"{url}"')
+        body = text.encode("utf-8")
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+        with self._lock:
+            self._index = (digest, links, urls, body, etag)
+        return body, etag
+
+
+STATIC_ASSETS = StaticAssets(STATIC_DIR)
+
+
+def parse_header_params(value):
+    """
+    Split a header like ``form-data; name="file"; filename="a.png"`` into
+    ``("form-data", {"name": "file", "filename": "a.png"})`` (stand-in for cgi.parse_header).
+    """
+    parts = []
+    current = []
+    quoted = False
+    escaped = False
+    for char in value or "":
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\" and quoted:
+            current.append(char)
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+            current.append(char)
+        elif char == ";" and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    main = parts[0].strip().lower()
+    params = {}
+    for item in parts[1:]:
+        key, sep, val = item.partition("=")
+        if not sep:
+            continue
+        val = val.strip()
+        if len(val) >= 2 and val[0] == val[-1] == '"':
+            val = val[1:-1].replace('\\\\', '\\').replace('\\"', '"')
+        params[key.strip().lower()] = val
+    return main, params
+
+
+class MultipartPart:
+    """One received form part; the body sits in a spooled temp file exposed as ``file``."""
+
+    def __init__(self, name, filename, content_type, headers):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.headers = headers
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+
+    @property
+    def is_file(self):
+        return self.filename is not None
+
+    def write(self, data):
+        self.size += len(data)
+        self.file.write(data)
+
+    def read(self):
+        self.file.seek(0)
+        return self.file.read()
+
+    def text(self, charset="utf-8"):
+        return self.read().decode(charset, errors="replace")
+
+    def close(self):
+        self.file.close()
+
+
+class MultipartForm:
+    """Parsed form: text ``fields`` plus file parts (streams) in ``files``."""
+
+    def __init__(self):
+        self.fields = {}
+        self.files = {}
+
+    def get(self, name, default=""):
+        return self.fields.get(name, default)
+
+    def close(self):
+        for part in self.files.values():
+            part.close()
+
+
+class MultipartParser:
+    """
+    Incremental multipart/form-data parser for the stdlib server (replaces cgi.FieldStorage).
+    Reads the body in fixed-size chunks, spools each part as it arrives and rejects
+    oversized bodies/parts as soon as a limit is crossed instead of after buffering.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    MAX_HEADER_BYTES = 16 * 1024
+
+    def __init__(self, stream, boundary, content_length, max_total=MAX_REQUEST_BYTES,
+                 max_file=MAX_FILE_BYTES, max_field=MAX_FIELD_BYTES):
+        if not boundary or len(boundary) > 200:
+            raise ApiError(400, "Malformed multipart boundary")
+        if max_total and content_length > max_total:
+            raise ApiError(413, f"Upload too large (limit {max_total} bytes)")
+        self.stream = stream
+        self.remaining = content_length
+        self.delimiter = b"\r\n--" + boundary.encode("latin-1")
+        self.max_file = max_file
+        self.max_field = max_field
+
+    def _read(self):
+        if self.remaining <= 0:
+            return b""
+        chunk = self.stream.read(min(self.CHUNK_SIZE, self.remaining))
+        if not chunk:
+            raise ApiError(400, "Upload ended early")
+        self.remaining -= len(chunk)
+        return chunk
+
+    def parse(self):
+        form = MultipartForm()
+        try:
+            for part in self.parts():
+                if part.is_file:
+                    previous = form.files.pop(part.name, None)
+                    if previous is not None:
+                        previous.close()
+                    form.files[part.name] = part
+                else:
+                    charset = parse_header_params(part.content_type)[1].get("charset", "utf-8")
+                    form.fields[part.name] = part.text(charset)
+                    part.close()
+            # Discard the epilogue so a keep-alive connection is positioned at the next request.
+            while self._read():
+                pass
+        except Exception:
+            form.close()
+            raise
+        return form
+
+    def parts(self):
+        # Prefix CRLF so the first boundary matches the same delimiter as later ones.
+        buf = bytearray(b"\r\n")
+        delimiter = self.delimiter
+        keep = len(delimiter) + 4
+        # Preamble: skip everything up to the first boundary.
+        while True:
+            pos = buf.find(delimiter)
+            if pos >= 0:
+                del buf[: pos + len(delimiter)]
+                break
+            del buf[: max(0, len(buf) - keep)]
+            chunk = self._read()
+            if not chunk:
+                raise ApiError(400, "Malformed multipart body")
+            buf += chunk
+        while True:
+            while len(buf) < 2:
+                chunk = self._read()
+                if not chunk:
+                    raise ApiError(400, "Malformed multipart body")
+                buf += chunk
+            if buf[:2] == b"--":
+                return
+            if buf[:2] != b"\r\n":
+                raise ApiError(400, "Malformed multipart body")
+            del buf[:2]
+            while True:
+                end = buf.find(b"\r\n\r\n")
+                if end >= 0:
+                    break
+                if len(buf) > self.MAX_HEADER_BYTES:
+                    raise ApiError(400, "Multipart part headers too large")
+                chunk = self._read()
+                if not chunk:
+                    raise ApiError(400, "Malformed multipart body")
+                buf += chunk
+            part = self._start_part(bytes(buf[:end]))
+            del buf[: end + 4]
+            limit = self.max_file if part.is_file else self.max_field
+            try:
+                while True:
+                    pos = buf.find(delimiter)
+                    if pos >= 0:
+                        part.write(bytes(buf[:pos]))
+                        del buf[: pos + len(delimiter)]
+                        break
+                    # Everything except a possible partial delimiter at the end is body data.
+                    safe = len(buf) - keep
+                    if safe > 0:
+                        part.write(bytes(buf[:safe]))
+                        del buf[:safe]
+                    if limit and part.size > limit:
+                        raise ApiError(413, f"Form field '{part.name}' too large (limit {limit} bytes)")
+                    chunk = self._read()
+                    if not chunk:
+                        raise ApiError(400, "Malformed multipart body")
+                    buf += chunk
+                if limit and part.size > limit:
+                    raise ApiError(413, f"Form field '{part.name}' too large (limit {limit} bytes)")
+            except Exception:
+                part.close()
+                raise
+            part.file.seek(0)
+            yield part
+
+    @staticmethod
+    def _start_part(raw_headers):
+        headers = {}
+        for line in raw_headers.decode("utf-8", errors="replace").split("\r\n"):
+            key, sep, value = line.partition(":")
+            if sep:
+                headers[key.strip().lower()] = value.strip()
+        disposition, params = parse_header_params(headers.get("content-disposition", ""))
+        if disposition != "form-data" or "name" not in params:
+            raise ApiError(400, "Multipart part without a form-data name")
+        return MultipartPart(
+            params["name"], params.get("filename"), headers.get("content-type", "text/plain"), headers
+        )
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Upper bound on iovecs per sendmsg() call (POSIX guarantees at least 16, Linux allows 1024).
+SENDMSG_MAX_BUFFERS = 512
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer that hands accepted connections to ``workers`` long-lived threads through
+    a queue of at most ``queue_size`` connections, instead of a thread per connection.
+    When the queue is full the connection is passed to a single shedding thread that
+    answers 503 + Retry-After, so the accept loop itself never blocks on a client.
+    """
+
+    request_queue_size = 128  # listen() backlog
+
+    def __init__(self, server_address, handler_class, workers=HTTP_WORKERS, queue_size=HTTP_ACCEPT_QUEUE):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+        # Shedding is cheap (read, write 503, close), so it may lag behind by a whole backlog.
+        self._shed_queue = queue.Queue(maxsize=self.request_queue_size)
+        self._threads = []
+        for number in range(workers):
+            thread = threading.Thread(target=self._work, name=f"http-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        threading.Thread(target=self._shed_loop, name="http-shed", daemon=True).start()
+        _HTTP_SERVERS.add(self)
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address))
+            return
+        except queue.Full:
+            pass
+        METRICS.inc("http_shed_total")
+        log_event("http_shed", level=logging.WARNING, sample=10, client=client_address[0], queued=self._queue.qsize())
+        # TLS connections haven't shaken hands yet (that happens on a worker), so they are just closed.
+        if isinstance(request, ssl.SSLSocket):
+            return self.shutdown_request(request)
+        try:
+            self._shed_queue.put_nowait(request)
+        except queue.Full:
+            self.shutdown_request(request)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            request, client_address = job
+            with self._busy_lock:
+                self._busy += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._busy_lock:
+                    self._busy -= 1
+
+    def _shed_loop(self):
+        while True:
+            request = self._shed_queue.get()
+            if request is None:
+                return
+            try:
+                # Take the request off the wire first: closing a socket with unread data
+                # resets the connection and the client would never see the 503.
+                request.settimeout(0.5)
+                try:
+                    request.recv(64 * 1024)
+                except TimeoutError:
+                    pass
+                request.sendall(SHED_RESPONSE)
+            except OSError:
+                pass
+            finally:
+                self.shutdown_request(request)
+
+    def under_pressure(self):
+        """True while accepted connections are waiting for a free worker."""
+        return not self._queue.empty()
+
+    def stats(self):
+        with self._busy_lock:
+            busy = self._busy
+        return {"workers": self.workers, "busy": busy, "queued": self._queue.qsize()}
+
+    def server_close(self):
+        super().server_close()
+        _HTTP_SERVERS.discard(self)
+        for pending, count in ((self._queue, len(self._threads)), (self._shed_queue, 1)):
+            for _ in range(count):
+                try:
+                    pending.put_nowait(None)
+                except queue.Full:
+                    break
+
+
+_SHED_BODY = b'{"error":"Server overloaded"}'
+SHED_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: application/json; charset=utf-8\r\n"
+    b"Retry-After: %d\r\n"
+    b"Connection: close\r\n"
+    b"Content-Length: %d\r\n\r\n" % (HTTP_RETRY_AFTER, len(_SHED_BODY))
+) + _SHED_BODY
+_HTTP_SERVERS = weakref.WeakSet()
+
+
+def collect_http_pool_metrics():
+    for server in list(_HTTP_SERVERS):
+        stats = server.stats()
+        port = str(server.server_address[1])
+        yield "http_workers", {"port": port}, stats["workers"]
+        yield "http_workers_busy", {"port": port}, stats["busy"]
+        yield "http_accept_queue_depth", {"port": port}, stats["queued"]
+
+
+METRICS.add_collector(collect_http_pool_metrics)
+
+
+# Start-up work runs on a background thread once the listeners are up, so the first
+# request never pays for it. Requests for /api and /uploads wait for the gating tasks
+# for at most READY_TIMEOUT seconds, then get 503 with Retry-After.
+READY_TIMEOUT = float(os.environ.get("READY_TIMEOUT", "30") or 30)
+
+
+class Startup:
+    """
+    Runs start-up tasks in order on a daemon thread. ``gating`` tasks (directories,
+    upload migration, the default trip's state) must finish before state-backed
+    requests are served; ``warm`` tasks (regex compilation, optional imports) run
+    afterwards and only make first calls cheaper. A failed task is logged and
+    reported by /readyz, but does not hold requests back: the request path redoes
+    any of this work lazily.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self.started_at = None
+        self.ready_after = None
+        self.tasks = OrderedDict()
+
+    def start(self, gating, warm=()):
+        """Begin the tasks in the background; returns False if they were already started."""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self.started_at = self.clock()
+            for name, _fn in list(gating) + list(warm):
+                self.tasks[name] = {"state": "pending", "gating": False, "seconds": None}
+            for name, _fn in gating:
+                self.tasks[name]["gating"] = True
+            self._thread = threading.Thread(target=self._run, args=(list(gating), list(warm)), name="startup", daemon=True)
+            self._thread.start()
+        return True
+
+    def _run(self, gating, warm):
+        for name, fn in gating:
+            self._step(name, fn)
+        self.ready_after = self.clock() - self.started_at
+        self._ready.set()
+        log_event("startup_ready", level=logging.INFO, seconds=round(self.ready_after, 4))
+        for name, fn in warm:
+            self._step(name, fn)
+
+    def _step(self, name, fn):
+        task = self.tasks[name]
+        task["state"] = "running"
+        start = self.clock()
+        try:
+            with track_stage(f"startup_{name}"):
+                fn()
+        except Exception as e:
+            task["state"] = "failed"
+            task["error"] = repr(e)
+            log_event("startup_task_failed", level=logging.ERROR, task=name, error=repr(e))
+        else:
+            task["state"] = "done"
+        task["seconds"] = round(self.clock() - start, 6)
+
+    @property
+    def ready(self):
+        # Never started (tests, bench harnesses): nothing to wait for.
+        return self._thread is None or self._ready.is_set()
+
+    def wait(self, timeout=None):
+        return self.ready or self._ready.wait(READY_TIMEOUT if timeout is None else timeout)
+
+    def status(self):
+        with self._lock:
+            tasks = {name: dict(task) for name, task in self.tasks.items()}
+        return {
+            "ready": self.ready,
+            "ready_after_s": round(self.ready_after, 6) if self.ready_after is not None else None,
+            "tasks": tasks,
+        }
+
+
+STARTUP = Startup()
+
+
+def warm_default_trip():
+    """Load the default trip and encode its /api/state snapshot."""
+    trip = get_trip(DEFAULT_TRIP_ID)
+    with trip.lock:
+        trip.snapshot_json()
+
+
+def begin_startup(startup=None):
+    """Kick off background start-up (idempotent); called by run() and the ASGI lifespan."""
+    startup = startup or STARTUP
+    return startup.start(
+        gating=(("dirs", ensure_dirs), ("uploads", migrate_uploads), ("state", warm_default_trip)),
+        warm=(
+            ("patterns", warm_patterns),
+            ("numpy", numpy_module),
+            ("qrdecode", lambda: importlib.import_module("qrdecode")),
+        ),
+    )
 
 
-def compute_summary(state):
-    people = {name: {"paid": 0.0, "consumed": 0.0} for name in state.get("people", [])}
-    for receipt in state.get("receipts", []):
-        total = receipt.get("total_amount") or 0.0
-        paid_by = receipt.get("paid_by")
-        if paid_by in people:
-            people[paid_by]["paid"] += total
-        for item in receipt.get("items", []):
-            participants = item.get("participants") or []
-            if not participants:
-                continue
-            item_total = item.get("total")
-            if item_total is None:
-                q = item.get("quantity") or 0
-                p = item.get("price") or 0
-                item_total = q * p
-            if not item_total:
-                continue
-            share = item_total / len(participants)
-            for person in participants:
-                if person in people:
-                    people[person]["consumed"] += share
-    summary = []
-    for name, data in people.items():
-        net = round(data["paid"] - data["consumed"], 2)
-        summary.append(
-            {
-                "name": name,
-                "paid": round(data["paid"], 2),
-                "consumed": round(data["consumed"], 2),
-                "net": net
-            }
-        )
-    summary.sort(key=lambda x: x["name"].lower())
-    return summary
+def needs_startup(path):
+    """Paths served from state or uploads, which wait for the gating start-up tasks."""
+    return path.startswith("/api/") or path.startswith("/uploads/")
 
 
-class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
-    daemon_threads = True
+TRIP_PATH_RE = LazyPattern(r"^/api/trips/([^/]+)(/.*)?$")
+ADMIN_PROFILE_PATH_RE = LazyPattern(r"^/api/admin/profiles/[^/]+$")
+RECEIPT_PATH_RE = LazyPattern(r"^/api/receipts/[^/]+$")
+RECEIPT_PARTICIPANTS_PATH_RE = LazyPattern(r"^/api/receipts/[^/]+/participants$")
+RECEIPT_PAID_BY_PATH_RE = LazyPattern(r"^/api/receipts/[^/]+/paid_by$")
+RECEIPT_BULK_PATH_RE = LazyPattern(r"^/api/receipts/[^/]+/bulk$")
+EXPORT_PATH_RE = LazyPattern(r"^/api/export/[^/]+$")
 
 
 class AppHandler(SimpleHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests, so every response must carry a
+    # Content-Length (send_body, send_error and the static file path all do) or be
+    # chunked (send_stream).
+    protocol_version = "HTTP/1.1"
+    timeout = HTTP_REQUEST_TIMEOUT
+    # Headers and body go out in separate writes; with Nagle on, a kept-alive connection
+    # would wait for the client's delayed ACK (~40 ms) before sending the body.
+    disable_nagle_algorithm = True
+
     def __init__(self, *args, **kwargs):
+        self._requests_served = 0
+        self._idle_selector = None
         super().__init__(*args, directory=str(STATIC_DIR), **kwargs)
 
+    def setup(self):
+        super().setup()
+        if isinstance(self.connection, ssl.SSLSocket):
+            self.connection.do_handshake()
+
     def log_message(self, fmt, *args):
-        sys.stderr.write("%s - - [%s] %s\n" % (self.client_address[0], self.log_date_time_string(), fmt % args))
+        log_event("http_access", fmt, *args, level=logging.INFO, client=self.client_address[0])
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            if self._idle_selector is not None:
+                self._idle_selector.close()
+
+    def _has_buffered_request(self):
+        """True when the next request's bytes are already buffered (pipelined or TLS)."""
+        sock = self.connection
+        if isinstance(sock, ssl.SSLSocket) and sock.pending():
+            return True
+        sock.settimeout(0)
+        try:
+            # Only returns what is buffered: the raw read of a non-blocking socket comes back empty.
+            return bool(self.rfile.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(HTTP_REQUEST_TIMEOUT)
+
+    def wait_for_request(self):
+        """
+        Wait on an idle keep-alive connection for the next request, in HTTP_KEEPALIVE_POLL
+        slices. Returns False after HTTP_KEEPALIVE_TIMEOUT, or as soon as connections are
+        queued for a worker, so an idle client never keeps a worker from them.
+        """
+        if self._has_buffered_request():
+            return True
+        if self._idle_selector is None:
+            self._idle_selector = selectors.DefaultSelector()
+            self._idle_selector.register(self.connection, selectors.EVENT_READ)
+        under_pressure = getattr(self.server, "under_pressure", lambda: False)
+        deadline = time.monotonic() + HTTP_KEEPALIVE_TIMEOUT
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                log_event("http_keepalive_timeout", client=self.client_address[0])
+                return False
+            if self._idle_selector.select(min(HTTP_KEEPALIVE_POLL, remaining)):
+                return True
+            if under_pressure():
+                log_event("http_keepalive_released", client=self.client_address[0])
+                return False
+
+    def handle_one_request(self):
+        self._status = None
+        self._profile = None
+        self._request_start = None
+        self._body_pending = 0
+        if self._requests_served and not self.wait_for_request():
+            self.close_connection = True
+            return
+        try:
+            super().handle_one_request()
+        finally:
+            if self._profile is not None:
+                self._profile.stop(self._status)
+                self._profile = None
+        if self._status is not None and self.command:
+            self._requests_served += 1
+            METRICS.observe(
+                "http_request_duration_seconds",
+                time.perf_counter() - self._request_start,
+                route=route_template(urllib.parse.urlsplit(self.path).path),
+                method=self.command,
+                status=self._status,
+            )
+
+    def parse_request(self):
+        # Timed from here so the wait for the request line on a kept-alive connection isn't counted.
+        self._request_start = time.perf_counter()
+        self.connection.settimeout(HTTP_REQUEST_TIMEOUT)
+        if not super().parse_request():
+            return False
+        try:
+            self._body_pending = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self._body_pending = 1
+        if self.headers.get("Transfer-Encoding"):
+            self._body_pending = 1  # chunked request bodies aren't supported; don't reuse the connection
+        split = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(split.query))
+        reason = PROFILER.reason(
+            split.path, self.headers.get("X-Profile"), query.get("profile"), self.admin_token(query)
+        )
+        if reason:
+            self._profile = PROFILER.start(self.command, split.path, reason)
+        return True
+
+    def admin_token(self, query):
+        return self.headers.get("X-Admin-Token") or query.get("admin_token")
+
+    def send_response(self, code, message=None):
+        self._cache_control_sent = False
+        self._connection_sent = False
+        self._status = code
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "cache-control":
+            self._cache_control_sent = True
+        elif keyword.lower() == "connection":
+            self._connection_sent = True
+        super().send_header(keyword, value)
 
     def end_headers(self):
-        # Prevent stale assets on mobile by disabling caching for all responses.
-        self.send_header("Cache-Control", "no-cache, no-store, must-revalidate")
-        self.send_header("Pragma", "no-cache")
-        self.send_header("Expires", "0")
+        # Responses that don't choose a policy must be revalidated on every use, so mobile
+        # browsers never show stale data but can still get cheap 304s.
+        if not getattr(self, "_cache_control_sent", False):
+            self.send_header("Cache-Control", "no-cache")
+        if getattr(self, "_profile", None) is not None:
+            self.send_header("X-Profile-Id", self._profile.id)
+        if not getattr(self, "_connection_sent", False) and (
+            self.close_connection
+            or getattr(self, "_body_pending", 0)
+            or self._requests_served + 1 >= HTTP_KEEPALIVE_MAX
+            or getattr(self.server, "under_pressure", lambda: False)()
+        ):
+            # Unread request bodies would be parsed as the next request; under load, idle
+            # keep-alive connections would hold workers that queued connections need.
+            self.send_header("Connection", "close")
         super().end_headers()
 
     # ------- helpers -------
-    def send_json(self, data, status=200):
-        body = json.dumps(data).encode("utf-8")
+    def send_json(self, data, status=200, headers=None):
+        """
+        Send ``data`` as JSON. Pre-encoded payloads may be passed as bytes or as a list
+        of byte chunks; chunks go out in one gather write instead of being joined first.
+        """
+        if isinstance(data, (bytes, bytearray)):
+            chunks = [data]
+        elif isinstance(data, list) and all(isinstance(c, (bytes, bytearray)) for c in data):
+            chunks = data
+        else:
+            chunks = [json_dumps(data)]
+        return self.send_body(chunks, "application/json; charset=utf-8", status=status, headers=headers)
+
+    def send_body(self, chunks, content_type, status=200, headers=None):
+        """Send byte chunks, compressed when the client accepts it and the body is big enough."""
+        length = sum(len(c) for c in chunks)
+        encoding = None
+        if length >= COMPRESS_MIN_BYTES and is_compressible(content_type):
+            encoding = choose_encoding(self.headers.get("Accept-Encoding"))
+        if encoding:
+            chunks = [compress_chunks(chunks, encoding)]
+            length = len(chunks[0])
         self.send_response(status)
-        self.send_header("Content-Type", "application/json; charset=utf-8")
-        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        if is_compressible(content_type):
+            self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.write_chunks(chunks)
+
+    def send_stream(self, chunks, content_type, status=200, headers=None):
+        """
+        Send an iterable of byte chunks with chunked transfer encoding, gzip-compressed
+        on the fly for clients that accept it. HTTP/1.0 clients get the raw body and
+        the connection closes after it.
+        """
+        encoding = choose_encoding(self.headers.get("Accept-Encoding"), ("gzip",)) if is_compressible(content_type) else None
+        chunked = self.request_version != "HTTP/1.0"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.close_connection = True
+        if is_compressible(content_type):
+            self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if encoding else None
+
+        def write(data):
+            if data:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data) if chunked else data)
+
+        try:
+            for chunk in chunks:
+                write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                write(compressor.flush())
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except Exception as e:
+            # The status line is already out; a missing final chunk tells the client the body is incomplete.
+            self.close_connection = True
+            log_event("stream_aborted", level=logging.WARNING, path=self.path, error=str(e))
+
+    def send_not_modified(self, headers):
+        self.send_response(304)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def check_not_modified(self, etag, last_modified=None):
+        return is_not_modified(
+            self.headers.get("If-None-Match"), self.headers.get("If-Modified-Since"), etag, last_modified
+        )
+
+    def requested_range(self, size, etag, last_modified=None):
+        """The ``Range`` that applies to this request: ``(start, end)``, None or False (416)."""
+        header = self.headers.get("Range")
+        if not header:
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range and not if_range_matches(if_range, etag, last_modified):
+            return None
+        return parse_range(header, size)
+
+    def send_range_not_satisfiable(self, size):
+        self.send_response(416)
+        self.send_header("Content-Range", f"bytes */{size}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_hot(self, asset, cache_control):
+        """Serve a :class:`HotAsset`; headers were built when it was cached."""
+        encoding = asset.encoding_for(self.headers.get("Accept-Encoding"))
+        if self.check_not_modified(asset.headers[encoding]["ETag"], asset.last_modified):
+            return self.send_not_modified(asset.validators(encoding, cache_control))
+        body = asset.bodies[None]
+        byte_range = self.requested_range(len(body), asset.etag, asset.last_modified)
+        if byte_range is False:
+            return self.send_range_not_satisfiable(len(body))
+        if byte_range:
+            start, end = byte_range
+            body = body[start:end + 1]
+            headers = dict(asset.headers[None])
+            headers["Content-Length"] = str(len(body))
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(asset.bodies[None])}"
+            self.send_response(206)
+        else:
+            body, headers = asset.bodies[encoding], asset.headers[encoding]
+            self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Cache-Control", cache_control)
         self.end_headers()
-        self.wfile.write(body)
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def serve_file(self, path, cache_control, etag=None):
+        """
+        Stream a file from disk with ``socket.sendfile`` (``os.sendfile`` on plain
+        sockets), honouring conditional and single-range requests. A fresh ``.gz``
+        sibling is sent instead for full responses to clients that accept gzip.
+        """
+        try:
+            stat = path.stat()
+        except OSError:
+            return self.send_error(404, "File not found")
+        etag = etag or file_etag(stat)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": http_date(stat.st_mtime),
+            "Cache-Control": cache_control,
+        }
+        content_type = file_content_type(path)
+        # Ranges are cut from the file itself, so If-Range is compared with its own ETag.
+        byte_range = self.requested_range(stat.st_size, etag, stat.st_mtime)
+        source, offset, count, status = path, 0, stat.st_size, 200
+        if not byte_range and is_compressible(content_type):
+            headers["Vary"] = "Accept-Encoding"
+            sibling = precompressed_sibling(path)
+            if sibling and choose_encoding(self.headers.get("Accept-Encoding"), ("gzip",)):
+                source, count = sibling, sibling.stat().st_size
+                headers["Content-Encoding"] = "gzip"
+                headers["ETag"] = variant_etag(etag, "gzip")
+        if self.check_not_modified(headers["ETag"], stat.st_mtime):
+            return self.send_not_modified(headers)
+        if byte_range is False:
+            return self.send_range_not_satisfiable(stat.st_size)
+        if byte_range:
+            start, end = byte_range
+            offset, count, status = start, end - start + 1, 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        if source is path:
+            headers["Accept-Ranges"] = "bytes"
+        try:
+            fh = open(source, "rb")
+        except OSError:
+            return self.send_error(404, "File not found")
+        with fh:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(count))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            if self.command != "HEAD" and count:
+                # SSL sockets fall back to send() inside socket.sendfile.
+                self.connection.sendfile(fh, offset, count)
+
+    def serve_static(self, rel_path):
+        asset = STATIC_ASSETS.resolve(rel_path)
+        if asset is None:
+            return self.send_error(404, "File not found")
+        path, digest, immutable = asset
+        cache_control = IMMUTABLE_CACHE_CONTROL if immutable else "no-cache"
+        hot = STATIC_ASSETS.hot(path, digest)
+        if hot is None:
+            return self.serve_file(path, cache_control, etag=f'"{digest}"')
+        return self.send_hot(hot, cache_control)
+
+    def serve_upload(self, rel_path):
+        name = urllib.parse.unquote(rel_path).lstrip("/")
+        digest = BLOBS.digest_for(name)
+        if digest is not None:
+            return self.serve_blob(digest)
+        path = upload_path(name)
+        if path is None:
+            return self.send_error(404, "File not found")
+        return self.serve_file(path, UPLOAD_CACHE_CONTROL)
+
+    def serve_blob(self, digest):
+        """
+        Serve an uploaded blob. Gzip blobs go out as stored (sendfile) to clients that
+        accept gzip; everything else is decompressed while it is streamed. A single
+        range of the original bytes is served (206) by decompressing up to its start.
+        The blob is opened before any header is sent, so an :class:`ApiError` from
+        ``BLOBS.open`` (a ``.zst`` blob without ``zstandard``) still reaches :meth:`dispatch`.
+        """
+        located = BLOBS.locate(digest)
+        if located is None:
+            return self.send_error(404, "File not found")
+        path, suffix = located
+        size = BLOBS.size(digest)
+        identity_etag = f'"{digest}"'
+        byte_range = self.requested_range(size, identity_etag) if size is not None else None
+        passthrough = not byte_range and suffix == ".gz" and choose_encoding(self.headers.get("Accept-Encoding"), ("gzip",))
+        etag = variant_etag(identity_etag, "gzip" if passthrough else None)
+        headers = {"ETag": etag, "Cache-Control": UPLOAD_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+        if self.check_not_modified(etag):
+            return self.send_not_modified(headers)
+        if byte_range is False:
+            return self.send_range_not_satisfiable(size)
+        status = 200
+        if passthrough:
+            headers["Content-Encoding"] = "gzip"
+            length = path.stat().st_size
+            fh = path.open("rb")
+        else:
+            length = size
+            fh = BLOBS.open(digest)
+            if size is not None:
+                headers["Accept-Ranges"] = "bytes"
+            if byte_range:
+                start, end = byte_range
+                fh.seek(start)
+                length, status = end - start + 1, 206
+                headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        with fh:
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            if length is not None:
+                self.send_header("Content-Length", str(length))
+            else:
+                self.close_connection = True
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            if self.command == "HEAD":
+                return
+            if passthrough:
+                self.connection.sendfile(fh, 0, length)
+            else:
+                for data in BlobStore.iter_chunks(fh, length):
+                    self.wfile.write(data)
+
+    def serve_index(self):
+        return self.send_hot(STATIC_ASSETS.hot_index(), "no-cache")
+
+    def write_chunks(self, chunks):
+        sock = self.connection
+        if len(chunks) == 1 or not hasattr(sock, "sendmsg") or isinstance(sock, ssl.SSLSocket):
+            self.wfile.write(b"".join(chunks) if len(chunks) > 1 else chunks[0])
+            return
+        pending = [memoryview(c) for c in chunks if c]
+        while pending:
+            sent = sock.sendmsg(pending[:SENDMSG_MAX_BUFFERS])
+            while sent and pending:
+                head = pending[0]
+                if sent >= len(head):
+                    sent -= len(head)
+                    pending.pop(0)
+                else:
+                    pending[0] = head[sent:]
+                    sent = 0
+
+    def content_length(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0) or 0)
+        except ValueError:
+            raise ApiError(400, "Invalid Content-Length")
+        if length < 0:
+            raise ApiError(400, "Invalid Content-Length")
+        if MAX_REQUEST_BYTES and length > MAX_REQUEST_BYTES:
+            # The body stays unread, so the connection cannot be reused.
+            self.close_connection = True
+            raise ApiError(413, f"Request too large (limit {MAX_REQUEST_BYTES} bytes)")
+        return length
+
+    def read_form(self):
+        """Parse a multipart/form-data body with the streaming parser; caller closes the form."""
+        _ctype, params = parse_header_params(self.headers.get("Content-Type", ""))
+        length = self.content_length()
+        try:
+            form = MultipartParser(self.rfile, params.get("boundary", ""), length).parse()
+        except ApiError:
+            self.close_connection = True
+            raise
+        self._body_pending = 0
+        return form
 
     def read_json(self):
-        length = int(self.headers.get("Content-Length", 0) or 0)
+        length = self.content_length()
         raw = self.rfile.read(length) if length else b""
+        self._body_pending = 0
         if not raw:
             return {}
         try:
@@ -673,82 +4685,200 @@ class AppHandler(SimpleHTTPRequestHandler):
             return {}
 
     # ------- routing -------
+    @staticmethod
+    def split_trip_path(path):
+        """
+        Map ``/api/trips/<id>/rest`` onto ``(<id>, /api/rest)``; plain ``/api/...`` paths
+        address the default trip.
+        """
+        match = TRIP_PATH_RE.match(path)
+        if match and match.group(2):
+            return match.group(1), "/api" + match.group(2)
+        return DEFAULT_TRIP_ID, path
+
+    def dispatch(self, handler, *args):
+        try:
+            return handler(*args)
+        except ApiError as e:
+            return self.send_json({"error": e.message}, status=e.status)
+
+    def wait_ready(self, path):
+        """
+        Hold state-backed requests until start-up has finished. Returns False after
+        answering 503 when it does not finish within READY_TIMEOUT.
+        """
+        if not needs_startup(path) or STARTUP.wait():
+            return True
+        self.send_json({"error": "Starting up, retry shortly"}, status=503, headers={"Retry-After": "1"})
+        return False
+
     def do_GET(self):
         parsed = urllib.parse.urlparse(self.path)
         path = parsed.path
-        if path == "/api/state":
-            state = load_state()
-            payload = {
-                "people": state.get("people", []),
-                "receipts": state.get("receipts", []),
-                "summary": compute_summary(state)
-            }
-            return self.send_json(payload)
+        path_clean = path.rstrip("/") or "/"
+        if path_clean == "/api/trips":
+            return self.dispatch(lambda: self.send_json({"trips": TRIPS.list_trips()}))
+        if path_clean == "/metrics":
+            return self.send_body([METRICS.render()], PROMETHEUS_CONTENT_TYPE)
+        if path_clean == "/healthz":
+            return self.send_json({"ok": True})
+        if path_clean == "/readyz":
+            status = STARTUP.status()
+            return self.send_json(status, status=200 if status["ready"] else 503)
+        if not self.wait_ready(path):
+            return None
+        if path_clean == "/api/admin/profiles":
+            return self.dispatch(self.handle_admin_profiles, parsed.query)
+        if ADMIN_PROFILE_PATH_RE.match(path_clean):
+            return self.dispatch(self.handle_admin_profile, path_clean, parsed.query)
+        trip_id, api_path = self.split_trip_path(path_clean)
+        if api_path == "/api/state":
+            return self.dispatch(self.handle_state, trip_id)
+        if api_path == "/api/receipts":
+            return self.dispatch(self.handle_list_receipts, trip_id, parsed.query)
+        if api_path == "/api/search":
+            return self.dispatch(self.handle_search, trip_id, parsed.query)
+        if EXPORT_PATH_RE.match(api_path):
+            return self.dispatch(self.handle_export, api_path, trip_id, parsed.query)
+        if RECEIPT_PATH_RE.match(api_path):
+            return self.dispatch(self.handle_receipt_detail, api_path, trip_id, parsed.query)
         if path.startswith("/static/"):
-            self.path = path[len("/static"):] or "/"
-            return super().do_GET()
+            return self.serve_static(path[len("/static/"):])
         if path.startswith("/uploads/"):
-            return super().do_GET()
-        if path == "/" or path == "":
-            self.path = "/index.html"
-            return super().do_GET()
+            return self.dispatch(self.serve_upload, path[len("/uploads/"):])
+        if path in ("/", "", "/index.html"):
+            return self.serve_index()
         return super().do_GET()
 
+    def do_HEAD(self):
+        path = urllib.parse.urlparse(self.path).path
+        if not self.wait_ready(path):
+            return None
+        if path.startswith("/static/"):
+            return self.serve_static(path[len("/static/"):])
+        if path.startswith("/uploads/"):
+            return self.dispatch(self.serve_upload, path[len("/uploads/"):])
+        if path in ("/", "", "/index.html"):
+            return self.serve_index()
+        return super().do_HEAD()
+
     def do_POST(self):
         parsed = urllib.parse.urlparse(self.path)
         path = parsed.path
         path_clean = path.rstrip("/") or "/"
-        if path_clean == "/api/people":
-            return self.handle_add_person()
-        if path_clean == "/api/receipts":
-            return self.handle_add_receipt()
-        if path_clean == "/api/qr/decode":
-            return self.handle_qr_decode()
-        if re.match(r"^/api/receipts/[^/]+/participants$", path_clean):
-            return self.handle_update_participants(path_clean)
-        if re.match(r"^/api/receipts/[^/]+/paid_by$", path_clean):
-            return self.handle_update_paid_by(path_clean)
-        if re.match(r"^/api/receipts/[^/]+/bulk$", path_clean):
-            return self.handle_bulk_participants(path_clean)
+        if not self.wait_ready(path):
+            return None
+        if path_clean == "/api/trips":
+            return self.dispatch(self.handle_create_trip)
+        trip_id, api_path = self.split_trip_path(path_clean)
+        if api_path == "/api/people":
+            return self.dispatch(self.handle_add_person, trip_id)
+        if api_path == "/api/receipts":
+            return self.dispatch(self.handle_add_receipt, trip_id)
+        if api_path == "/api/qr/decode":
+            return self.dispatch(self.handle_qr_decode)
+        if api_path == "/api/import":
+            return self.dispatch(self.handle_import, trip_id, parsed.query)
+        if RECEIPT_PARTICIPANTS_PATH_RE.match(api_path):
+            return self.dispatch(self.handle_update_participants, api_path, trip_id)
+        if RECEIPT_PAID_BY_PATH_RE.match(api_path):
+            return self.dispatch(self.handle_update_paid_by, api_path, trip_id)
+        if RECEIPT_BULK_PATH_RE.match(api_path):
+            return self.dispatch(self.handle_bulk_participants, api_path, trip_id)
         return self.send_json({"error": "Not found"}, status=404)
 
     # ------- handlers -------
-    def handle_add_person(self):
+    def handle_state(self, trip_id):
+        trip = get_trip(trip_id)
+        with trip.lock:
+            etag, modified_at = trip.etag, trip.modified_at
+            headers = {"ETag": etag, "Last-Modified": http_date(modified_at)}
+            if self.check_not_modified(etag, modified_at):
+                return self.send_not_modified(headers)
+            chunks = trip.snapshot_json()
+        return self.send_json(chunks, headers=headers)
+
+    def handle_list_receipts(self, trip_id, query):
+        params = dict(urllib.parse.parse_qsl(query))
+        return self.send_json(get_trip(trip_id).list_receipts(params))
+
+    def handle_search(self, trip_id, query):
+        params = dict(urllib.parse.parse_qsl(query))
+        return self.send_json(get_trip(trip_id).search(params))
+
+    def handle_export(self, path, trip_id, query):
+        kind = path.rsplit("/", 1)[1]
+        params = dict(urllib.parse.parse_qsl(query))
+        content_type, filename, chunks = get_trip(trip_id).export(kind, params.get("format") or "csv")
+        return self.send_stream(chunks, content_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+    def handle_import(self, trip_id, query):
+        params = dict(urllib.parse.parse_qsl(query))
+        trip = get_trip(trip_id)
+        remaining = self.content_length()
+        importer = TripImport()
+        while remaining > 0:
+            data = self.rfile.read(min(remaining, EXPORT_CHUNK_BYTES))
+            if not data:
+                break
+            remaining -= len(data)
+            importer.feed(data)
+        self._body_pending = remaining
+        result = trip.import_state(importer.state(), params.get("mode") or "replace")
+        return self.send_json({"ok": True, **result})
+
+    def handle_receipt_detail(self, path, trip_id, query):
+        receipt_id = path.split("/")[3]
+        params = dict(urllib.parse.parse_qsl(query))
+        return self.send_json(get_trip(trip_id).receipt_detail(receipt_id, params.get("fields")))
+
+    def handle_admin_profiles(self, query):
+        require_admin(self.admin_token(dict(urllib.parse.parse_qsl(query))))
+        return self.send_json(
+            {"profiles": PROFILER.list(), "sample_rate": PROFILER.sample_rate, "keep": PROFILER.keep},
+            headers={"Cache-Control": "no-store"},
+        )
+
+    def handle_admin_profile(self, path, query):
+        params = dict(urllib.parse.parse_qsl(query))
+        require_admin(self.admin_token(params))
+        profile_id = path.rsplit("/", 1)[1]
+        if params.get("format") == "text":
+            report = PROFILER.report(profile_id, params.get("sort") or "cumulative", params.get("limit") or 50)
+            return self.send_body(
+                [report.encode("utf-8")], "text/plain; charset=utf-8", headers={"Cache-Control": "no-store"}
+            )
+        return self.send_body(
+            [PROFILER.path_for(profile_id).read_bytes()],
+            "application/octet-stream",
+            headers={"Cache-Control": "no-store", "Content-Disposition": f'attachment; filename="{profile_id}.prof"'},
+        )
+
+    def handle_create_trip(self):
         data = self.read_json()
-        name = (data.get("name") or "").strip()
-        if not name:
-            return self.send_json({"error": "Name required"}, status=400)
-        state = load_state()
-        if name not in state["people"]:
-            state["people"].append(name)
-            save_state(state)
-        return self.send_json({"ok": True, "people": state["people"]})
-
-    def handle_add_receipt(self):
-        ctype, _pdict = cgi.parse_header(self.headers.get("Content-Type", ""))
+        trip = TRIPS.create_trip(name=data.get("name", ""), people=data.get("people") or [], trip_id=data.get("id"))
+        return self.send_json({"ok": True, "trip": trip})
+
+    def handle_add_person(self, trip_id):
+        data = self.read_json()
+        people = get_trip(trip_id).add_person(data.get("name"))
+        return self.send_json({"ok": True, "people": people})
+
+    def handle_add_receipt(self, trip_id):
+        ctype, _params = parse_header_params(self.headers.get("Content-Type", ""))
         file_bytes = None
         if ctype.startswith("multipart/"):
-            form = cgi.FieldStorage(
-                fp=self.rfile,
-                headers=self.headers,
-                environ={
-                    "REQUEST_METHOD": "POST",
-                    "CONTENT_TYPE": self.headers.get("Content-Type"),
-                    "CONTENT_LENGTH": self.headers.get("Content-Length", "0"),
-                },
-            )
-            html_text = form.getvalue("html_text", "")
-            paid_by = form.getvalue("paid_by", "")
-            title = form.getvalue("title", "")
-            notes = form.getvalue("notes", "")
-            html_file = form["html_file"] if "html_file" in form else None
-            if html_file is not None and getattr(html_file, "file", None):
-                file_bytes = html_file.file.read()
-                if not html_text:
-                    try:
-                        html_text = file_bytes.decode("utf-8", errors="ignore")
-                    except Exception:
-                        html_text = ""
+            form = self.read_form()
+            try:
+                html_text = form.get("html_text", "")
+                paid_by = form.get("paid_by", "")
+                title = form.get("title", "")
+                notes = form.get("notes", "")
+                html_file = form.files.get("html_file")
+                if html_file is not None and html_file.size:
+                    file_bytes = html_file.read()
+            finally:
+                form.close()
         else:
             data = self.read_json()
             html_text = data.get("html_text", "")
@@ -763,56 +4893,56 @@ class AppHandler(SimpleHTTPRequestHandler):
             title=title,
             notes=notes,
             file_bytes=file_bytes,
+            trip_id=trip_id,
         )
         return self.send_json({"ok": True, "receipt": receipt})
 
     def handle_qr_decode(self):
-        ctype, _pdict = cgi.parse_header(self.headers.get("Content-Type", ""))
-        debug(f"qr decode hit path={self.path} content-type={ctype}")
+        ctype, _params = parse_header_params(self.headers.get("Content-Type", ""))
+        log_event("qr_request", path=self.path, content_type=ctype)
         if not ctype.startswith("multipart/"):
-            debug("qr decode: bad content-type (not multipart)")
+            log_event("qr_request_rejected", reason="not multipart")
             return self.send_json({"error": "Upload an image file"}, status=400)
-        form = cgi.FieldStorage(
-            fp=self.rfile,
-            headers=self.headers,
-            environ={
-                "REQUEST_METHOD": "POST",
-                "CONTENT_TYPE": self.headers.get("Content-Type"),
-                "CONTENT_LENGTH": self.headers.get("Content-Length", "0"),
-            },
-        )
-        if "file" not in form:
-            debug("qr decode: no file field")
-            return self.send_json({"error": "No file provided"}, status=400)
-        file_field = form["file"]
-        if not getattr(file_field, "file", None):
-            debug("qr decode: invalid file field (no file)")
-            return self.send_json({"error": "Invalid file"}, status=400)
-        file_bytes = file_field.file.read()
+        form = self.read_form()
+        try:
+            file_field = form.files.get("file")
+            if file_field is None:
+                log_event("qr_request_rejected", reason="no file field")
+                return self.send_json({"error": "No file provided"}, status=400)
+            file_bytes = file_field.read()
+        finally:
+            form.close()
         size_bytes = len(file_bytes) if file_bytes else 0
-        debug(f"qr decode filename={getattr(file_field, 'filename', '')} bytes={size_bytes}")
+        log_event("qr_upload", filename=file_field.filename, bytes=size_bytes)
         if not file_bytes:
             return self.send_json({"error": "Empty file"}, status=400)
         if size_bytes > 1_200_000:
-            debug("qr decode: warning image over recommended 1MB, API may reject")
+            log_event("qr_upload_large", "image over recommended 1MB, API may reject", level=logging.WARNING, bytes=size_bytes)
+        decode_source = None
+        local_err = None
         try:
             decoded_data, decode_source, local_err = decode_qr_best_effort(
                 file_bytes, filename=file_field.filename or "qr.png"
             )
-        except urllib.error.URLError as e:
-            debug(f"qr decode URLError {e} (source={decode_source or 'remote'})")
-            return self.send_json(
-                {"error": f"QR decode failed: network error ({e})", "source": decode_source or "remote", "local_error": local_err},
-                status=502,
-            )
         except Exception as e:
-            debug(f"qr decode unexpected error {e} (source={decode_source or 'remote'})")
+            log_event("qr_decode_error", level=logging.ERROR, source=decode_source or "remote", local_error=local_err, error=str(e))
             return self.send_json(
                 {"error": f"QR decode failed unexpectedly ({e})", "source": decode_source or "remote", "local_error": local_err},
                 status=500,
             )
+        if decode_source == "remote_skipped":
+            return self.send_json(
+                {"error": "Could not read QR code locally and the QR API is unavailable", "source": decode_source, "local_error": local_err},
+                status=503,
+            )
+        if decode_source == "remote_error":
+            log_event("qr_decode_url_error", level=logging.WARNING, source=decode_source, local_error=local_err)
+            return self.send_json(
+                {"error": "QR decode failed: network error", "source": decode_source, "local_error": local_err},
+                status=502,
+            )
         if not decoded_data:
-            debug(f"qr decode: could not read QR code (empty data) source={decode_source or 'unknown'}")
+            log_event("qr_decode_empty", level=logging.WARNING, source=decode_source or "unknown", local_error=local_err)
             return self.send_json(
                 {"error": "Could not read QR code (no data returned)", "source": decode_source or "unknown", "local_error": local_err},
                 status=422,
@@ -823,20 +4953,23 @@ class AppHandler(SimpleHTTPRequestHandler):
         try:
             if decoded_str.startswith("http://") or decoded_str.startswith("https://"):
                 html_text = fetch_html(decoded_str)
-                debug(
-                    f"qr decode fetched html len={len(html_text) if html_text else 0} "
-                    f"source={decode_source or 'remote'} url={decoded_str}"
+                log_event(
+                    "qr_fetched_html",
+                    level=logging.INFO,
+                    length=len(html_text) if html_text else 0,
+                    source=decode_source or "remote",
+                    url=decoded_str,
                 )
             else:
                 # Some QR codes embed the invoice HTML directly
                 html_text = decoded_str or None
         except urllib.error.URLError as e:
             fetch_error = str(e)
-            debug(f"qr decode fetch html URLError (likely offline or bad URL) err={e}")
+            log_event("qr_fetch_url_error", "likely offline or bad URL", level=logging.WARNING, error=str(e))
             html_text = None
         snippet = (html_text or "")[:200].replace("\n", " ")
         if snippet:
-            debug(f"qr decode html snippet: {snippet!r}")
+            log_event("qr_html_snippet", snippet=snippet)
         return self.send_json(
             {
                 "ok": True,
@@ -849,84 +4982,49 @@ class AppHandler(SimpleHTTPRequestHandler):
             }
         )
 
-    def handle_update_participants(self, path):
+    def handle_update_participants(self, path, trip_id):
         parts = path.rstrip("/").split("/")
         receipt_id = parts[3]
         data = self.read_json()
-        item_id = data.get("item_id")
-        participants = data.get("participants") or []
-        state = load_state()
-        receipt = next((r for r in state["receipts"] if r["id"] == receipt_id), None)
-        if not receipt:
-            return self.send_json({"error": "Receipt not found"}, status=404)
-        item = next((i for i in receipt.get("items", []) if i["id"] == item_id), None)
-        if not item:
-            return self.send_json({"error": "Item not found"}, status=404)
-        # Filter out unknown names
-        valid = [p for p in participants if p in state["people"]]
-        item["participants"] = valid
-        save_state(state)
+        get_trip(trip_id).set_participants(receipt_id, data.get("item_id"), data.get("participants") or [])
         return self.send_json({"ok": True})
 
-    def handle_update_paid_by(self, path):
+    def handle_update_paid_by(self, path, trip_id):
         parts = path.rstrip("/").split("/")
         receipt_id = parts[3]
         data = self.read_json()
-        paid_by = (data.get("paid_by") or "").strip()
-        state = load_state()
-        receipt = next((r for r in state["receipts"] if r["id"] == receipt_id), None)
-        if not receipt:
-            return self.send_json({"error": "Receipt not found"}, status=404)
-        if paid_by and paid_by in state["people"]:
-            receipt["paid_by"] = paid_by
-        save_state(state)
+        get_trip(trip_id).set_paid_by(receipt_id, data.get("paid_by"))
         return self.send_json({"ok": True})
 
-    def handle_delete_receipt(self, path):
+    def handle_delete_receipt(self, path, trip_id):
         parts = path.rstrip("/").split("/")
         receipt_id = parts[3]
-        state = load_state()
-        before = len(state.get("receipts", []))
-        state["receipts"] = [r for r in state.get("receipts", []) if r.get("id") != receipt_id]
-        if len(state["receipts"]) == before:
-            return self.send_json({"error": "Receipt not found"}, status=404)
-        save_state(state)
+        get_trip(trip_id).delete_receipt(receipt_id)
         return self.send_json({"ok": True})
 
-    def handle_bulk_participants(self, path):
+    def handle_bulk_participants(self, path, trip_id):
         parts = path.rstrip("/").split("/")
         receipt_id = parts[3]
         data = self.read_json()
-        mode = data.get("mode")
-        state = load_state()
-        receipt = next((r for r in state["receipts"] if r["id"] == receipt_id), None)
-        if not receipt:
-            return self.send_json({"error": "Receipt not found"}, status=404)
-        if mode == "all":
-            for item in receipt.get("items", []):
-                item["participants"] = list(state["people"])
-        elif mode == "none":
-            for item in receipt.get("items", []):
-                item["participants"] = []
-        else:
-            return self.send_json({"error": "Invalid mode"}, status=400)
-        save_state(state)
+        get_trip(trip_id).bulk_participants(receipt_id, data.get("mode"))
         return self.send_json({"ok": True})
 
     def do_DELETE(self):
         parsed = urllib.parse.urlparse(self.path)
         path = parsed.path
-        if re.match(r"^/api/receipts/[^/]+$", path.rstrip("/")):
-            return self.handle_delete_receipt(path)
+        if not self.wait_ready(path):
+            return None
+        trip_id, api_path = self.split_trip_path(path.rstrip("/"))
+        if RECEIPT_PATH_RE.match(api_path):
+            return self.dispatch(self.handle_delete_receipt, api_path, trip_id)
         return self.send_json({"error": "Not found"}, status=404)
 
 
-def create_server(port):
-    return ThreadingHTTPServer(("0.0.0.0", port), AppHandler)
+def create_server(port, workers=HTTP_WORKERS, queue_size=HTTP_ACCEPT_QUEUE):
+    return PooledHTTPServer(("0.0.0.0", port), AppHandler, workers=workers, queue_size=queue_size)
 
 
 def run(port, ssl_cert=None, ssl_key=None, ssl_port=None, disable_http=False):
-    ensure_dirs()
     servers = []
     threads = []
 
@@ -938,7 +5036,7 @@ def run(port, ssl_cert=None, ssl_key=None, ssl_port=None, disable_http=False):
         http_server = create_server(http_port)
         servers.append(("http", http_server, http_port))
     else:
-        debug("http listener disabled via DISABLE_HTTP=1")
+        log_event("http_disabled", "http listener disabled via DISABLE_HTTP=1", level=logging.INFO)
 
     if ssl_cert and ssl_key:
         try:
@@ -948,14 +5046,17 @@ def run(port, ssl_cert=None, ssl_key=None, ssl_port=None, disable_http=False):
             https_server = create_server(https_port)
             context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
             context.load_cert_chain(certfile=ssl_cert, keyfile=ssl_key)
-            https_server.socket = context.wrap_socket(https_server.socket, server_side=True)
+            # The handshake runs on the worker (AppHandler.setup), not in the accept loop.
+            https_server.socket = context.wrap_socket(
+                https_server.socket, server_side=True, do_handshake_on_connect=False
+            )
             servers.append(("https", https_server, https_port))
         except FileNotFoundError as e:
-            debug(f"ssl setup failed (missing file): {e}")
+            log_event("ssl_setup_failed", "missing file", level=logging.ERROR, error=str(e))
         except ssl.SSLError as e:
-            debug(f"ssl setup failed: {e}")
+            log_event("ssl_setup_failed", level=logging.ERROR, error=str(e))
         except Exception as e:  # pragma: no cover - safety net
-            debug(f"ssl setup unexpected error: {e}")
+            log_event("ssl_setup_failed", "unexpected error", level=logging.ERROR, error=str(e))
 
     if not servers:
         raise RuntimeError("No servers started; check port configuration.")
@@ -964,24 +5065,190 @@ def run(port, ssl_cert=None, ssl_key=None, ssl_port=None, disable_http=False):
         thread = threading.Thread(target=server.serve_forever, daemon=True)
         thread.start()
         threads.append((scheme, server, listen_port, thread))
-        print(f"Server ready on {scheme}://localhost:{listen_port}")
+        log_event("server_ready", level=logging.INFO, url=f"{scheme}://localhost:{listen_port}")
+    begin_startup()
 
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("\nStopping server...")
+        log_event("server_stopping", level=logging.INFO)
     finally:
         for _scheme, server, _listen_port, _thread in threads:
             server.shutdown()
             server.server_close()
+        flush_logging()
+
+
+class CompressionMiddleware:
+    """
+    ASGI counterpart of ``AppHandler.send_body``: gzip/brotli-encode compressible
+    responses of at least ``minimum_size`` bytes. Streaming bodies are compressed
+    chunk by chunk as they are sent.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        encoding = choose_encoding(request_headers.get("accept-encoding"))
+        if not encoding:
+            return await self.app(scope, receive, send)
+
+        start = None
+        passthrough = False
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, passthrough, compressor
+            if passthrough or message["type"] != "http.response.body":
+                if message["type"] == "http.response.start":
+                    start = message
+                    return
+                return await send(message)
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = [(k.lower(), v) for k, v in start["headers"]]
+                content_type = next((v.decode("latin-1") for k, v in headers if k == b"content-type"), "")
+                already_encoded = any(k == b"content-encoding" for k, _ in headers)
+                too_small = not more_body and len(body) < self.minimum_size
+                if already_encoded or too_small or start["status"] in (204, 206, 304) or not is_compressible(content_type):
+                    passthrough = True
+                    await send(start)
+                    start = None
+                    return await send(message)
+                headers = [(k, v) for k, v in headers if k != b"content-length"]
+                headers.append((b"content-encoding", encoding.encode("latin-1")))
+                headers.append((b"vary", b"Accept-Encoding"))
+                if not more_body:
+                    compressed = compress_chunks([body], encoding)
+                    headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+                    await send({**start, "headers": headers})
+                    start = None
+                    return await send({"type": "http.response.body", "body": compressed})
+                await send({**start, "headers": headers})
+                start = None
+                compressor = stream_compressor(encoding)
+            out = compressor.compress(body)
+            if not more_body:
+                out += compressor.flush()
+            return await send({"type": "http.response.body", "body": out, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class MetricsMiddleware:
+    """Record http_request_duration_seconds for the ASGI app, like AppHandler does."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            METRICS.observe(
+                "http_request_duration_seconds",
+                time.perf_counter() - start,
+                route=route_template(scope.get("path", "")),
+                method=scope.get("method", ""),
+                status=status,
+            )
+
+
+class ReadinessMiddleware:
+    """ASGI counterpart of ``AppHandler.wait_ready``."""
+
+    def __init__(self, app, startup=None):
+        self.app = app
+        self.startup = startup
+
+    async def __call__(self, scope, receive, send):
+        startup = self.startup or STARTUP
+        if scope["type"] == "http" and not startup.ready and needs_startup(scope.get("path", "")):
+            import asyncio
+
+            if not await asyncio.get_running_loop().run_in_executor(None, startup.wait):
+                body = json_dumps({"detail": "Starting up, retry shortly"})
+                await send({
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode("latin-1")),
+                        (b"retry-after", b"1"),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
+
+
+class ProfilingMiddleware:
+    """ASGI counterpart of AppHandler's profiling hook; adds ``X-Profile-Id`` to profiled responses."""
+
+    def __init__(self, app, profiler=None):
+        self.app = app
+        self.profiler = profiler or PROFILER
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope.get("path", "")
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        query = dict(urllib.parse.parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        reason = self.profiler.reason(
+            path, headers.get("x-profile"), query.get("profile"), headers.get("x-admin-token") or query.get("admin_token")
+        )
+        session = self.profiler.start(scope.get("method", ""), path, reason) if reason else None
+        if session is None:
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                extra = [(b"x-profile-id", session.id.encode("latin-1"))]
+                message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            session.stop(status)
 
 
 def create_fastapi_app():
-    if FastAPI is None:
+    if not FASTAPI_AVAILABLE:
         raise RuntimeError("FastAPI is not installed. Install fastapi and uvicorn to use the ASGI app.")
-    ensure_dirs()
-    app = FastAPI()
+    from fastapi import APIRouter, Body, Depends, FastAPI, File, Form, HTTPException, Request, UploadFile
+    from fastapi.concurrency import run_in_threadpool
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+
+    @contextlib.asynccontextmanager
+    async def lifespan(_app):
+        begin_startup()
+        yield
+
+    app = FastAPI(lifespan=lifespan)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
@@ -989,58 +5256,167 @@ def create_fastapi_app():
         allow_methods=["*"],
         allow_headers=["*"],
     )
-    app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
-    app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR), check_dir=False), name="uploads")
+    app.add_middleware(CompressionMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(ProfilingMiddleware)
+    app.add_middleware(ReadinessMiddleware)
+
+    @app.exception_handler(ApiError)
+    async def api_error_handler(_request: Request, exc: ApiError):
+        return JSONResponse(status_code=exc.status, content={"detail": exc.message})
+
+    def json_response(data):
+        # Bypass FastAPI's jsonable_encoder pass: the payload is encoded exactly once.
+        if isinstance(data, list):
+            data = b"".join(data)
+        elif not isinstance(data, (bytes, bytearray)):
+            data = json_dumps(data)
+        return Response(content=bytes(data), media_type="application/json")
+
+    def current_trip(request: Request):
+        # Routes are mounted twice: under /api (default trip) and /api/trips/{trip_id}.
+        return get_trip(request.path_params.get("trip_id", DEFAULT_TRIP_ID))
+
+    def admin_token(request):
+        return request.headers.get("x-admin-token") or request.query_params.get("admin_token")
+
+    def conditional(request, etag, last_modified=None):
+        return is_not_modified(
+            request.headers.get("if-none-match"), request.headers.get("if-modified-since"), etag, last_modified
+        )
+
+    def hot_response(request, asset, cache_control):
+        encoding = asset.encoding_for(request.headers.get("accept-encoding"))
+        if conditional(request, asset.headers[encoding]["ETag"], asset.last_modified):
+            return Response(status_code=304, headers=asset.validators(encoding, cache_control))
+        headers = dict(asset.headers[encoding], **{"Cache-Control": cache_control})
+        return Response(content=asset.bodies[encoding], headers=headers)
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"ok": True}
+
+    @app.get("/readyz")
+    async def readyz():
+        status = STARTUP.status()
+        return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
 
     @app.get("/")
-    async def index():
-        return FileResponse(STATIC_DIR / "index.html")
+    async def index(request: Request):
+        return hot_response(request, STATIC_ASSETS.hot_index(), "no-cache")
 
-    @app.get("/api/state")
-    async def api_state():
-        state = load_state()
-        return {
-            "people": state.get("people", []),
-            "receipts": state.get("receipts", []),
-            "summary": compute_summary(state),
-        }
+    @app.get("/static/{asset_path:path}")
+    async def static_asset(asset_path: str, request: Request):
+        asset = STATIC_ASSETS.resolve(asset_path)
+        if asset is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        path, digest, immutable = asset
+        cache_control = IMMUTABLE_CACHE_CONTROL if immutable else "no-cache"
+        # Range requests go to FileResponse, which implements them (and 416) itself.
+        hot = None if request.headers.get("range") else STATIC_ASSETS.hot(path, digest)
+        if hot is not None:
+            return hot_response(request, hot, cache_control)
+        mtime = path.stat().st_mtime
+        headers = {"ETag": f'"{digest}"', "Last-Modified": http_date(mtime), "Cache-Control": cache_control}
+        content_type = file_content_type(path)
+        sibling = None if request.headers.get("range") else precompressed_sibling(path)
+        source = path
+        if sibling and choose_encoding(request.headers.get("accept-encoding"), ("gzip",)):
+            source = sibling
+            headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+            headers["ETag"] = variant_etag(headers["ETag"], "gzip")
+        if conditional(request, headers["ETag"], mtime):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(source, media_type=content_type, headers=headers)
 
-    @app.post("/api/people")
-    async def api_people(payload: dict = Body(...)):
-        name = (payload.get("name") or "").strip()
-        if not name:
-            raise HTTPException(status_code=400, detail="Name required")
-        state = load_state()
-        if name not in state["people"]:
-            state["people"].append(name)
-            save_state(state)
-        return {"ok": True, "people": state["people"]}
-
-    @app.post("/api/receipts")
-    async def api_receipts(
-        request: Request,
-        html_file: UploadFile | None = File(default=None),
-        html_text: str = Form(default=""),
-        paid_by: str = Form(default=""),
-        title: str = Form(default=""),
-        notes: str = Form(default=""),
-    ):
-        file_bytes = await html_file.read() if html_file else None
-        ctype = request.headers.get("content-type", "")
-        if ctype.startswith("application/json"):
-            data = await request.json()
-            html_text = data.get("html_text", "")
-            paid_by = data.get("paid_by", "")
-            title = data.get("title", "")
-            notes = data.get("notes", "")
-        receipt = create_receipt_entry(
-            html_text=html_text or file_bytes or "",
-            paid_by=paid_by,
-            title=title,
-            notes=notes,
-            file_bytes=file_bytes,
+    @app.get("/uploads/{name:path}")
+    def upload(name: str, request: Request):
+        digest = BLOBS.digest_for(name)
+        if digest is None:
+            path = upload_path(name)
+            if path is None:
+                raise HTTPException(status_code=404, detail="Not Found")
+            stat = path.stat()
+            headers = {"ETag": file_etag(stat), "Cache-Control": UPLOAD_CACHE_CONTROL}
+            if conditional(request, headers["ETag"], stat.st_mtime):
+                return Response(status_code=304, headers=headers)
+            return FileResponse(path, media_type=file_content_type(path), headers=headers)
+        located = BLOBS.locate(digest)
+        if located is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        path, suffix = located
+        size = BLOBS.size(digest)
+        identity_etag = f'"{digest}"'
+        byte_range = None
+        if size is not None and request.headers.get("range"):
+            if_range = request.headers.get("if-range")
+            if not if_range or if_range_matches(if_range, identity_etag, None):
+                byte_range = parse_range(request.headers.get("range"), size)
+        passthrough = not byte_range and suffix == ".gz" and choose_encoding(request.headers.get("accept-encoding"), ("gzip",))
+        etag = variant_etag(identity_etag, "gzip" if passthrough else None)
+        headers = {"ETag": etag, "Cache-Control": UPLOAD_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+        if conditional(request, etag):
+            return Response(status_code=304, headers=headers)
+        if byte_range is False:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        if passthrough:
+            headers["Content-Encoding"] = "gzip"
+            return FileResponse(path, media_type="text/html; charset=utf-8", headers=headers)
+
+        fh = BLOBS.open(digest)
+        status, length = 200, size
+        if size is not None:
+            headers["Accept-Ranges"] = "bytes"
+        if byte_range:
+            start, end = byte_range
+            fh.seek(start)
+            status, length = 206, end - start + 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+        def chunks():
+            with fh:
+                yield from BlobStore.iter_chunks(fh, length)
+
+        if length is not None:
+            headers["Content-Length"] = str(length)
+        return StreamingResponse(chunks(), status_code=status, media_type="text/html; charset=utf-8", headers=headers)
+
+    @app.get("/metrics")
+    async def metrics():
+        return Response(content=METRICS.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+    @app.get("/api/admin/profiles")
+    async def admin_profiles(request: Request):
+        require_admin(admin_token(request))
+        payload = {"profiles": PROFILER.list(), "sample_rate": PROFILER.sample_rate, "keep": PROFILER.keep}
+        response = json_response(payload)
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    @app.get("/api/admin/profiles/{profile_id}")
+    async def admin_profile(profile_id: str, request: Request, format: str = "", sort: str = "cumulative", limit: str = "50"):
+        require_admin(admin_token(request))
+        headers = {"Cache-Control": "no-store"}
+        if format == "text":
+            report = PROFILER.report(profile_id, sort, limit)
+            return Response(content=report, media_type="text/plain; charset=utf-8", headers=headers)
+        return FileResponse(
+            PROFILER.path_for(profile_id),
+            media_type="application/octet-stream",
+            filename=f"{profile_id}.prof",
+            headers=headers,
+        )
+
+    @app.get("/api/trips")
+    async def api_trips():
+        return json_response({"trips": TRIPS.list_trips()})
+
+    @app.post("/api/trips")
+    async def api_create_trip(payload: dict = Body(default={})):
+        trip = TRIPS.create_trip(
+            name=payload.get("name", ""), people=payload.get("people") or [], trip_id=payload.get("id")
         )
-        return {"ok": True, "receipt": receipt}
+        return {"ok": True, "trip": trip}
 
     @app.post("/api/qr/decode")
     async def api_qr_decode(file: UploadFile = File(...)):
@@ -1049,18 +5425,17 @@ def create_fastapi_app():
             raise HTTPException(status_code=400, detail="Empty file")
         size_bytes = len(file_bytes)
         if size_bytes > 1_200_000:
-            debug("qr decode: warning image over recommended 1MB, API may reject")
+            log_event("qr_upload_large", "image over recommended 1MB, API may reject", level=logging.WARNING, bytes=size_bytes)
         try:
             decoded_data, decode_source, local_err = decode_qr_best_effort(
                 file_bytes, filename=file.filename or "qr.png"
             )
-        except urllib.error.URLError as e:
-            raise HTTPException(
-                status_code=502,
-                detail=f"QR decode failed: network error ({e})",
-            ) from e
         except Exception as e:  # pragma: no cover - safety net
             raise HTTPException(status_code=500, detail=f"QR decode failed unexpectedly ({e})") from e
+        if decode_source == "remote_skipped":
+            raise HTTPException(status_code=503, detail=f"Could not read QR code locally and the QR API is unavailable ({local_err})")
+        if decode_source == "remote_error":
+            raise HTTPException(status_code=502, detail=f"QR decode failed: network error ({local_err})")
         if not decoded_data:
             raise HTTPException(status_code=422, detail="Could not read QR code")
 
@@ -1074,7 +5449,7 @@ def create_fastapi_app():
                 html_text = decoded_str or None
         except urllib.error.URLError as e:
             fetch_error = str(e)
-            debug("qr decode fetch html URLError")
+            log_event("qr_fetch_url_error", level=logging.WARNING, error=fetch_error)
         return {
             "ok": True,
             "qr_data": decoded_str,
@@ -1084,65 +5459,117 @@ def create_fastapi_app():
             "fetch_error": fetch_error,
         }
 
-    @app.post("/api/receipts/{receipt_id}/participants")
-    async def api_participants(receipt_id: str, payload: dict = Body(...)):
-        item_id = payload.get("item_id")
-        participants = payload.get("participants") or []
-        state = load_state()
-        receipt = next((r for r in state["receipts"] if r["id"] == receipt_id), None)
-        if not receipt:
-            raise HTTPException(status_code=404, detail="Receipt not found")
-        item = next((i for i in receipt.get("items", []) if i["id"] == item_id), None)
-        if not item:
-            raise HTTPException(status_code=404, detail="Item not found")
-        valid = [p for p in participants if p in state["people"]]
-        item["participants"] = valid
-        save_state(state)
+    router = APIRouter()
+
+    @router.get("/state")
+    async def api_state(request: Request, trip: Trip = Depends(current_trip)):
+        with trip.lock:
+            etag, modified_at = trip.etag, trip.modified_at
+            headers = {"ETag": etag, "Last-Modified": http_date(modified_at), "Cache-Control": "no-cache"}
+            if conditional(request, etag, modified_at):
+                return Response(status_code=304, headers=headers)
+            chunks = trip.snapshot_json()
+        response = json_response(chunks)
+        response.headers.update(headers)
+        return response
+
+    # Plain ``def`` routes run in the threadpool: they take trip.lock (which export
+    # iterators may hold) and can build indexes, so they must not block the event loop.
+    @router.get("/receipts")
+    def api_list_receipts(request: Request, trip: Trip = Depends(current_trip)):
+        return json_response(trip.list_receipts(dict(request.query_params)))
+
+    @router.get("/search")
+    def api_search(request: Request, trip: Trip = Depends(current_trip)):
+        return json_response(trip.search(dict(request.query_params)))
+
+    @router.get("/export/{kind}")
+    def api_export(kind: str, format: str = "csv", trip: Trip = Depends(current_trip)):
+        content_type, filename, chunks = trip.export(kind, format)
+        headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+        # A sync iterator: Starlette pulls it from the threadpool, so trip.lock never blocks the loop.
+        return StreamingResponse(chunks, media_type=content_type, headers=headers)
+
+    @router.post("/import")
+    async def api_import(request: Request, mode: str = "replace", trip: Trip = Depends(current_trip)):
+        importer = TripImport()
+        async for data in request.stream():
+            importer.feed(data)
+        # Normalizing, the shard write and blob refcounts are blocking work under trip.lock.
+        result = await run_in_threadpool(trip.import_state, importer.state(), mode)
+        return json_response({"ok": True, **result})
+
+    @router.get("/receipts/{receipt_id}")
+    def api_receipt_detail(receipt_id: str, fields: str | None = None, trip: Trip = Depends(current_trip)):
+        return json_response(trip.receipt_detail(receipt_id, fields))
+
+    @router.post("/people")
+    async def api_people(payload: dict = Body(...), trip: Trip = Depends(current_trip)):
+        return {"ok": True, "people": trip.add_person(payload.get("name"))}
+
+    @router.post("/receipts")
+    async def api_receipts(
+        request: Request,
+        html_file: UploadFile | None = File(default=None),
+        html_text: str = Form(default=""),
+        paid_by: str = Form(default=""),
+        title: str = Form(default=""),
+        notes: str = Form(default=""),
+        trip: Trip = Depends(current_trip),
+    ):
+        file_bytes = await html_file.read() if html_file else None
+        ctype = request.headers.get("content-type", "")
+        if ctype.startswith("application/json"):
+            data = await request.json()
+            html_text = data.get("html_text", "")
+            paid_by = data.get("paid_by", "")
+            title = data.get("title", "")
+            notes = data.get("notes", "")
+        receipt = create_receipt_entry(
+            html_text=html_text or file_bytes or "",
+            paid_by=paid_by,
+            title=title,
+            notes=notes,
+            file_bytes=file_bytes,
+            trip_id=trip.id,
+        )
+        return json_response({"ok": True, "receipt": receipt})
+
+    @router.post("/receipts/{receipt_id}/participants")
+    async def api_participants(receipt_id: str, payload: dict = Body(...), trip: Trip = Depends(current_trip)):
+        trip.set_participants(receipt_id, payload.get("item_id"), payload.get("participants") or [])
         return {"ok": True}
 
-    @app.post("/api/receipts/{receipt_id}/paid_by")
-    async def api_paid_by(receipt_id: str, payload: dict = Body(...)):
-        paid_by = (payload.get("paid_by") or "").strip()
-        state = load_state()
-        receipt = next((r for r in state["receipts"] if r["id"] == receipt_id), None)
-        if not receipt:
-            raise HTTPException(status_code=404, detail="Receipt not found")
-        if paid_by and paid_by in state["people"]:
-            receipt["paid_by"] = paid_by
-            save_state(state)
+    @router.post("/receipts/{receipt_id}/paid_by")
+    async def api_paid_by(receipt_id: str, payload: dict = Body(...), trip: Trip = Depends(current_trip)):
+        trip.set_paid_by(receipt_id, payload.get("paid_by"))
         return {"ok": True}
 
-    @app.post("/api/receipts/{receipt_id}/bulk")
-    async def api_bulk(receipt_id: str, payload: dict = Body(...)):
-        mode = payload.get("mode")
-        state = load_state()
-        receipt = next((r for r in state["receipts"] if r["id"] == receipt_id), None)
-        if not receipt:
-            raise HTTPException(status_code=404, detail="Receipt not found")
-        if mode == "all":
-            for item in receipt.get("items", []):
-                item["participants"] = list(state["people"])
-        elif mode == "none":
-            for item in receipt.get("items", []):
-                item["participants"] = []
-        else:
-            raise HTTPException(status_code=400, detail="Invalid mode")
-        save_state(state)
+    @router.post("/receipts/{receipt_id}/bulk")
+    async def api_bulk(receipt_id: str, payload: dict = Body(...), trip: Trip = Depends(current_trip)):
+        trip.bulk_participants(receipt_id, payload.get("mode"))
         return {"ok": True}
 
-    @app.delete("/api/receipts/{receipt_id}")
-    async def api_delete_receipt(receipt_id: str):
-        state = load_state()
-        before = len(state.get("receipts", []))
-        state["receipts"] = [r for r in state.get("receipts", []) if r.get("id") != receipt_id]
-        if len(state["receipts"]) == before:
-            raise HTTPException(status_code=404, detail="Receipt not found")
-        save_state(state)
+    @router.delete("/receipts/{receipt_id}")
+    async def api_delete_receipt(receipt_id: str, trip: Trip = Depends(current_trip)):
+        trip.delete_receipt(receipt_id)
         return {"ok": True}
 
+    app.include_router(router, prefix="/api")
+    app.include_router(router, prefix="/api/trips/{trip_id}")
+
     return app
 
 
+def __getattr__(name):
+    # ASGI entrypoint for uvicorn (``uvicorn app:app``), built on first access so a
+    # plain import, the stdlib server and --reload restarts don't construct it early.
+    if name == "app":
+        value = globals()["app"] = create_fastapi_app() if FASTAPI_AVAILABLE else None
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "8000"))
     ssl_cert = os.environ.get("SSL_CERTFILE")
@@ -1150,6 +5577,3 @@ if __name__ == "__main__":
     ssl_port = os.environ.get("SSL_PORT")
     disable_http = os.environ.get("DISABLE_HTTP", "").lower() in ("1", "true", "yes")
     run(port=port, ssl_cert=ssl_cert, ssl_key=ssl_key, ssl_port=ssl_port, disable_http=disable_http)
-
-# ASGI entrypoint for uvicorn
-app = create_fastapi_app() if FastAPI is not None else None
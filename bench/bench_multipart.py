@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Upload parsing benchmark: throughput and peak Python memory of the streaming
+MultipartParser versus cgi.FieldStorage (when the interpreter still ships cgi).
+
+Run: python3 bench/bench_multipart.py [--sizes 1,8,32] [--repeat 3] [--json out.json]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+BOUNDARY = "----benchboundary7MA4YWxkTrZu0gW"
+
+
+def build_body(file_mb):
+    """Multipart body with a few text fields and one ``file_mb`` MiB file part."""
+    payload = os.urandom(1024 * 1024) * file_mb
+    parts = []
+    for name, value in (("paid_by", "Eva"), ("title", "Bench upload"), ("notes", "x" * 512)):
+        parts.append(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+        )
+    parts.append(
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="html_file"; filename="bench.html"\r\n'
+        f"Content-Type: text/html\r\n\r\n".encode("utf-8")
+    )
+    parts.append(payload)
+    parts.append(f"\r\n--{BOUNDARY}--\r\n".encode("utf-8"))
+    return b"".join(parts)
+
+
+def parse_streaming(body):
+    form = app.MultipartParser(io.BytesIO(body), BOUNDARY, len(body), max_total=0, max_file=0).parse()
+    size = form.files["html_file"].size
+    form.close()
+    return size
+
+
+def parse_cgi(body):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import cgi
+    form = cgi.FieldStorage(
+        fp=io.BytesIO(body),
+        headers={"content-type": f"multipart/form-data; boundary={BOUNDARY}", "content-length": str(len(body))},
+        environ={"REQUEST_METHOD": "POST"},
+    )
+    return len(form["html_file"].file.read())
+
+
+def measure(fn, body, repeat):
+    timings = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn(body)
+        timings.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    best = min(timings)
+    return {
+        "best_s": round(best, 6),
+        "throughput_mb_s": round(len(body) / best / 1e6, 2),
+        "peak_mem_kb": round(peak / 1024, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1,8,32", help="file sizes in MiB, comma separated")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    try:
+        parse_cgi(build_body(0))
+        contenders = {"streaming": parse_streaming, "cgi": parse_cgi}
+    except ImportError:
+        contenders = {"streaming": parse_streaming}
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        body = build_body(size)
+        for name, fn in contenders.items():
+            row = {"parser": name, "file_mb": size, **measure(fn, body, args.repeat)}
+            results.append(row)
+            print(
+                f"{name:>9} {size:>4} MiB  {row['throughput_mb_s']:>8.1f} MB/s  "
+                f"peak {row['peak_mem_kb']:>10.1f} KiB"
+            )
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump({"benchmark": "multipart", "results": results}, fh, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+QR decoder benchmark: latency and accuracy of the built-in decoder (with and
+without NumPy) and, when installed, zbar over a generated corpus of receipt-style
+QR images (rotation, perspective, noise, uneven lighting). With Pillow installed
+the corpus is also re-encoded as JPEG.
+
+Run: python3 bench/bench_qr.py [--quick] [--images photo.jpg ...] [--json out.json]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import time
+
+from common import app, percentile, quiet_logs
+import generators
+import qrdecode
+
+
+def zbar_decode(data):
+    text, _err = app.decode_qr_locally(data)
+    return text
+
+
+def builtin_decode(data):
+    try:
+        return qrdecode.decode(data)
+    except qrdecode.QRDecodeError:
+        return None
+
+
+def builtin_python_decode(data):
+    saved = qrdecode.np
+    qrdecode.np = None
+    try:
+        return builtin_decode(data)
+    finally:
+        qrdecode.np = saved
+
+
+def decoders():
+    out = {"builtin": builtin_decode}
+    if qrdecode.np is not None:
+        out["builtin-python"] = builtin_python_decode
+    try:
+        import pyzbar.pyzbar  # noqa: F401
+        out["zbar"] = zbar_decode
+    except ImportError:
+        pass
+    return out
+
+
+def corpus(quick):
+    generated = generators.qr_corpus(quick=quick)
+    cases = [(name, "png", data, text) for name, data, text in generated]
+    if qrdecode.Image is not None:
+        for name, data, text in generated:
+            buf = io.BytesIO()
+            qrdecode.Image.open(io.BytesIO(data)).convert("RGB").save(buf, "JPEG", quality=70)
+            cases.append((name, "jpeg", buf.getvalue(), text))
+    return cases
+
+
+def measure(fn, cases):
+    timings, decoded, failures = [], 0, []
+    for name, _fmt, data, text in cases:
+        start = time.perf_counter()
+        result = fn(data)
+        timings.append(time.perf_counter() - start)
+        if result == text:
+            decoded += 1
+        else:
+            failures.append(name)
+    timings.sort()
+    return {
+        "cases": len(cases),
+        "decoded": decoded,
+        "accuracy": round(decoded / len(cases), 4) if cases else None,
+        "median_s": round(statistics.median(timings), 6),
+        "p95_s": round(percentile(timings, 95), 6),
+        "max_s": round(timings[-1], 6),
+        "failures": failures,
+    }
+
+
+def run(quick=False, images=()):
+    results = []
+    quiet_logs()
+    cases = corpus(quick)
+    formats = sorted({fmt for _name, fmt, _data, _text in cases})
+    for name, fn in decoders().items():
+        for fmt in formats:
+            row = {"decoder": name, "format": fmt, **measure(fn, [c for c in cases if c[1] == fmt])}
+            results.append(row)
+            print(
+                f"{name:<15} {fmt:<5} {row['decoded']:>3}/{row['cases']:<3} "
+                f"median {row['median_s'] * 1000:>8.1f} ms  p95 {row['p95_s'] * 1000:>8.1f} ms"
+                + (f"  missed: {', '.join(row['failures'])}" if row["failures"] else "")
+            )
+        for path in images:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            start = time.perf_counter()
+            text = fn(data)
+            elapsed = time.perf_counter() - start
+            label = os.path.basename(path)
+            print(f"{name:<15} {label}: {elapsed * 1000:.1f} ms  {repr(text[:60]) if text else 'not decoded'}")
+            results.append({"decoder": name, "file": label, "seconds": round(elapsed, 6), "decoded": bool(text)})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller corpus, for a fast sanity run")
+    parser.add_argument("--images", nargs="+", default=[], metavar="FILE", help="also time these photos (no ground truth)")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    args = parser.parse_args(argv)
+    results = run(quick=args.quick, images=args.images)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump({"benchmark": "qr", "results": results}, fh, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Shared helpers for the benchmark scripts: import path setup, an isolated data
+directory so runs never touch ./data, and a small timing loop.
+"""
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import app  # noqa: E402
+
+
+@contextmanager
+def isolated_data_dir():
+    """Point app's data/upload directories and trip store at a throwaway directory."""
+    tmp = Path(tempfile.mkdtemp(prefix="tripsplitter-bench-"))
+    saved = {name: getattr(app, name) for name in ("DATA_DIR", "UPLOAD_DIR", "DATA_FILE", "TRIPS_DIR", "TRIPS_INDEX_FILE", "TRIPS", "BLOB_DIR", "BLOBS")}
+    try:
+        app.DATA_DIR = tmp / "data"
+        app.UPLOAD_DIR = tmp / "uploads"
+        app.DATA_FILE = app.DATA_DIR / "state.json"
+        app.TRIPS_DIR = app.DATA_DIR / "trips"
+        app.TRIPS_INDEX_FILE = app.DATA_DIR / "trips.json"
+        app.TRIPS = app.TripStore(app.TRIPS_DIR, app.TRIPS_INDEX_FILE)
+        app.BLOB_DIR = app.DATA_DIR / "blobs"
+        app.BLOBS = app.BlobStore(app.BLOB_DIR)
+        app.ensure_dirs()
+        yield tmp
+    finally:
+        for name, value in saved.items():
+            setattr(app, name, value)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench(fn, repeat=5, min_time=0.05):
+    """
+    Time ``fn()``: calibrate a loop count so one repeat takes at least ``min_time``,
+    then report best/median seconds per call over ``repeat`` repeats.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    best = min(samples)
+    return {
+        "best_s": best,
+        "median_s": statistics.median(samples),
+        "ops_per_s": (1.0 / best) if best > 0 else None,
+        "loops": number,
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def quiet_logs():
+    app.configure_logging(level=os.environ.get("BENCH_LOG_LEVEL", "WARNING"))
@@ -0,0 +1,357 @@
+"""
+Synthetic inputs for benchmarks: MyMarket and Entersoft invoice HTML, Chrome-style
+MHTML snapshots wrapping them, whole trips with N people and M receipts, and
+receipt-style QR code images (rotated, tilted, noisy) for the QR decoders.
+All generators are deterministic for a given seed.
+"""
+import base64
+import datetime as dt
+import math
+import quopri
+import random
+import struct
+import zlib
+
+import qrdecode
+
+PRODUCTS = [
+    "ΓΑΛΑ ΦΡΕΣΚΟ 1L", "ΨΩΜΙ ΤΟΣΤ", "ΕΛΑΙΟΛΑΔΟ ΠΑΡΘΕΝΟ 1L", "ΤΥΡΙ ΦΕΤΑ ΠΟΠ", "ΝΤΟΜΑΤΕΣ ΕΓΧ.",
+    "ΜΠΥΡΑ ΑΛΦΑ 500ML", "ΝΕΡΟ ΖΑΓΟΡΙ 1.5L", "ΚΑΦΕΣ ΦΙΛΤΡΟΥ", "ΜΑΚΑΡΟΝΙΑ Ν.10", "ΑΥΓΑ ΕΛΕΥΘ. 6ΤΕΜ",
+    "ΓΙΑΟΥΡΤΙ ΣΤΡΑΓΓΙΣΤΟ", "ΧΑΡΤΙ ΚΟΥΖΙΝΑΣ", "ΠΑΤΑΤΑΚΙΑ 150G", "ΚΡΑΣΙ ΛΕΥΚΟ 750ML", "ΜΠΑΝΑΝΕΣ",
+]
+FIRST_NAMES = ["Eva", "Ari", "Spiros", "Anna", "Nikos", "Maria", "Kostas", "Eleni", "Giorgos", "Sofia"]
+
+
+def _greek_number(value, decimals=2):
+    return f"{value:,.{decimals}f}".replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def _lines(count, seed):
+    rnd = random.Random(seed)
+    for i in range(count):
+        qty = rnd.choice([1, 1, 1, 2, 3, 0.5, 1.25])
+        price = round(rnd.uniform(0.3, 25.0), 2)
+        yield f"{rnd.choice(PRODUCTS)} #{i}", qty, price
+
+
+def mymarket_html(lines=20, seed=0):
+    """Invoice in the MyMarket field/label/value span layout parse_invoice_mymarket expects."""
+    def field(name, value):
+        return (
+            f'<span class="field field-{name}"><span class="label">{name}</span>'
+            f'<span class="value">{value}</span></span>'
+        )
+
+    rows = []
+    total = 0.0
+    for desc, qty, price in _lines(lines, seed):
+        total += qty * price
+        rows.append(
+            "<tr>"
+            f"<td>{field('Description1', desc)}</td>"
+            f"<td>{field('Quantity', _greek_number(qty, 3))}</td>"
+            f"<td>{field('UnitPrice', _greek_number(price))}</td>"
+            f"<td>{field('NetValue', _greek_number(qty * price))}</td>"
+            "</tr>"
+        )
+    header = "".join(
+        field(name, value)
+        for name, value in (
+            ("RegisteredName", "MY MARKET ΑΕ"),
+            ("Vat", "094062259"),
+            ("IssuerFormatedInvoiceSeriesNumber", f"ΑΛΠ-{seed:06d}"),
+            ("DateIssued", "12/08/2025 19:42"),
+            ("CurrencyCode", "EUR"),
+            ("PaymentMethodType", "Κάρτα"),
+            ("TotalGrossValue", _greek_number(total)),
+        )
+    )
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Παραστατικό</title>"
+        "<style>.field{display:block}.label{font-weight:bold}</style></head><body>"
+        f"<div class=\"header\">{header}</div>"
+        f"<table class=\"lines\"><thead><tr><th>Περιγραφή</th><th>Ποσότητα</th><th>Τιμή</th><th>Αξία</th></tr></thead>"
+        f"<tbody>{''.join(rows)}</tbody></table></body></html>"
+    )
+
+
+def entersoft_html(lines=20, seed=0):
+    """Sklavenitis-style invoice as rendered inside the Entersoft e-invoicing iframe."""
+    rows = []
+    total = 0.0
+    for desc, qty, price in _lines(lines, seed):
+        line_total = round(qty * price, 2)
+        total += line_total
+        rows.append(
+            "<tr>"
+            f'<td data-title="Περιγραφή">{desc}</td>'
+            f'<td data-title="Ποσότητα">{_greek_number(qty, 3)}</td>'
+            f'<td data-title="Τιμή μονάδας">{_greek_number(price)}</td>'
+            f'<td data-title="ΦΠΑ">13%</td>'
+            f'<td data-title="Συνολική Αξία">{_greek_number(line_total)}</td>'
+            "</tr>"
+        )
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>e-invoicing.gr | Entersoft</title></head><body>"
+        '<div class="BoldBlueHeader">ΣΚΛΑΒΕΝΙΤΗΣ ΑΕΕ</div>'
+        "<div>Α.Φ.Μ: 094025817</div>"
+        f"<div>Αρ. Παραστατικού: {seed:08d}</div>"
+        "<div>Ημ/νία έκδοσης: 12/08/2025</div>"
+        "<div>Τρόπος πληρωμής:<div class=\"val\">Κάρτα</div></div>"
+        "<table><thead><tr><th>Περιγραφή</th></tr></thead>"
+        f"<tbody>{''.join(rows)}</tbody></table>"
+        f"<div>Ποσό Πληρωμής<div class=\"val\">{_greek_number(total)} EUR</div></div>"
+        "</body></html>"
+    )
+
+
+def mhtml_snapshot(html, assets_kb=512, asset_count=4, seed=0):
+    """
+    Wrap ``html`` the way Chrome's "Save page as MHTML" does: quoted-printable HTML
+    first, followed by base64 image/stylesheet parts totalling about ``assets_kb`` KiB.
+    """
+    rnd = random.Random(seed)
+    boundary = f"----MultipartBoundary--{rnd.getrandbits(64):x}----"
+    url = "https://e-invoicing.gr/invoice/GetInvoice?id=bench"
+    parts = [
+        "From: <Saved by Blink>\r\n"
+        f"Snapshot-Content-Location: {url}\r\n"
+        "Subject: =?utf-8?Q?Invoice?=\r\n"
+        f"Date: {dt.datetime(2025, 8, 12, 19, 42):%a, %d %b %Y %H:%M:%S} -0000\r\n"
+        "MIME-Version: 1.0\r\n"
+        "Content-Type: multipart/related;\r\n"
+        '\ttype="text/html";\r\n'
+        f'\tboundary="{boundary}"\r\n\r\n\r\n'
+    ]
+    qp_html = quopri.encodestring(html.encode("utf-8")).decode("ascii").replace("\n", "\r\n")
+    parts.append(
+        f"--{boundary}\r\n"
+        "Content-Type: text/html\r\n"
+        "Content-ID: <frame-0@mhtml.blink>\r\n"
+        "Content-Transfer-Encoding: quoted-printable\r\n"
+        f"Content-Location: {url}\r\n\r\n{qp_html}\r\n"
+    )
+    per_asset = max(1, assets_kb * 1024 // max(1, asset_count))
+    for index in range(asset_count):
+        ctype = "text/css" if index % 4 == 3 else "image/png"
+        blob = rnd.randbytes(per_asset)
+        encoded = base64.encodebytes(blob).decode("ascii").replace("\n", "\r\n")
+        parts.append(
+            f"--{boundary}\r\n"
+            f"Content-Type: {ctype}\r\n"
+            "Content-Transfer-Encoding: base64\r\n"
+            f"Content-Location: https://e-invoicing.gr/assets/{index}\r\n\r\n{encoded}\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n")
+    return "".join(parts).encode("ascii")
+
+
+def synthetic_trip(people=8, receipts=100, items_per_receipt=25, seed=0, share_ratio=0.6):
+    """
+    A normalized trip state: ``people`` names and ``receipts`` receipts whose items
+    are each shared by a random subset of the group (``share_ratio`` of items have
+    participants at all).
+    """
+    rnd = random.Random(seed)
+    names = [
+        FIRST_NAMES[i % len(FIRST_NAMES)] + ("" if i < len(FIRST_NAMES) else f" {i // len(FIRST_NAMES)}")
+        for i in range(people)
+    ]
+    created = dt.datetime(2025, 8, 1, 9, 0)
+    out = []
+    for r in range(receipts):
+        items = []
+        for i, (desc, qty, price) in enumerate(_lines(items_per_receipt, seed * 100_003 + r)):
+            participants = []
+            if rnd.random() < share_ratio:
+                participants = rnd.sample(names, rnd.randint(1, len(names)))
+            items.append(
+                {
+                    "id": f"{r:05d}{i:05d}",
+                    "description": desc,
+                    "quantity": qty,
+                    "price": price,
+                    "total": round(qty * price, 2),
+                    "participants": participants,
+                }
+            )
+        out.append(
+            {
+                "id": f"r{r:07d}",
+                "title": f"Receipt {r}",
+                "supplier": rnd.choice(["MY MARKET ΑΕ", "ΣΚΛΑΒΕΝΙΤΗΣ ΑΕΕ", "ΦΟΥΡΝΟΣ"]),
+                "paid_by": rnd.choice(names),
+                "currency": "EUR",
+                "total_amount": round(sum(it["total"] for it in items), 2),
+                "items": items,
+                "payment_method": "Κάρτα",
+                "notes": "",
+                "parser": rnd.choice(["mymarket", "entersoft"]),
+                "raw_html_file": None,
+                "created_at": (created + dt.timedelta(minutes=37 * r)).isoformat() + "Z",
+            }
+        )
+    return {"people": names, "receipts": out}
+
+
+def qr_matrix(text, level="M", mask=0):
+    """Module grid (rows of bools, True = dark) encoding ``text`` as one UTF-8 byte segment."""
+    data = text.encode("utf-8")
+    for version in range(1, 41):
+        ecc_len, data_lens = qrdecode.block_layout(version, level)
+        capacity = sum(data_lens) * 8
+        needed = 4 + (8 if version <= 9 else 16) + 8 * len(data)
+        if needed <= capacity:
+            break
+    else:
+        raise ValueError("text too long for a QR code")
+    bits = [0, 1, 0, 0]
+    count_bits = 8 if version <= 9 else 16
+    bits += [(len(data) >> i) & 1 for i in reversed(range(count_bits))]
+    for byte in data:
+        bits += [(byte >> i) & 1 for i in reversed(range(8))]
+    bits += [0] * min(4, capacity - len(bits))
+    bits += [0] * (-len(bits) % 8)
+    codewords = [int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    pad = 0xEC
+    while len(codewords) < capacity // 8:
+        codewords.append(pad)
+        pad ^= 0xEC ^ 0x11
+    blocks, start = [], 0
+    for length in data_lens:
+        blocks.append(codewords[start:start + length])
+        start += length
+    eccs = [qrdecode.rs_encode(block, ecc_len) for block in blocks]
+    stream = []
+    for i in range(max(data_lens)):
+        stream += [block[i] for block in blocks if i < len(block)]
+    for i in range(ecc_len):
+        stream += [ecc[i] for ecc in eccs]
+
+    size = qrdecode.symbol_size(version)
+    grid = [[False] * size for _ in range(size)]
+    for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+        for dy in range(-4, 5):
+            for dx in range(-4, 5):
+                x, y = cx + dx, cy + dy
+                if 0 <= x < size and 0 <= y < size:
+                    grid[y][x] = max(abs(dx), abs(dy)) not in (2, 4)
+    for i in range(8, size - 8):
+        grid[6][i] = grid[i][6] = i % 2 == 0
+    positions = qrdecode.alignment_positions(version)
+    last = len(positions) - 1
+    for i, cy in enumerate(positions):
+        for j, cx in enumerate(positions):
+            if (i, j) not in ((0, 0), (0, last), (last, 0)):
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        grid[cy + dy][cx + dx] = max(abs(dx), abs(dy)) != 1
+    grid[size - 8][8] = True
+    if version >= 7:
+        value = qrdecode.version_bits(version)
+        for copy in qrdecode.version_positions(size):
+            for i, (x, y) in enumerate(copy):
+                grid[y][x] = bool(value >> i & 1)
+    value = qrdecode.format_bits(level, mask)
+    for copy in qrdecode.format_positions(size):
+        for i, (x, y) in enumerate(copy):
+            grid[y][x] = bool(value >> i & 1)
+    condition = qrdecode.MASKS[mask]
+    for i, (x, y) in enumerate(qrdecode.data_positions(version)):
+        bit = i < len(stream) * 8 and bool(stream[i >> 3] >> (7 - (i & 7)) & 1)
+        grid[y][x] = bit != condition(x, y)
+    return grid
+
+
+def qr_photo(grid, module=4, angle=0.0, tilt=0.0, noise=0, dark=20, light=235, gradient=0, margin=8, seed=0):
+    """
+    Render ``grid`` as a grayscale "photo": ``module`` pixels per module, rotated by
+    ``angle`` degrees, ``tilt`` (0..1) shrinking the top edge for a perspective view,
+    uniform pixel ``noise`` and a left-to-right lighting ``gradient``, on a textured
+    background ``margin`` modules wide. Returns ``(width, height, pixels)``.
+    """
+    rnd = random.Random(seed)
+    size = len(grid)
+    quiet = 4
+    half = (size / 2 + quiet) * module
+    extent = int(2 * (size / 2 + quiet + margin) * module)
+    centre = extent / 2
+    theta = math.radians(angle)
+    cos_t, sin_t = math.cos(theta), math.sin(theta)
+    corners = []
+    for sx, sy in ((-1, -1), (1, -1), (1, 1), (-1, 1)):
+        x = sx * half * (1 - tilt if sy < 0 else 1)
+        y = sy * half * (1 - tilt / 2 if sy < 0 else 1)
+        corners.append((centre + x * cos_t - y * sin_t, centre + x * sin_t + y * cos_t))
+    square = [(-quiet, -quiet), (size + quiet, -quiet), (size + quiet, size + quiet), (-quiet, size + quiet)]
+    a, b, c, d, e, f, g, h = qrdecode.perspective(corners, square)
+    pixels = bytearray(extent * extent)
+    for py in range(extent):
+        v = py + 0.5
+        for px in range(extent):
+            u = px + 0.5
+            denom = g * u + h * v + 1
+            mx = (a * u + b * v + c) / denom
+            my = (d * u + e * v + f) / denom
+            if -quiet <= mx < size + quiet and -quiet <= my < size + quiet:
+                inside = 0 <= mx < size and 0 <= my < size and grid[int(my)][int(mx)]
+                value = dark if inside else light
+            else:
+                value = rnd.randint(90, 170)
+            value += gradient * px // extent + (rnd.randint(-noise, noise) if noise else 0)
+            pixels[py * extent + px] = min(255, max(0, value))
+    return extent, extent, bytes(pixels)
+
+
+def png_gray(width, height, pixels):
+    """Encode 8-bit grayscale ``pixels`` as a PNG (no filtering)."""
+    def chunk(kind, body):
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+    raw = b"".join(b"\x00" + pixels[y * width:(y + 1) * width] for y in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def receipt_qr_text(length, seed=0):
+    """A receipt-style URL (AADE myDATA / e-invoicing provider) of about ``length`` characters."""
+    rnd = random.Random(seed)
+    base = rnd.choice([
+        "https://www1.aade.gr/tameiakes/myweb/q1.php?SIG=",
+        "https://e-invoicing.gr/invoice/GetInvoice?id=",
+        "https://www.mymarket.gr/e-receipt?mark=",
+    ])
+    alphabet = "0123456789ABCDEF"
+    return base + "".join(rnd.choice(alphabet) for _ in range(max(1, length - len(base))))
+
+
+def qr_corpus(quick=False, seed=0):
+    """
+    ``(name, png_bytes, text)`` cases covering receipt URL lengths, error correction
+    levels, masks and capture distortions (rotation, perspective, noise, uneven light).
+    """
+    distortions = [
+        ("clean", {}),
+        ("rotated", {"angle": 17}),
+        ("tilted", {"tilt": 0.18, "angle": -6}),
+        ("noisy", {"noise": 60}),
+        ("shaded", {"gradient": 140, "dark": 40, "light": 190}),
+    ]
+    lengths = (60, 140) if quick else (40, 90, 140, 250)
+    levels = ("M",) if quick else ("L", "M", "Q")
+    out = []
+    index = 0
+    for length in lengths:
+        for level in levels:
+            text = receipt_qr_text(length, seed + index)
+            grid = qr_matrix(text, level=level, mask=index % 8)
+            version = (len(grid) - 17) // 4
+            for label, options in distortions:
+                width, height, pixels = qr_photo(grid, module=4, seed=seed + index, **options)
+                out.append((f"v{version}{level}-{label}", png_gray(width, height, pixels), text))
+            index += 1
+    return out
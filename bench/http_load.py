@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+HTTP load driver: starts the stdlib server and/or the FastAPI app (via uvicorn)
+in-process on a synthetic trip, then hammers a few routes from client threads and
+reports throughput and latency percentiles per server and scenario. Clients reuse
+their connection (keep-alive) unless --no-keepalive is given; --both runs each
+scenario both ways. 503s from overload shedding are counted separately from errors.
+
+Run: python3 bench/http_load.py [--servers stdlib,fastapi] [--concurrency 8] [--duration 5] [--json out.json]
+Overload: python3 bench/http_load.py --servers stdlib --workers 4 --queue 4 --concurrency 64 --scenarios toggle_participant
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+
+from common import app, isolated_data_dir, percentile, quiet_logs
+import generators
+
+TRIP_ID = "loadtest"
+
+
+def start_stdlib(workers=None, queue_size=None):
+    server = app.create_server(0, workers=workers or app.HTTP_WORKERS, queue_size=queue_size or app.HTTP_ACCEPT_QUEUE)
+    server.server_address = ("127.0.0.1", server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+
+    return server.server_address[1], stop
+
+
+def start_fastapi(**_pool):
+    import uvicorn
+
+    config = uvicorn.Config(app.create_fastapi_app(), host="127.0.0.1", port=0, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("uvicorn did not start")
+        time.sleep(0.02)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    def stop():
+        server.should_exit = True
+        thread.join(timeout=5)
+
+    return port, stop
+
+
+SERVERS = {"stdlib": start_stdlib, "fastapi": start_fastapi}
+
+
+def scenarios(state):
+    receipt = state["receipts"][0]
+    item = receipt["items"][0]
+    person = state["people"][0]
+    toggle = json.dumps({"item_id": item["id"], "participants": [person]}).encode("utf-8")
+    base = f"/api/trips/{TRIP_ID}"
+    return {
+        "state": ("GET", f"{base}/state", None, {"Accept-Encoding": "gzip"}),
+        "receipts_page": ("GET", f"{base}/receipts?limit=50&sort=-created_at", None, {}),
+        "receipt_detail": ("GET", f"{base}/receipts/{receipt['id']}", None, {}),
+        "toggle_participant": (
+            "POST",
+            f"{base}/receipts/{receipt['id']}/participants",
+            toggle,
+            {"Content-Type": "application/json"},
+        ),
+        "static_js": ("GET", "/static/app.js", None, {"Accept-Encoding": "gzip"}),
+    }
+
+
+def drive(port, request, concurrency, duration, keepalive=True):
+    method, path, body, headers = request
+    if not keepalive:
+        headers = {**headers, "Connection": "close"}
+    latencies = []
+    counts = {"errors": 0, "shed": 0, "connections": 0}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        local = []
+        local_counts = dict.fromkeys(counts, 0)
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            if conn.sock is None:
+                local_counts["connections"] += 1
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status == 503:
+                    local_counts["shed"] += 1
+                elif resp.status >= 400:
+                    local_counts["errors"] += 1
+                if resp.will_close or not keepalive:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                local_counts["errors"] += 1
+                conn.close()
+            local.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            for key, value in local_counts.items():
+                counts[key] += value
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        **counts,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1e3, 3) if latencies else None,
+        "p90_ms": round(percentile(latencies, 90) * 1e3, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1e3, 3) if latencies else None,
+        "max_ms": round(latencies[-1] * 1e3, 3) if latencies else None,
+    }
+
+
+def run(servers=("stdlib", "fastapi"), concurrency=8, duration=5.0, people=8, receipts=200, only=None,
+        keepalive=(True,), workers=None, queue_size=None):
+    quiet_logs()
+    results = []
+    with isolated_data_dir():
+        state = generators.synthetic_trip(people=people, receipts=receipts)
+        app.TRIPS.create_trip(name="Load test", trip_id=TRIP_ID)
+        app.get_trip(TRIP_ID).replace_state(app.normalize_state(state))
+        for server_name in servers:
+            try:
+                port, stop = SERVERS[server_name](workers=workers, queue_size=queue_size)
+            except ImportError as e:
+                print(f"skipping {server_name}: {e}")
+                continue
+            try:
+                for scenario, request in scenarios(state).items():
+                    if only and scenario not in only:
+                        continue
+                    for reuse in keepalive:
+                        row = {
+                            "server": server_name,
+                            "scenario": scenario,
+                            "concurrency": concurrency,
+                            "keepalive": reuse,
+                            "receipts": receipts,
+                            **drive(port, request, concurrency, duration, keepalive=reuse),
+                        }
+                        results.append(row)
+                        print(
+                            f"{server_name:<8} {scenario:<20} {'keep-alive' if reuse else 'close':<10} "
+                            f"{row['rps']:>9} req/s  p50 {row['p50_ms']} ms  p99 {row['p99_ms']} ms  "
+                            f"conns {row['connections']}  shed {row['shed']}  errors {row['errors']}"
+                        )
+            finally:
+                stop()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--servers", default="stdlib,fastapi")
+    parser.add_argument("--scenarios", default="", help="comma separated subset of scenarios")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per scenario")
+    parser.add_argument("--receipts", type=int, default=200)
+    parser.add_argument("--people", type=int, default=8)
+    parser.add_argument("--no-keepalive", action="store_true", help="open a new connection per request")
+    parser.add_argument("--both", action="store_true", help="run every scenario with and without keep-alive")
+    parser.add_argument("--workers", type=int, help="stdlib server worker threads (default HTTP_WORKERS)")
+    parser.add_argument("--queue", type=int, help="stdlib server accept queue size (default HTTP_ACCEPT_QUEUE)")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    args = parser.parse_args(argv)
+    if args.both:
+        keepalive = (True, False)
+    else:
+        keepalive = (not args.no_keepalive,)
+    results = run(
+        servers=[s for s in args.servers.split(",") if s],
+        concurrency=args.concurrency,
+        duration=args.duration,
+        people=args.people,
+        receipts=args.receipts,
+        only={s for s in args.scenarios.split(",") if s} or None,
+        keepalive=keepalive,
+        workers=args.workers,
+        queue_size=args.queue,
+    )
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump({"benchmark": "http", "results": results}, fh, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
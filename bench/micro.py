@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the hot functions: invoice parsers (plain HTML and MHTML, with
+the email-package MHTML extractor as a baseline),
+compute_summary (cold and with cached item columns), the /api/state encoder, receipt listing queries, the
+search index (build, exact/prefix/fuzzy queries), ledger/trip exports and trip load/save. Each case reports best/median seconds per call.
+
+Run: python3 bench/micro.py [--quick] [--mhtml saved-page.mhtml ...] [--json out.json]
+"""
+import argparse
+import json
+import os
+
+from common import app, bench, isolated_data_dir, quiet_logs
+import generators
+
+
+def mhtml_cases(snapshot, params):
+    yield "extract_html_from_mhtml", params, lambda: app.extract_html_from_mhtml(snapshot)
+    yield "extract_html_from_mhtml_email", params, lambda: app.extract_html_from_mhtml_email(snapshot)
+    yield "parse_invoice_mhtml", params, lambda: app.parse_invoice(snapshot)
+
+
+def parser_cases(quick, mhtml_files=()):
+    sizes = (10, 100) if quick else (10, 100, 1000)
+    for lines in sizes:
+        html = generators.mymarket_html(lines)
+        yield "parse_invoice_mymarket", {"lines": lines}, lambda html=html: app.parse_invoice_mymarket(html)
+        html = generators.entersoft_html(lines)
+        yield "parse_invoice_entersoft", {"lines": lines}, lambda html=html: app.parse_invoice_entersoft(html)
+    for assets_kb in ((256,) if quick else (256, 4096)):
+        snapshot = generators.mhtml_snapshot(generators.entersoft_html(100), assets_kb=assets_kb, asset_count=8)
+        yield from mhtml_cases(snapshot, {"lines": 100, "assets_kb": assets_kb})
+    for path in mhtml_files:
+        with open(path, "rb") as fh:
+            snapshot = fh.read()
+        name = os.path.basename(path)
+        if app.extract_html_from_mhtml(snapshot) != app.extract_html_from_mhtml_email(snapshot):
+            print(f"warning: {name}: boundary scanner and email package disagree")
+        yield from mhtml_cases(snapshot, {"file": name, "kb": len(snapshot) // 1024})
+
+
+def state_cases(quick):
+    shapes = ((8, 50),) if quick else ((8, 50), (8, 500), (30, 2000))
+    for people, receipts in shapes:
+        params = {"people": people, "receipts": receipts}
+        state = app.normalize_state(generators.synthetic_trip(people=people, receipts=receipts))
+        yield "compute_summary", params, lambda state=state: app.compute_summary(state)
+        columns = app.ItemColumns.concat(app.ItemColumns.from_items(r["items"], app.cent_seed(r.get("id"))) for r in state["receipts"])
+        yield "compute_summary_columns", params, (
+            lambda state=state, columns=columns: app.compute_summary(state, columns)
+        )
+
+        trip_id = f"bench{people}x{receipts}"
+        app.TRIPS.create_trip(name=trip_id, trip_id=trip_id)
+        trip = app.get_trip(trip_id)
+        trip.replace_state(state)
+
+        def cold_snapshot(trip=trip):
+            trip._encoded.clear()
+            trip._summary_json = None
+            return trip.snapshot_json()
+
+        yield "state_json_cold", params, cold_snapshot
+        yield "state_json_warm", params, trip.snapshot_json
+        yield "list_receipts_page", params, lambda trip=trip: trip.list_receipts({"limit": "50", "sort": "-created_at"})
+        person = state["people"][0]
+        yield "list_receipts_participant", params, (
+            lambda trip=trip, person=person: trip.list_receipts({"participant": person, "limit": "50"})
+        )
+        yield "search_index_build", params, lambda state=state: app.SearchIndex(state["receipts"], state["people"])
+        trip.search_index()
+        for label, query in (("exact", "γιαουρτι"), ("prefix", "γιαο"), ("fuzzy", "γιαουρτη"), ("participant", person)):
+            yield f"search_{label}", params, lambda trip=trip, query=query: trip.search({"q": query})
+        for kind, fmt in (("ledger", "csv"), ("trip", "jsonl")):
+            yield f"export_{kind}_{fmt}", params, (
+                lambda trip=trip, kind=kind, fmt=fmt: sum(len(chunk) for chunk in trip.export(kind, fmt)[2])
+            )
+        yield "save_state", params, trip.save
+
+        def load(trip_id=trip_id):
+            store = app.TripStore(app.TRIPS_DIR, app.TRIPS_INDEX_FILE)
+            return store.get(trip_id)
+
+        yield "load_state", params, load
+
+
+def run(quick=False, repeat=5, mhtml_files=()):
+    quiet_logs()
+    results = []
+    with isolated_data_dir():
+        for group in (parser_cases(quick, mhtml_files), state_cases(quick)):
+            for name, params, fn in group:
+                row = {"name": name, "params": params, **bench(fn, repeat=repeat)}
+                results.append(row)
+                label = ",".join(f"{k}={v}" for k, v in params.items())
+                print(f"{name:<30} {label:<28} best {row['best_s'] * 1e3:>10.3f} ms  median {row['median_s'] * 1e3:>10.3f} ms")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller inputs, for a fast sanity run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--mhtml", nargs="+", default=[], metavar="FILE", help="also time these saved MHTML snapshots")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    args = parser.parse_args(argv)
+    results = run(quick=args.quick, repeat=args.repeat, mhtml_files=args.mhtml)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump({"benchmark": "micro", "results": results}, fh, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
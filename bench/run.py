@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Runs the whole benchmark suite (micro, HTTP load, multipart, QR, cold start) and writes one JSON
+report to bench/results/<timestamp>.json. With --compare it also diffs the run
+against an earlier report and exits non-zero when any case regressed by more
+than --threshold, so it can gate CI.
+
+Run: python3 bench/run.py [--quick] [--only micro,http,multipart,qr,startup] [--compare bench/results/baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from common import ROOT, app
+import bench_multipart
+import bench_qr
+import http_load
+import micro
+import startup
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SUITES = ("micro", "http", "multipart", "qr", "startup")
+
+
+def environment():
+    try:
+        rev = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        rev = ""
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_rev": rev or None,
+        "orjson": app.orjson is not None,
+        "brotli": app.brotli is not None,
+        "fastapi": app.FASTAPI_AVAILABLE,
+    }
+
+
+def run_suites(suites, quick):
+    report = {}
+    if "micro" in suites:
+        print("== micro")
+        report["micro"] = micro.run(quick=quick, repeat=3 if quick else 5)
+    if "http" in suites:
+        print("== http")
+        report["http"] = http_load.run(duration=1.0 if quick else 5.0, receipts=50 if quick else 200)
+    if "multipart" in suites:
+        print("== multipart")
+        report["multipart"] = bench_multipart.main(["--sizes", "1" if quick else "1,8", "--repeat", "3"])
+    if "qr" in suites:
+        print("== qr")
+        report["qr"] = bench_qr.run(quick=quick)
+    if "startup" in suites:
+        print("== startup")
+        report["startup"] = startup.run(repeat=3 if quick else 5)
+    return report
+
+
+def case_metrics(suite, row):
+    """(key, value, higher_is_better) for the headline metric of one result row."""
+    if suite == "micro":
+        label = ",".join(f"{k}={v}" for k, v in sorted(row["params"].items()))
+        return f"micro/{row['name']}[{label}]", row["best_s"], False
+    if suite == "http":
+        mode = "" if row.get("keepalive", True) else ",close"
+        return f"http/{row['server']}/{row['scenario']}[c={row['concurrency']}{mode}]", row["rps"], True
+    if suite == "multipart":
+        return f"multipart/{row['parser']}[{row['file_mb']}MiB]", row["best_s"], False
+    if suite == "qr":
+        if "file" in row:
+            return f"qr/{row['decoder']}[{row['file']}]", row["seconds"], False
+        return f"qr/{row['decoder']}[{row['format']}]", row["median_s"], False
+    if suite == "startup":
+        return f"startup/{row['name']}", row["median_s"], False
+    raise ValueError(suite)
+
+
+def flatten(report):
+    cases = {}
+    for suite in SUITES:
+        for row in report.get("results", {}).get(suite, []):
+            key, value, higher = case_metrics(suite, row)
+            if value:
+                cases[key] = (value, higher)
+    return cases
+
+
+def compare(current, baseline, threshold):
+    """Prints a ratio per shared case; returns the keys that got slower than threshold."""
+    now, before = flatten(current), flatten(baseline)
+    regressions = []
+    for key in sorted(now.keys() & before.keys()):
+        value, higher = now[key]
+        old, _ = before[key]
+        # Normalise so that > 1 always means "slower than baseline".
+        slowdown = old / value if higher else value / old
+        flag = ""
+        if slowdown > 1 + threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:<70} {slowdown:>6.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller inputs and shorter load runs")
+    parser.add_argument("--only", default=",".join(SUITES), help="comma separated subset of " + ",".join(SUITES))
+    parser.add_argument("--output", help="report path (default: bench/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed slowdown before a case counts as a regression"
+    )
+    args = parser.parse_args(argv)
+
+    suites = [s for s in args.only.split(",") if s]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "quick": args.quick,
+        "environment": environment(),
+        "results": run_suites(suites, args.quick),
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"report written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        print(f"== compare against {args.compare}")
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) regressed by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: the cost of ``import app`` in a fresh interpreter, and the
+time from spawning the stdlib server (and uvicorn, when installed) until /healthz
+answers and until the first /api/state returns 200. Every run works on a copy of
+the app in a temp directory, so ./data is never touched.
+
+Run: python3 bench/startup.py [--repeat 5] [--json out.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from common import ROOT, app
+
+APP_FILES = ("app.py", "qrdecode.py", "static")
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+
+def copy_app(dest):
+    for name in APP_FILES:
+        src = ROOT / name
+        if src.is_dir():
+            shutil.copytree(src, os.path.join(dest, name))
+        elif src.exists():
+            shutil.copy(src, dest)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault("LOG_LEVEL", "WARNING")
+    # Measure with cached bytecode, as a deployed image would have it.
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def time_import(cwd, repeat):
+    samples = []
+    # The first run only compiles and caches the bytecode.
+    for _ in range(repeat + 1):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET], cwd=cwd, env=child_env(), capture_output=True, text=True, check=True
+        )
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return samples[1:]
+
+
+def poll(url, deadline):
+    """perf_counter() reading when ``url`` first answers 200, or None once ``deadline`` passes."""
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resp:
+                resp.read()
+                if resp.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.002)
+    return None
+
+
+def time_server(cmd, cwd, port, timeout=30.0):
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        cmd, cwd=cwd, env={**child_env(), "PORT": str(port)}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = start + timeout
+        healthy = poll(base + "/healthz", deadline)
+        first = poll(base + "/api/state", deadline) if healthy else None
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    if healthy is None or first is None:
+        raise RuntimeError(f"{cmd[-1]} did not come up within {timeout}s")
+    return healthy - start, first - start
+
+
+def servers():
+    out = {"stdlib": lambda port: [sys.executable, "app.py"]}
+    if app.FASTAPI_AVAILABLE:
+        try:
+            import uvicorn  # noqa: F401
+            out["uvicorn"] = lambda port: [
+                sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning",
+            ]
+        except ImportError:
+            pass
+    return out
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {"best_s": round(samples[0], 6), "median_s": round(statistics.median(samples), 6)}
+
+
+def run(repeat=5):
+    results = []
+    tmp = tempfile.mkdtemp(prefix="tripsplitter-startup-")
+    try:
+        copy_app(tmp)
+        row = {"name": "import", **summarize(time_import(tmp, repeat))}
+        results.append(row)
+        print(f"{'import app':<26} best {row['best_s'] * 1000:>8.1f} ms  median {row['median_s'] * 1000:>8.1f} ms")
+        for name, build in servers().items():
+            healthy, first = [], []
+            for _ in range(repeat):
+                # Fresh state each run so the first request pays for loading it.
+                shutil.rmtree(os.path.join(tmp, "data"), ignore_errors=True)
+                shutil.rmtree(os.path.join(tmp, "uploads"), ignore_errors=True)
+                port = free_port()
+                h, f = time_server(build(port), tmp, port)
+                healthy.append(h)
+                first.append(f)
+            for metric, samples in (("healthz", healthy), ("first_request", first)):
+                row = {"name": f"{name}/{metric}", **summarize(samples)}
+                results.append(row)
+                print(
+                    f"{name + ' ' + metric:<26} best {row['best_s'] * 1000:>8.1f} ms  "
+                    f"median {row['median_s'] * 1000:>8.1f} ms"
+                )
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="cold starts per measurement")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    args = parser.parse_args(argv)
+    results = run(repeat=args.repeat)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump({"benchmark": "startup", "results": results}, fh, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
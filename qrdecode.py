@@ -0,0 +1,1363 @@
+"""
+Pure-Python QR code decoder, used by app.py when zbar (pyzbar + libzbar) is not
+installed so scans do not have to go to the remote API.
+
+Pipeline: grayscale pixels (Pillow when present, otherwise the built-in PNG and
+baseline-JPEG readers below) -> adaptive binarization -> finder pattern search ->
+alignment pattern -> perspective sampling of the module grid -> format/version
+information -> unmasking and codeword extraction -> Reed-Solomon correction ->
+segment decoding. All QR versions (1-40) and error correction levels are handled;
+receipts typically carry versions 3-12. NumPy, when installed, vectorizes the
+per-pixel stages; the same integer arithmetic runs without it.
+
+Usage: ``qrdecode.decode(image_bytes)`` returns the text or raises QRDecodeError.
+"""
+import math
+import re
+import zlib
+from io import BytesIO
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # optional; pixel stages fall back to plain loops
+    np = None
+
+try:
+    from PIL import Image  # type: ignore
+except ImportError:  # optional; PNG and baseline JPEG are decoded in Python
+    Image = None
+
+# Images are reduced so their longer side is at most this many pixels before binarization.
+MAX_SIDE = 1200
+
+
+class QRDecodeError(Exception):
+    """The image could not be read or holds no decodable QR code."""
+
+
+# ---------------------------------------------------------------------------
+# GF(256) arithmetic and Reed-Solomon (generator roots alpha^0 .. alpha^(n-1))
+# ---------------------------------------------------------------------------
+
+_EXP = [0] * 512
+_LOG = [0] * 256
+_value = 1
+for _i in range(255):
+    _EXP[_i] = _value
+    _LOG[_value] = _i
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= 0x11D
+for _i in range(255, 512):
+    _EXP[_i] = _EXP[_i - 255]
+del _value, _i
+
+
+def gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+def gf_div(a, b):
+    if b == 0:
+        raise ZeroDivisionError("division by zero in GF(256)")
+    if a == 0:
+        return 0
+    return _EXP[(_LOG[a] - _LOG[b]) % 255]
+
+
+def _poly_eval_low(poly, x):
+    """Evaluate a polynomial given lowest-degree coefficient first."""
+    result = 0
+    for coef in reversed(poly):
+        result = gf_mul(result, x) ^ coef
+    return result
+
+
+def rs_encode(data, ecc_len):
+    """Error correction codewords for ``data`` (the remainder of data * x^ecc_len by the generator)."""
+    generator = [1]
+    for i in range(ecc_len):
+        nxt = [0] * (len(generator) + 1)
+        for j, coef in enumerate(generator):
+            nxt[j] ^= coef
+            nxt[j + 1] ^= gf_mul(coef, _EXP[i])
+        generator = nxt
+    remainder = [0] * ecc_len
+    for byte in data:
+        factor = byte ^ remainder[0]
+        remainder = remainder[1:] + [0]
+        if factor:
+            for j in range(ecc_len):
+                remainder[j] ^= gf_mul(generator[j + 1], factor)
+    return remainder
+
+
+def rs_correct(codewords, ecc_len):
+    """
+    Correct up to ``ecc_len // 2`` byte errors in one block (data then ECC codewords)
+    in place; returns the number of errors fixed or raises QRDecodeError.
+    """
+    n = len(codewords)
+    syndromes = []
+    for i in range(ecc_len):
+        x = _EXP[i]
+        value = 0
+        for byte in codewords:
+            value = gf_mul(value, x) ^ byte
+        syndromes.append(value)
+    if not any(syndromes):
+        return 0
+    # Berlekamp-Massey: error locator polynomial, lowest degree first.
+    locator, previous = [1], [1]
+    length, shift, last_discrepancy = 0, 1, 1
+    for step in range(ecc_len):
+        discrepancy = syndromes[step]
+        for i in range(1, length + 1):
+            if i < len(locator):
+                discrepancy ^= gf_mul(locator[i], syndromes[step - i])
+        if discrepancy == 0:
+            shift += 1
+            continue
+        coef = gf_div(discrepancy, last_discrepancy)
+        updated = locator + [0] * max(0, len(previous) + shift - len(locator))
+        for i, value in enumerate(previous):
+            updated[i + shift] ^= gf_mul(coef, value)
+        if 2 * length <= step:
+            previous, locator = locator, updated
+            length = step + 1 - length
+            last_discrepancy = discrepancy
+            shift = 1
+        else:
+            locator = updated
+            shift += 1
+    while len(locator) > 1 and locator[-1] == 0:
+        locator.pop()
+    if length * 2 > ecc_len:
+        raise QRDecodeError("too many errors")
+    # Chien search: position idx holds the coefficient of x^(n-1-idx).
+    positions = []
+    for idx in range(n):
+        if _poly_eval_low(locator, _EXP[(255 - (n - 1 - idx)) % 255]) == 0:
+            positions.append(idx)
+    if len(positions) != length:
+        raise QRDecodeError("uncorrectable block")
+    # Forney: evaluator = syndromes * locator mod x^ecc_len.
+    evaluator = [0] * ecc_len
+    for i, syndrome in enumerate(syndromes):
+        for j, coef in enumerate(locator):
+            if i + j < ecc_len:
+                evaluator[i + j] ^= gf_mul(syndrome, coef)
+    for idx in positions:
+        x = _EXP[n - 1 - idx]
+        x_inv = _EXP[(255 - (n - 1 - idx)) % 255]
+        denominator = 0
+        for i in range(1, len(locator), 2):
+            denominator ^= gf_mul(locator[i], _EXP[(_LOG[x_inv] * (i - 1)) % 255])
+        if denominator == 0:
+            raise QRDecodeError("uncorrectable block")
+        codewords[idx] ^= gf_mul(x, gf_div(_poly_eval_low(evaluator, x_inv), denominator))
+    return len(positions)
+
+
+# ---------------------------------------------------------------------------
+# Symbol layout tables (ISO/IEC 18004); indexed [level][version]
+# ---------------------------------------------------------------------------
+
+LEVELS = ("L", "M", "Q", "H")
+# Format information encodes the level with these two bits.
+LEVEL_BITS = {"L": 1, "M": 0, "Q": 3, "H": 2}
+ECC_CODEWORDS_PER_BLOCK = {
+    "L": (7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28,
+          28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    "M": (10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26,
+          26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    "Q": (13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30,
+          28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    "H": (17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28,
+          30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+}
+NUM_BLOCKS = {
+    "L": (1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8,
+          8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    "M": (1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16,
+          17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    "Q": (1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20,
+          23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    "H": (1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25,
+          25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+}
+MASKS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+ALPHANUMERIC = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+# ECI assignment numbers -> Python codecs; 9 (ISO-8859-7) is the Greek one.
+ECI_CHARSETS = {
+    1: "iso-8859-1", 3: "iso-8859-1", 4: "iso-8859-2", 5: "iso-8859-3", 6: "iso-8859-4",
+    7: "iso-8859-5", 8: "iso-8859-6", 9: "iso-8859-7", 10: "iso-8859-8", 11: "iso-8859-9",
+    20: "shift_jis", 21: "cp1250", 22: "cp1251", 23: "cp1252", 24: "cp1256", 26: "utf-8",
+}
+
+
+def symbol_size(version):
+    return version * 4 + 17
+
+
+def alignment_positions(version):
+    if version == 1:
+        return []
+    count = version // 7 + 2
+    step = 26 if version == 32 else (version * 4 + count * 2 + 1) // (count * 2 - 2) * 2
+    return list(reversed([version * 4 + 10 - i * step for i in range(count - 1)] + [6]))
+
+
+def raw_codewords(version):
+    modules = (16 * version + 128) * version + 64
+    if version >= 2:
+        count = version // 7 + 2
+        modules -= (25 * count - 10) * count - 55
+        if version >= 7:
+            modules -= 36
+    return modules // 8
+
+
+def block_layout(version, level):
+    """``(ecc_len, [data codewords per block])``; short blocks come first."""
+    blocks = NUM_BLOCKS[level][version - 1]
+    ecc_len = ECC_CODEWORDS_PER_BLOCK[level][version - 1]
+    raw = raw_codewords(version)
+    short_len = raw // blocks - ecc_len
+    num_short = blocks - raw % blocks
+    return ecc_len, [short_len + (0 if i < num_short else 1) for i in range(blocks)]
+
+
+def format_bits(level, mask):
+    data = LEVEL_BITS[level] << 3 | mask
+    rem = data
+    for _ in range(10):
+        rem = (rem << 1) ^ ((rem >> 9) * 0x537)
+    return (data << 10 | rem) ^ 0x5412
+
+
+def version_bits(version):
+    rem = version
+    for _ in range(12):
+        rem = (rem << 1) ^ ((rem >> 11) * 0x1F25)
+    return version << 12 | rem
+
+
+def format_positions(size):
+    """Module coordinates ``(x, y)`` of format bits 0..14 for both copies."""
+    first = [(8, i) for i in range(6)] + [(8, 7), (8, 8), (7, 8)] + [(14 - i, 8) for i in range(9, 15)]
+    second = [(size - 1 - i, 8) for i in range(8)] + [(8, size - 15 + i) for i in range(8, 15)]
+    return first, second
+
+
+def version_positions(size):
+    """Module coordinates of version bits 0..17 for both copies (versions 7+)."""
+    first = [(size - 11 + i % 3, i // 3) for i in range(18)]
+    second = [(i // 3, size - 11 + i % 3) for i in range(18)]
+    return first, second
+
+
+def function_mask(version):
+    """``size x size`` grid (rows of bools) marking finder, timing, alignment, format and version modules."""
+    size = symbol_size(version)
+    grid = [[False] * size for _ in range(size)]
+
+    def fill(x0, y0, w, h):
+        for y in range(max(0, y0), min(size, y0 + h)):
+            for x in range(max(0, x0), min(size, x0 + w)):
+                grid[y][x] = True
+
+    fill(0, 0, 9, 9)
+    fill(size - 8, 0, 8, 9)
+    fill(0, size - 8, 9, 8)
+    fill(6, 0, 1, size)
+    fill(0, 6, size, 1)
+    positions = alignment_positions(version)
+    last = len(positions) - 1
+    for i, cy in enumerate(positions):
+        for j, cx in enumerate(positions):
+            if (i, j) in ((0, 0), (0, last), (last, 0)):
+                continue
+            fill(cx - 2, cy - 2, 5, 5)
+    if version >= 7:
+        fill(size - 11, 0, 3, 6)
+        fill(0, size - 11, 6, 3)
+    return grid
+
+
+def data_positions(version):
+    """Module coordinates ``(x, y)`` of the data/ECC bit stream, in placement order."""
+    size = symbol_size(version)
+    functions = function_mask(version)
+    order = []
+    for right in range(size - 1, 0, -2):
+        if right <= 6:
+            right -= 1
+        upward = (right + 1) & 2 == 0
+        for vert in range(size):
+            y = size - 1 - vert if upward else vert
+            for x in (right, right - 1):
+                if not functions[y][x]:
+                    order.append((x, y))
+    return order
+
+
+_LAYOUT_CACHE = {}
+
+
+def _data_positions_cached(version):
+    cached = _LAYOUT_CACHE.get(version)
+    if cached is None:
+        cached = _LAYOUT_CACHE[version] = data_positions(version)
+    return cached
+
+
+# ---------------------------------------------------------------------------
+# Image loading
+# ---------------------------------------------------------------------------
+
+class Gray:
+    """8-bit grayscale image: ``pixels`` is row-major bytes of ``width * height``."""
+
+    __slots__ = ("width", "height", "pixels")
+
+    def __init__(self, width, height, pixels):
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+
+
+def load_gray(data):
+    """Decode PNG/JPEG bytes (anything Pillow reads when it is installed) to :class:`Gray`."""
+    if Image is not None:
+        try:
+            img = Image.open(BytesIO(data))
+            # Let the JPEG decoder downscale in the DCT domain when it can.
+            img.draft("L", (MAX_SIDE, MAX_SIDE))
+            img = img.convert("L")
+        except Exception as e:
+            raise QRDecodeError(f"unreadable image: {e}")
+        return Gray(img.width, img.height, img.tobytes())
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return _decode_png(data)
+    if data[:2] == b"\xff\xd8":
+        return _decode_jpeg(data)
+    raise QRDecodeError("unsupported image format (PNG and baseline JPEG only without Pillow)")
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def _decode_png(data):
+    pos = 8
+    idat = []
+    header = palette = None
+    while pos + 8 <= len(data):
+        length = int.from_bytes(data[pos:pos + 4], "big")
+        kind = data[pos + 4:pos + 8]
+        body = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if kind == b"IHDR":
+            header = body
+        elif kind == b"PLTE":
+            palette = body
+        elif kind == b"IDAT":
+            idat.append(body)
+        elif kind == b"IEND":
+            break
+    if header is None:
+        raise QRDecodeError("PNG without IHDR")
+    width = int.from_bytes(header[0:4], "big")
+    height = int.from_bytes(header[4:8], "big")
+    depth, color, interlace = header[8], header[9], header[12]
+    if interlace:
+        raise QRDecodeError("interlaced PNG is not supported")
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color)
+    if channels is None or depth not in (1, 2, 4, 8, 16):
+        raise QRDecodeError("unsupported PNG pixel format")
+    try:
+        raw = zlib.decompress(b"".join(idat))
+    except zlib.error as e:
+        raise QRDecodeError(f"corrupt PNG data: {e}")
+    bits_per_pixel = channels * depth
+    stride = (width * bits_per_pixel + 7) // 8
+    bpp = max(1, bits_per_pixel // 8)
+    rows = []
+    prior = bytearray(stride)
+    for y in range(height):
+        start = y * (stride + 1)
+        kind = raw[start]
+        row = bytearray(raw[start + 1:start + 1 + stride])
+        if len(row) < stride:
+            raise QRDecodeError("truncated PNG data")
+        if kind == 1:
+            for i in range(bpp, stride):
+                row[i] = (row[i] + row[i - bpp]) & 0xFF
+        elif kind == 2:
+            if np is not None:
+                row = bytearray((np.frombuffer(row, np.uint8) + np.frombuffer(prior, np.uint8)).tobytes())
+            else:
+                row = bytearray((a + b) & 0xFF for a, b in zip(row, prior))
+        elif kind == 3:
+            for i in range(stride):
+                left = row[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + ((left + prior[i]) >> 1)) & 0xFF
+        elif kind == 4:
+            for i in range(stride):
+                left = row[i - bpp] if i >= bpp else 0
+                upper_left = prior[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + _paeth(left, prior[i], upper_left)) & 0xFF
+        elif kind != 0:
+            raise QRDecodeError("bad PNG filter")
+        rows.append(bytes(row))
+        prior = row
+    out = bytearray()
+    for row in rows:
+        if depth < 8:
+            per_byte = 8 // depth
+            top = (1 << depth) - 1
+            values = [(byte >> (8 - depth * (k + 1))) & top for byte in row for k in range(per_byte)][:width]
+            if color == 3:
+                out.extend(values)
+            else:
+                out.extend(v * 255 // top for v in values)
+            continue
+        if depth == 16:
+            row = row[0::2]
+        if color == 0 or color == 3:
+            out.extend(row)
+        elif color == 4:
+            out.extend(row[0::2])
+        else:
+            step = channels
+            out.extend((r * 299 + g * 587 + b * 114) // 1000 for r, g, b in zip(row[0::step], row[1::step], row[2::step]))
+    if color == 3:
+        if not palette:
+            raise QRDecodeError("palette PNG without PLTE")
+        lut = bytes(
+            (palette[3 * i] * 299 + palette[3 * i + 1] * 587 + palette[3 * i + 2] * 114) // 1000
+            if 3 * i + 2 < len(palette) else 0
+            for i in range(256)
+        )
+        out = bytes(out).translate(lut)
+    return Gray(width, height, bytes(out))
+
+
+_ZIGZAG = (
+    0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+    12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+)
+_JPEG_SEGMENT_END_RE = re.compile(rb"\xff[^\x00\xd0-\xd7]")
+_JPEG_RESTART_RE = re.compile(rb"\xff[\xd0-\xd7]")
+
+
+def _huffman_lookup(counts, symbols):
+    """65536-entry table: the next 16 bits of the stream -> ``length << 8 | symbol``."""
+    table = [0] * 65536
+    code = 0
+    k = 0
+    for length in range(1, 17):
+        for _ in range(counts[length - 1]):
+            start = code << (16 - length)
+            span = 1 << (16 - length)
+            table[start:start + span] = [length << 8 | symbols[k]] * span
+            code += 1
+            k += 1
+        code <<= 1
+    return table
+
+
+def _idct_matrix(n):
+    """``n x n`` reduced inverse DCT basis: rows are output samples, columns frequencies."""
+    return [
+        [(math.sqrt(0.5) if u == 0 else 1.0) / 2 * math.cos((2 * x + 1) * u * math.pi / (2 * n)) for u in range(n)]
+        for x in range(n)
+    ]
+
+
+def _decode_jpeg(data):
+    """
+    Baseline (sequential Huffman) JPEG -> luma only. Large images are reduced in the
+    DCT domain (only the low-frequency N x N corner of each block is transformed).
+    """
+    quant = {}
+    dc_tables, ac_tables = {}, {}
+    frame = None
+    restart_interval = 0
+    blocks = None
+    pos = 2
+    while pos < len(data):
+        if data[pos] != 0xFF:
+            pos += 1
+            continue
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xD9:
+            break
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        body = data[pos + 4:pos + 2 + length]
+        pos += 2 + length
+        if marker == 0xDB:
+            i = 0
+            while i < len(body):
+                precision, table_id = body[i] >> 4, body[i] & 15
+                count = 128 if precision else 64
+                raw = body[i + 1:i + 1 + count]
+                values = [int.from_bytes(raw[k:k + 2], "big") for k in range(0, 128, 2)] if precision else list(raw)
+                natural = [0] * 64
+                for k, value in enumerate(values):
+                    natural[_ZIGZAG[k]] = value
+                quant[table_id] = natural
+                i += 1 + count
+        elif marker == 0xC4:
+            i = 0
+            while i < len(body):
+                table_class, table_id = body[i] >> 4, body[i] & 15
+                counts = body[i + 1:i + 17]
+                total = sum(counts)
+                table = _huffman_lookup(counts, body[i + 17:i + 17 + total])
+                (ac_tables if table_class else dc_tables)[table_id] = table
+                i += 17 + total
+        elif marker in (0xC0, 0xC1):
+            height = int.from_bytes(body[1:3], "big")
+            width = int.from_bytes(body[3:5], "big")
+            components = []
+            for k in range(body[5]):
+                cid, sampling, qt = body[6 + 3 * k], body[7 + 3 * k], body[8 + 3 * k]
+                components.append({"id": cid, "h": sampling >> 4, "v": sampling & 15, "q": qt})
+            frame = {"width": width, "height": height, "components": components}
+        elif 0xC2 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            raise QRDecodeError("progressive/lossless JPEG is not supported without Pillow")
+        elif marker == 0xDD:
+            restart_interval = int.from_bytes(body[0:2], "big")
+        elif marker == 0xDA:
+            if frame is None:
+                raise QRDecodeError("JPEG scan before frame header")
+            end = _JPEG_SEGMENT_END_RE.search(data, pos)
+            end = end.start() if end else len(data)
+            blocks = _jpeg_scan(frame, body, data[pos:end], restart_interval, dc_tables, ac_tables, quant, blocks)
+            pos = end
+    if frame is None or blocks is None:
+        raise QRDecodeError("JPEG without image data")
+    return _jpeg_luma(frame, blocks)
+
+
+def _jpeg_scale(frame):
+    side = max(frame["width"], frame["height"])
+    for n in (8, 4, 2):
+        if side * n <= MAX_SIDE * 8:
+            return n
+    return 1
+
+
+def _jpeg_scan(frame, header, entropy, restart_interval, dc_tables, ac_tables, quant, blocks):
+    components = frame["components"]
+    luma = components[0]
+    h_max = max(c["h"] for c in components)
+    v_max = max(c["v"] for c in components)
+    mcus_x = -(-frame["width"] // (8 * h_max))
+    mcus_y = -(-frame["height"] // (8 * v_max))
+    blocks_x = mcus_x * luma["h"]
+    blocks_y = mcus_y * luma["v"]
+    if blocks is None:
+        blocks = {"x": blocks_x, "y": blocks_y, "n": _jpeg_scale(frame), "coef": {}}
+    n = blocks["n"]
+    keep = [k for k in range(64) if _ZIGZAG[k] // 8 < n and _ZIGZAG[k] % 8 < n]
+    keep_set = set(keep)
+
+    scan = []
+    for k in range(header[0]):
+        cid, tables = header[1 + 2 * k], header[2 + 2 * k]
+        component = next((c for c in components if c["id"] == cid), None)
+        if component is None:
+            raise QRDecodeError("JPEG scan references an unknown component")
+        scan.append((component, dc_tables.get(tables >> 4), ac_tables.get(tables & 15)))
+    if any(dc is None or ac is None for _c, dc, ac in scan):
+        raise QRDecodeError("JPEG scan without Huffman tables")
+    if len(scan) == 1:
+        component = scan[0][0]
+        width = -(-frame["width"] * component["h"] // h_max)
+        height = -(-frame["height"] * component["v"] // v_max)
+        per_row = -(-width // 8)
+        units = [[(component, scan[0][1], scan[0][2], 0, 0)] for _ in range(per_row * -(-height // 8))]
+        unit_origin = [((i % per_row), (i // per_row)) for i in range(len(units))]
+    else:
+        layout = [
+            (component, dc, ac, bx, by)
+            for component, dc, ac in scan
+            for by in range(component["v"])
+            for bx in range(component["h"])
+        ]
+        units = [layout] * (mcus_x * mcus_y)
+        unit_origin = [(i % mcus_x, i // mcus_x) for i in range(len(units))]
+
+    segments = _JPEG_RESTART_RE.split(entropy)
+    per_segment = restart_interval or len(units)
+    coef_store = blocks["coef"]
+    unit = 0
+    for segment in segments:
+        buf = segment.replace(b"\xff\x00", b"\xff") + b"\xff\xff\xff\xff"
+        bit = 0
+        predictors = {}
+        for _ in range(per_segment):
+            if unit >= len(units):
+                break
+            ux, uy = unit_origin[unit]
+            for component, dc_table, ac_table, bx, by in units[unit]:
+                want = component is luma
+                q = quant.get(component["q"]) if want else None
+                # DC coefficient
+                byte = bit >> 3
+                entry = dc_table[(int.from_bytes(buf[byte:byte + 3], "big") >> (8 - (bit & 7))) & 0xFFFF]
+                if not entry:
+                    raise QRDecodeError("bad JPEG Huffman code")
+                bit += entry >> 8
+                size = entry & 0xFF
+                diff = 0
+                if size:
+                    byte = bit >> 3
+                    diff = (int.from_bytes(buf[byte:byte + 3], "big") >> (24 - (bit & 7) - size)) & ((1 << size) - 1)
+                    bit += size
+                    if diff < 1 << (size - 1):
+                        diff -= (1 << size) - 1
+                dc = predictors.get(component["id"], 0) + diff
+                predictors[component["id"]] = dc
+                coefs = None
+                if want:
+                    coefs = [0] * 64
+                    coefs[0] = dc * q[0]
+                k = 1
+                while k < 64:
+                    byte = bit >> 3
+                    entry = ac_table[(int.from_bytes(buf[byte:byte + 3], "big") >> (8 - (bit & 7))) & 0xFFFF]
+                    if not entry:
+                        raise QRDecodeError("bad JPEG Huffman code")
+                    bit += entry >> 8
+                    rs = entry & 0xFF
+                    run, size = rs >> 4, rs & 15
+                    if size == 0:
+                        if run != 15:
+                            break
+                        k += 16
+                        continue
+                    k += run
+                    if k > 63:
+                        break
+                    byte = bit >> 3
+                    value = (int.from_bytes(buf[byte:byte + 3], "big") >> (24 - (bit & 7) - size)) & ((1 << size) - 1)
+                    bit += size
+                    if want and k in keep_set:
+                        if value < 1 << (size - 1):
+                            value -= (1 << size) - 1
+                        coefs[_ZIGZAG[k]] = value * q[_ZIGZAG[k]]
+                    k += 1
+                if want:
+                    if len(scan) == 1:
+                        coef_store[(ux, uy)] = coefs
+                    else:
+                        coef_store[(ux * luma["h"] + bx, uy * luma["v"] + by)] = coefs
+            unit += 1
+    return blocks
+
+
+def _jpeg_luma(frame, blocks):
+    n = blocks["n"]
+    bx_count, by_count = blocks["x"], blocks["y"]
+    h_max = max(c["h"] for c in frame["components"])
+    luma = frame["components"][0]
+    out_w = -(-frame["width"] * luma["h"] // h_max * n // 8)
+    out_h = -(-frame["height"] * luma["v"] // max(c["v"] for c in frame["components"]) * n // 8)
+    full_w = bx_count * n
+    basis = _idct_matrix(n)
+    coef_store = blocks["coef"]
+    if np is not None:
+        matrix = np.array(basis)
+        stack = np.zeros((by_count, bx_count, n, n))
+        for (bx, by), coefs in coef_store.items():
+            if bx < bx_count and by < by_count:
+                stack[by, bx] = np.array(coefs).reshape(8, 8)[:n, :n]
+        pixels = np.einsum("xu,abuv,yv->abxy", matrix, stack, matrix) + 128
+        pixels = np.clip(np.rint(pixels), 0, 255).astype(np.uint8)
+        image = pixels.transpose(0, 2, 1, 3).reshape(by_count * n, bx_count * n)[:out_h, :out_w]
+        return Gray(out_w, out_h, image.tobytes())
+    image = bytearray(full_w * by_count * n)
+    for (bx, by), coefs in coef_store.items():
+        if bx >= bx_count or by >= by_count:
+            continue
+        if not any(coefs[1:]):
+            value = min(255, max(0, round(coefs[0] / 8 + 128)))
+            samples = [[value] * n for _ in range(n)]
+        else:
+            block = [coefs[8 * u:8 * u + n] for u in range(n)]
+            rows = [[sum(basis[y][u] * block[u][v] for u in range(n)) for v in range(n)] for y in range(n)]
+            samples = [
+                [min(255, max(0, round(sum(basis[x][v] * row[v] for v in range(n)) + 128))) for x in range(n)]
+                for row in rows
+            ]
+        for y in range(n):
+            start = (by * n + y) * full_w + bx * n
+            image[start:start + n] = bytes(samples[y])
+    rows = [bytes(image[y * full_w:y * full_w + out_w]) for y in range(out_h)]
+    return Gray(out_w, out_h, b"".join(rows))
+
+
+def downscale(gray, max_side=MAX_SIDE):
+    """Box-filter ``gray`` by an integer factor so its longer side fits ``max_side``."""
+    factor = -(-max(gray.width, gray.height) // max_side)
+    if factor <= 1:
+        return gray
+    width, height = gray.width // factor, gray.height // factor
+    if np is not None:
+        image = np.frombuffer(gray.pixels, np.uint8).reshape(gray.height, gray.width)
+        image = image[:height * factor, :width * factor].reshape(height, factor, width, factor)
+        return Gray(width, height, (image.sum(axis=(1, 3), dtype=np.int64) // (factor * factor)).astype(np.uint8).tobytes())
+    src, w = gray.pixels, gray.width
+    out = bytearray(width * height)
+    area = factor * factor
+    for y in range(height):
+        sums = [0] * width
+        for dy in range(factor):
+            start = (y * factor + dy) * w
+            row = src[start:start + width * factor]
+            for x in range(width):
+                sums[x] += sum(row[x * factor:(x + 1) * factor])
+        out[y * width:(y + 1) * width] = bytes(s // area for s in sums)
+    return Gray(width, height, bytes(out))
+
+
+# ---------------------------------------------------------------------------
+# Binarization: 1 = dark module, 0 = light
+# ---------------------------------------------------------------------------
+
+_THRESHOLD_TABLES = [bytes(1 if value <= t else 0 for value in range(256)) for t in range(256)]
+
+
+def binarize_adaptive(gray):
+    """
+    Local-mean threshold: the image is cut into blocks, and each block's pixels are
+    compared with the mean of the 5x5 blocks around it (windows clamped at edges).
+    """
+    width, height = gray.width, gray.height
+    block = max(8, min(width, height) // 40)
+    bw, bh = -(-width // block), -(-height // block)
+    if bw < 5 or bh < 5:
+        return binarize_global(gray)
+    src = gray.pixels
+    if np is not None:
+        image = np.frombuffer(src, np.uint8).reshape(height, width).astype(np.int64)
+        padded = np.pad(image, ((0, bh * block - height), (0, bw * block - width)), mode="edge")
+        means = padded.reshape(bh, block, bw, block).sum(axis=(1, 3)) // (block * block)
+        integral = np.zeros((bh + 1, bw + 1), np.int64)
+        integral[1:, 1:] = means.cumsum(0).cumsum(1)
+        top = np.clip(np.arange(bh) - 2, 0, bh - 5)[:, None]
+        left = np.clip(np.arange(bw) - 2, 0, bw - 5)[None, :]
+        window = integral[top + 5, left + 5] - integral[top, left + 5] - integral[top + 5, left] + integral[top, left]
+        thresholds = np.repeat(np.repeat(window // 25, block, 0), block, 1)[:height, :width]
+        return (image <= thresholds).astype(np.uint8).tobytes()
+    means = [[0] * bw for _ in range(bh)]
+    for by in range(bh):
+        y0, y1 = by * block, min(height, (by + 1) * block)
+        rows = [src[y * width:(y + 1) * width] for y in range(y0, y1)]
+        for bx in range(bw):
+            x0, x1 = bx * block, min(width, (bx + 1) * block)
+            total = sum(sum(row[x0:x1]) for row in rows)
+            # Edge blocks are padded by repeating their last row/column, like the NumPy path.
+            count = (y1 - y0) * (x1 - x0)
+            if count != block * block:
+                extra_x = block - (x1 - x0)
+                extra_y = block - (y1 - y0)
+                last_row = rows[-1]
+                total += extra_x * sum(row[x1 - 1] for row in rows)
+                total += extra_y * sum(last_row[x0:x1]) + extra_x * extra_y * last_row[x1 - 1]
+            means[by][bx] = total // (block * block)
+    integral = [[0] * (bw + 1) for _ in range(bh + 1)]
+    for by in range(bh):
+        running = 0
+        for bx in range(bw):
+            running += means[by][bx]
+            integral[by + 1][bx + 1] = integral[by][bx + 1] + running
+    out = bytearray(width * height)
+    for by in range(bh):
+        top = min(max(by - 2, 0), bh - 5)
+        y0, y1 = by * block, min(height, (by + 1) * block)
+        for bx in range(bw):
+            left = min(max(bx - 2, 0), bw - 5)
+            window = (integral[top + 5][left + 5] - integral[top][left + 5]
+                      - integral[top + 5][left] + integral[top][left])
+            table = _THRESHOLD_TABLES[window // 25]
+            x0, x1 = bx * block, min(width, (bx + 1) * block)
+            for y in range(y0, y1):
+                start = y * width
+                out[start + x0:start + x1] = src[start + x0:start + x1].translate(table)
+    return bytes(out)
+
+
+def binarize_global(gray):
+    """Otsu threshold over the whole image."""
+    src = gray.pixels
+    if np is not None:
+        histogram = np.bincount(np.frombuffer(src, np.uint8), minlength=256).tolist()
+    else:
+        histogram = [0] * 256
+        for value in src:
+            histogram[value] += 1
+    total = len(src)
+    weighted = sum(i * count for i, count in enumerate(histogram))
+    best, threshold = -1.0, 127
+    background = background_sum = 0
+    for t in range(256):
+        background += histogram[t]
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        background_sum += t * histogram[t]
+        mean_b = background_sum / background
+        mean_f = (weighted - background_sum) / foreground
+        between = background * foreground * (mean_b - mean_f) ** 2
+        if between > best:
+            best, threshold = between, t
+    return bytes(src).translate(_THRESHOLD_TABLES[threshold])
+
+
+# ---------------------------------------------------------------------------
+# Finder and alignment patterns
+# ---------------------------------------------------------------------------
+
+_RUN_RE = re.compile(rb"\x01+|\x00+")
+
+
+class FinderPattern:
+    __slots__ = ("x", "y", "module", "count")
+
+    def __init__(self, x, y, module):
+        self.x = x
+        self.y = y
+        self.module = module
+        self.count = 1
+
+    def near(self, x, y, module):
+        if abs(x - self.x) > self.module or abs(y - self.y) > self.module:
+            return False
+        return abs(module - self.module) <= max(1.0, self.module * 0.4)
+
+    def merge(self, x, y, module):
+        total = self.count + 1
+        self.x = (self.x * self.count + x) / total
+        self.y = (self.y * self.count + y) / total
+        self.module = (self.module * self.count + module) / total
+        self.count = total
+
+
+def _ratio_ok(runs):
+    total = sum(runs)
+    if total < 7:
+        return False
+    module = total / 7.0
+    slack = module / 1.5
+    return (abs(module - runs[0]) < slack and abs(module - runs[1]) < slack
+            and abs(3 * module - runs[2]) < 3 * slack
+            and abs(module - runs[3]) < slack and abs(module - runs[4]) < slack)
+
+
+def _cross_check(bits, width, height, x, y, dx, dy, max_count, expected_total):
+    """
+    Walk from (x, y) both ways along (dx, dy) measuring the 1:1:3:1:1 runs; returns the
+    refined centre offset along the line or None.
+    """
+    def at(step):
+        px, py = x + dx * step, y + dy * step
+        if 0 <= px < width and 0 <= py < height:
+            return bits[py * width + px]
+        return None
+
+    counts = [0] * 5
+    step = 0
+    while at(-step) == 1:
+        counts[2] += 1
+        step += 1
+    if at(-step) is None:
+        return None
+    while at(-step) == 0 and counts[1] <= max_count:
+        counts[1] += 1
+        step += 1
+    if at(-step) is None or counts[1] > max_count:
+        return None
+    while at(-step) == 1 and counts[0] <= max_count:
+        counts[0] += 1
+        step += 1
+    if counts[0] > max_count:
+        return None
+    step = 1
+    while at(step) == 1:
+        counts[2] += 1
+        step += 1
+    if at(step) is None:
+        return None
+    while at(step) == 0 and counts[3] < max_count:
+        counts[3] += 1
+        step += 1
+    if at(step) is None or counts[3] >= max_count:
+        return None
+    while at(step) == 1 and counts[4] < max_count:
+        counts[4] += 1
+        step += 1
+    if counts[4] >= max_count:
+        return None
+    total = sum(counts)
+    if 5 * abs(total - expected_total) >= 2 * expected_total or not _ratio_ok(counts):
+        return None
+    end = step - counts[4] - counts[3]
+    return end - counts[2] / 2.0, total
+
+
+def find_finder_patterns(bits, width, height):
+    candidates = []
+    row_step = max(1, height // 400)
+    for y in range(0, height, row_step):
+        row = bits[y * width:(y + 1) * width]
+        runs = [(m.start(), m.end() - m.start(), row[m.start()]) for m in _RUN_RE.finditer(row)]
+        for i in range(len(runs) - 4):
+            if runs[i][2] != 1:
+                continue
+            lengths = [runs[i + k][1] for k in range(5)]
+            if not _ratio_ok(lengths):
+                continue
+            total = sum(lengths)
+            center_x = runs[i + 2][0] + lengths[2] / 2.0
+            cx = int(center_x)
+            vertical = _cross_check(bits, width, height, cx, y, 0, 1, lengths[2], total)
+            if vertical is None:
+                continue
+            center_y = y + vertical[0]
+            horizontal = _cross_check(bits, width, height, cx, int(center_y), 1, 0, lengths[2], total)
+            if horizontal is None:
+                continue
+            center_x = cx + horizontal[0]
+            module = (total + vertical[1] + horizontal[1]) / 21.0
+            for candidate in candidates:
+                if candidate.near(center_x, center_y, module):
+                    candidate.merge(center_x, center_y, module)
+                    break
+            else:
+                candidates.append(FinderPattern(center_x, center_y, module))
+    return candidates
+
+
+def _distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def finder_triples(candidates, limit=6):
+    """Plausible ``(top_left, top_right, bottom_left)`` triples, best first."""
+    pool = sorted(candidates, key=lambda c: -c.count)[:12]
+    scored = []
+    for i in range(len(pool)):
+        for j in range(i + 1, len(pool)):
+            for k in range(j + 1, len(pool)):
+                trio = (pool[i], pool[j], pool[k])
+                modules = [c.module for c in trio]
+                if max(modules) > 1.6 * min(modules):
+                    continue
+                points = [(c.x, c.y) for c in trio]
+                sides = sorted(
+                    ((_distance(points[a], points[b]), a, b) for a, b in ((0, 1), (0, 2), (1, 2))),
+                    reverse=True,
+                )
+                hyp, legs = sides[0], sides[1:]
+                if legs[1][0] < 7 * min(modules):
+                    continue
+                leg_ratio = legs[0][0] / legs[1][0]
+                pythagoras = abs(hyp[0] ** 2 - legs[0][0] ** 2 - legs[1][0] ** 2) / hyp[0] ** 2
+                if leg_ratio > 1.5 or pythagoras > 0.35:
+                    continue
+                corner = ({0, 1, 2} - {hyp[1], hyp[2]}).pop()
+                top_left = trio[corner]
+                a, b = trio[hyp[1]], trio[hyp[2]]
+                cross = (a.x - top_left.x) * (b.y - top_left.y) - (a.y - top_left.y) * (b.x - top_left.x)
+                top_right, bottom_left = (a, b) if cross > 0 else (b, a)
+                score = (leg_ratio - 1) + pythagoras - 0.05 * min(c.count for c in trio)
+                scored.append((score, (top_left, top_right, bottom_left)))
+    scored.sort(key=lambda item: item[0])
+    return [trio for _score, trio in scored[:limit]]
+
+
+def _alignment_runs(at, limit):
+    """Lengths of the dark centre run and the light runs either side along one line, or None."""
+    counts = []
+    for direction in (-1, 1):
+        step = 0 if direction == 1 else 1
+        dark = light = 0
+        while at(direction * step) == 1 and dark <= limit:
+            dark += 1
+            step += 1
+        while at(direction * step) == 0 and light <= limit:
+            light += 1
+            step += 1
+        if light == 0 or light > limit or at(direction * step) != 1:
+            return None
+        counts.append((dark, light))
+    (dark_up, light_up), (dark_down, light_down) = counts
+    return dark_up, dark_down, light_up, light_down
+
+
+def _find_alignment(bits, width, height, x, y, module, radius):
+    """
+    Centre of an alignment pattern near (x, y), or None: rows of the search window
+    are scanned for light-dark-light runs of about one module, and each hit is
+    cross-checked along its column. Hits seen on several rows win; ties go to the
+    one nearest the estimate.
+    """
+    reach = int(radius * module)
+    x0, x1 = max(0, int(x) - reach), min(width, int(x) + reach + 1)
+    y0, y1 = max(0, int(y) - reach), min(height, int(y) + reach + 1)
+    low, high = module * 0.5, module * 1.6
+    found = []
+    for py in range(y0, y1):
+        row = bits[py * width + x0:py * width + x1]
+        runs = [(m.start(), m.end() - m.start(), row[m.start()]) for m in _RUN_RE.finditer(row)]
+        for i in range(1, len(runs) - 1):
+            start, length, value = runs[i]
+            if value != 1 or not all(low <= runs[k][1] <= high for k in (i - 1, i, i + 1)):
+                continue
+            if i - 1 == 0 or i + 1 == len(runs) - 1:
+                continue  # the outer dark ring must be visible on both sides
+            cx = x0 + start + length // 2
+
+            def column(step, cx=cx, py=py):
+                sy = py + step
+                return bits[sy * width + cx] if 0 <= sy < height else None
+
+            vertical = _alignment_runs(column, int(high) + 1)
+            if vertical is None:
+                continue
+            dark_up, dark_down, light_up, light_down = vertical
+            if not (low <= dark_up + dark_down - 1 <= high and low <= light_up <= high and low <= light_down <= high):
+                continue
+            cy = py + (dark_down - dark_up) / 2.0
+            centre_x = x0 + start + length / 2.0
+            for hit in found:
+                if abs(hit[0] - centre_x) <= module / 2 and abs(hit[1] - cy) <= module / 2:
+                    hit[2] += 1
+                    break
+            else:
+                found.append([centre_x, cy, 1])
+    if not found:
+        return None
+    best = max(found, key=lambda h: (h[2], -((h[0] - x) ** 2 + (h[1] - y) ** 2)))
+    return best[0], best[1]
+
+
+# ---------------------------------------------------------------------------
+# Geometry and sampling
+# ---------------------------------------------------------------------------
+
+def perspective(src, dst):
+    """Homography coefficients mapping four ``src`` points onto ``dst`` points."""
+    rows = []
+    for (u, v), (x, y) in zip(src, dst):
+        rows.append([u, v, 1, 0, 0, 0, -u * x, -v * x, x])
+        rows.append([0, 0, 0, u, v, 1, -u * y, -v * y, y])
+    for col in range(8):
+        pivot = max(range(col, 8), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            raise QRDecodeError("degenerate geometry")
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(8):
+            if r != col:
+                factor = rows[r][col] / rows[col][col]
+                if factor:
+                    rows[r] = [a - factor * b for a, b in zip(rows[r], rows[col])]
+    return [rows[i][8] / rows[i][i] for i in range(8)]
+
+
+def sample_grid(bits, width, height, transform, size):
+    a, b, c, d, e, f, g, h = transform
+    if np is not None:
+        image = np.frombuffer(bits, np.uint8).reshape(height, width)
+        v, u = np.mgrid[0:size, 0:size] + 0.5
+        denom = g * u + h * v + 1
+        xs = np.clip(((a * u + b * v + c) / denom).astype(np.int64), 0, width - 1)
+        ys = np.clip(((d * u + e * v + f) / denom).astype(np.int64), 0, height - 1)
+        return [[bool(value) for value in row] for row in image[ys, xs].tolist()]
+    grid = []
+    for row in range(size):
+        v = row + 0.5
+        line = []
+        for col in range(size):
+            u = col + 0.5
+            denom = g * u + h * v + 1
+            x = min(width - 1, max(0, int((a * u + b * v + c) / denom)))
+            y = min(height - 1, max(0, int((d * u + e * v + f) / denom)))
+            line.append(bits[y * width + x] == 1)
+        grid.append(line)
+    return grid
+
+
+def _locate(bits, width, height, trio, size):
+    top_left, top_right, bottom_left = trio
+    src = [(3.5, 3.5), (size - 3.5, 3.5), (3.5, size - 3.5)]
+    dst = [(top_left.x, top_left.y), (top_right.x, top_right.y), (bottom_left.x, bottom_left.y)]
+    br_x = top_right.x - top_left.x + bottom_left.x
+    br_y = top_right.y - top_left.y + bottom_left.y
+    # Under perspective the far corner's modules grow as much as the other two corners' do.
+    module = max(top_left.module / 2, top_right.module + bottom_left.module - top_left.module)
+    if size > 21:
+        # The bottom-right alignment pattern centre sits 3 modules in from the finder corner.
+        correction = 1 - 3.0 / (size - 7)
+        est_x = top_left.x + correction * (br_x - top_left.x)
+        est_y = top_left.y + correction * (br_y - top_left.y)
+        for radius in (4, 8, 16):
+            found = _find_alignment(bits, width, height, est_x, est_y, module, radius)
+            if found:
+                return perspective(src + [(size - 6.5, size - 6.5)], dst + [found])
+    return perspective(src + [(size - 3.5, size - 3.5)], dst + [(br_x, br_y)])
+
+
+# ---------------------------------------------------------------------------
+# Symbol decoding
+# ---------------------------------------------------------------------------
+
+def _hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def read_format(grid):
+    size = len(grid)
+    best = None
+    for positions in format_positions(size):
+        value = 0
+        for i, (x, y) in enumerate(positions):
+            if grid[y][x]:
+                value |= 1 << i
+        for level in LEVELS:
+            for mask in range(8):
+                distance = _hamming(value, format_bits(level, mask))
+                if best is None or distance < best[0]:
+                    best = (distance, level, mask)
+    if best[0] > 3:
+        raise QRDecodeError("unreadable format information")
+    return best[1], best[2]
+
+
+def read_version(grid):
+    size = len(grid)
+    estimated = (size - 17) // 4
+    if estimated < 7:
+        return estimated
+    best = None
+    for positions in version_positions(size):
+        value = 0
+        for i, (x, y) in enumerate(positions):
+            if grid[y][x]:
+                value |= 1 << i
+        for version in range(7, 41):
+            distance = _hamming(value, version_bits(version))
+            if best is None or distance < best[0]:
+                best = (distance, version)
+    return best[1] if best[0] <= 3 else estimated
+
+
+def read_codewords(grid, version, mask):
+    condition = MASKS[mask]
+    positions = _data_positions_cached(version)
+    total = raw_codewords(version)
+    out = bytearray(total)
+    for i in range(total * 8):
+        x, y = positions[i]
+        if grid[y][x] != condition(x, y):
+            out[i >> 3] |= 0x80 >> (i & 7)
+    return out
+
+
+def correct_codewords(codewords, version, level):
+    ecc_len, data_lens = block_layout(version, level)
+    blocks = [[] for _ in data_lens]
+    index = 0
+    for i in range(max(data_lens)):
+        for j, length in enumerate(data_lens):
+            if i < length:
+                blocks[j].append(codewords[index])
+                index += 1
+    for _ in range(ecc_len):
+        for block in blocks:
+            block.append(codewords[index])
+            index += 1
+    data = bytearray()
+    for block, length in zip(blocks, data_lens):
+        rs_correct(block, ecc_len)
+        data.extend(block[:length])
+    return bytes(data)
+
+
+class _BitReader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def remaining(self):
+        return len(self.data) * 8 - self.pos
+
+    def read(self, count):
+        if count > self.remaining():
+            raise QRDecodeError("truncated data segment")
+        value = 0
+        for _ in range(count):
+            value = (value << 1) | ((self.data[self.pos >> 3] >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+
+def _count_bits(mode, version):
+    group = 0 if version <= 9 else (1 if version <= 26 else 2)
+    return {1: (10, 12, 14), 2: (9, 11, 13), 4: (8, 16, 16), 8: (8, 10, 12)}[mode][group]
+
+
+def decode_segments(data, version):
+    reader = _BitReader(data)
+    parts = []
+    charset = None
+    while reader.remaining() >= 4:
+        mode = reader.read(4)
+        if mode == 0:
+            break
+        if mode == 7:
+            first = reader.read(8)
+            if first & 0x80 == 0:
+                eci = first
+            elif first & 0xC0 == 0x80:
+                eci = ((first & 0x3F) << 8) | reader.read(8)
+            else:
+                eci = ((first & 0x1F) << 16) | reader.read(16)
+            charset = ECI_CHARSETS.get(eci, charset)
+            continue
+        if mode == 3:
+            reader.read(16)
+            continue
+        if mode == 5:
+            continue
+        if mode == 9:
+            reader.read(8)
+            continue
+        if mode not in (1, 2, 4, 8):
+            raise QRDecodeError(f"unknown segment mode {mode}")
+        count = reader.read(_count_bits(mode, version))
+        if mode == 1:
+            digits = []
+            while count >= 3:
+                digits.append("%03d" % reader.read(10))
+                count -= 3
+            if count == 2:
+                digits.append("%02d" % reader.read(7))
+            elif count == 1:
+                digits.append("%d" % reader.read(4))
+            parts.append("".join(digits))
+        elif mode == 2:
+            chars = []
+            while count >= 2:
+                value = reader.read(11)
+                chars.append(ALPHANUMERIC[value // 45] + ALPHANUMERIC[value % 45])
+                count -= 2
+            if count:
+                chars.append(ALPHANUMERIC[reader.read(6)])
+            parts.append("".join(chars))
+        elif mode == 4:
+            raw = bytes(reader.read(8) for _ in range(count))
+            if charset:
+                parts.append(raw.decode(charset, errors="replace"))
+            else:
+                try:
+                    parts.append(raw.decode("utf-8"))
+                except UnicodeDecodeError:
+                    parts.append(raw.decode("iso-8859-1"))
+        else:
+            raw = bytearray()
+            for _ in range(count):
+                value = reader.read(13)
+                value = (value // 0xC0) << 8 | (value % 0xC0)
+                value += 0x8140 if value < 0x1F00 else 0xC140
+                raw.extend(value.to_bytes(2, "big"))
+            parts.append(bytes(raw).decode("shift_jis", errors="replace"))
+    return "".join(parts)
+
+
+def decode_grid(grid):
+    """Decode a sampled module grid (rows of bools, True = dark)."""
+    version = read_version(grid)
+    if symbol_size(version) != len(grid):
+        raise QRDecodeError("version information does not match the symbol size")
+    level, mask = read_format(grid)
+    codewords = read_codewords(grid, version, mask)
+    return decode_segments(correct_codewords(codewords, version, level), version)
+
+
+def _sizes_to_try(trio):
+    top_left, top_right, bottom_left = trio
+    module = (top_left.module + top_right.module + bottom_left.module) / 3
+    span = (_distance((top_left.x, top_left.y), (top_right.x, top_right.y))
+            + _distance((top_left.x, top_left.y), (bottom_left.x, bottom_left.y))) / 2
+    estimate = span / module + 7
+    version = min(40, max(1, int(round((estimate - 17) / 4))))
+    return [symbol_size(v) for v in (version, version - 1, version + 1) if 1 <= v <= 40]
+
+
+def decode_bits(bits, width, height):
+    """Find and decode a QR code in a binarized image; returns the text or raises QRDecodeError."""
+    candidates = find_finder_patterns(bits, width, height)
+    if len(candidates) < 3:
+        raise QRDecodeError("no finder patterns found")
+    last_error = QRDecodeError("no plausible finder pattern triple")
+    for trio in finder_triples(candidates):
+        sizes = _sizes_to_try(trio)
+        for size in sizes:
+            try:
+                transform = _locate(bits, width, height, trio, size)
+                grid = sample_grid(bits, width, height, transform, size)
+                hinted = symbol_size(read_version(grid))
+                if hinted != size and hinted not in sizes:
+                    # Perspective skews the size estimate; trust readable version information.
+                    sizes.append(hinted)
+                try:
+                    return decode_grid(grid)
+                except QRDecodeError:
+                    # A mirrored symbol reads correctly once transposed.
+                    return decode_grid([list(column) for column in zip(*grid)])
+            except QRDecodeError as e:
+                last_error = e
+    raise last_error
+
+
+def decode(data):
+    """Decode the first QR code found in PNG/JPEG ``data``; raises QRDecodeError."""
+    gray = downscale(load_gray(data))
+    last_error = None
+    for binarize in (binarize_adaptive, binarize_global):
+        try:
+            return decode_bits(binarize(gray), gray.width, gray.height)
+        except QRDecodeError as e:
+            last_error = e
+    raise last_error
@@ -4,10 +4,20 @@ const state = {
   summary: [],
   currentUser: null,
   verbose: false,
+  // Changes when the server's receipt versions start over (trip reloaded or replaced).
+  generation: null,
 };
 
 const CURRENT_USER_KEY = "trip-splitter:current-user";
 const VERBOSE_KEY = "trip-splitter:verbose";
+// Item rows are rendered in batches; the next batch renders when the end of a long receipt scrolls into view.
+const ITEM_BATCH = 40;
+// Cards render their item rows once they come this close to the viewport.
+const RENDER_MARGIN = "600px";
+// Placeholder height per item row for cards that haven't rendered their rows yet.
+const ROW_ESTIMATE_PX = 44;
+// Seconds before refetching a /state that failed without a Retry-After header.
+const STATE_RETRY_SECONDS = 2;
 
 const peopleList = document.getElementById("peopleList");
 const personForm = document.getElementById("personForm");
@@ -26,21 +36,104 @@ const overlayPeople = document.getElementById("overlayPeople");
 const overlayAddForm = document.getElementById("overlayAddForm");
 const overlayNewPerson = document.getElementById("overlayNewPerson");
 const overlayClose = document.getElementById("overlayClose");
+const toast = document.getElementById("toast");
 const MAX_UPLOAD_BYTES = 950 * 1024; // target under 1MB
+// Open a specific trip with ?trip=<id>; without it the legacy /api routes address the default trip.
+const TRIP_ID = new URLSearchParams(window.location.search).get("trip");
+const API_BASE = TRIP_ID ? `/api/trips/${encodeURIComponent(TRIP_ID)}` : "/api";
+
+// Rendered receipt cards by receipt id. A card is patched only when its receipt's server
+// version (or the people / current user shown in it) changes; ``rows`` maps item id to
+// { key, el } so only item rows whose content changed are rebuilt.
+const cards = new Map();
+// Optimistic participant edits not confirmed yet: `${receiptId}/${itemId}` -> participants.
+const pendingEdits = new Map();
+// Bumped whenever a mutation settles; a /state response requested before that is stale.
+let mutationSeq = 0;
+let refreshTimer = null;
+let toastTimer = null;
+let peopleKey = "";
+let summaryKey = "";
+let cardContext = "";
+let receiptList = null;
+let receiptsEmpty = null;
+let verboseToggle = null;
+const rowTemplate = document.createElement("template");
+
+const cardObserver =
+  "IntersectionObserver" in window ? new IntersectionObserver(onCardVisible, { rootMargin: RENDER_MARGIN }) : null;
+const moreObserver =
+  "IntersectionObserver" in window ? new IntersectionObserver(onMoreVisible, { rootMargin: RENDER_MARGIN }) : null;
+
+function escapeHtml(value) {
+  const entities = { "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;" };
+  return String(value ?? "").replace(/[&<>"']/g, (ch) => entities[ch]);
+}
 
 async function loadState() {
-  const res = await fetch("/api/state");
+  const seq = mutationSeq;
+  const res = await fetch(`${API_BASE}/state`);
+  if (!res.ok) {
+    // Start-up gating and overload shedding answer 503 with an error body; keep what is
+    // on screen (and the saved user) and try again once the server asks us to.
+    const data = await res.json().catch(() => ({}));
+    const retryAfter = Number(res.headers.get("Retry-After")) || STATE_RETRY_SECONDS;
+    showToast(`Could not refresh (${data.error || data.detail || `server error ${res.status}`}), retrying…`);
+    scheduleRefresh(retryAfter * 1000);
+    return;
+  }
   const data = await res.json();
+  if (seq !== mutationSeq) {
+    // A change settled while this was in flight and may be missing from it.
+    scheduleRefresh();
+    return;
+  }
+  applyState(data);
+}
+
+function scheduleRefresh(delay = 150) {
+  // Coalesces the refetches of several quick taps into one.
+  clearTimeout(refreshTimer);
+  refreshTimer = setTimeout(() => {
+    loadState().catch((err) => console.warn("refresh failed", err));
+  }, delay);
+}
+
+function applyState(data) {
+  if (data.generation !== state.generation) {
+    state.generation = data.generation;
+    clearCards();
+  }
   state.people = data.people || [];
-  state.receipts = data.receipts || [];
+  state.receipts = (data.receipts || []).map(withPendingEdits);
   state.summary = data.summary || [];
   syncVerbose();
   syncCurrentUser();
   renderPeople();
-  renderPaidBySelect();
+  const nextPeopleKey = JSON.stringify(state.people);
+  if (nextPeopleKey !== peopleKey) {
+    peopleKey = nextPeopleKey;
+    renderPaidBySelect();
+    renderOverlayPeople();
+  }
   renderSummary();
   renderReceipts();
-  renderOverlayPeople();
+}
+
+function editKey(receiptId, itemId) {
+  return `${receiptId}/${itemId}`;
+}
+
+function withPendingEdits(receipt) {
+  if (!pendingEdits.size) return receipt;
+  let items = null;
+  (receipt.items || []).forEach((item, pos) => {
+    const pending = pendingEdits.get(editKey(receipt.id, item.id));
+    if (!pending) return;
+    items = items || [...receipt.items];
+    items[pos] = { ...item, participants: pending };
+  });
+  return items ? { ...receipt, items } : receipt;
 }
 
 function syncCurrentUser() {
@@ -82,7 +175,7 @@ function renderPeople() {
   }
   peopleList.innerHTML = `
     <div style="display:flex; gap:8px; align-items:center; flex-wrap:wrap;">
-      <span class="chip">You: ${current}</span>
+      <span class="chip">You: ${escapeHtml(current)}</span>
       <span class="muted small">Other participants hidden (only you can join/leave items)</span>
     </div>
   `;
@@ -97,7 +190,7 @@ function renderOverlayPeople() {
   overlayPeople.innerHTML = state.people
     .map(
       (p) =>
-        `<button type="button" data-person="${p}" class="${state.currentUser === p ? "active" : ""}">${p}</button>`
+        `<button type="button" data-person="${escapeHtml(p)}" class="${state.currentUser === p ? "active" : ""}">${escapeHtml(p)}</button>`
     )
     .join("");
   overlayPeople.querySelectorAll("button[data-person]").forEach((btn) => {
@@ -120,10 +213,21 @@ function closeUserOverlay() {
   userOverlay.classList.add("hidden");
 }
 
+function showToast(message) {
+  if (!toast) {
+    console.warn(message);
+    return;
+  }
+  toast.textContent = message;
+  toast.classList.remove("hidden");
+  clearTimeout(toastTimer);
+  toastTimer = setTimeout(() => toast.classList.add("hidden"), 4000);
+}
+
 async function addPerson(name, setAsCurrent = false) {
   const cleaned = (name || "").trim();
   if (!cleaned) return;
-  await fetch("/api/people", {
+  await fetch(`${API_BASE}/people`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({ name: cleaned }),
@@ -151,7 +255,7 @@ function setCurrentUser(name) {
 }
 
 function renderPaidBySelect() {
-  const options = state.people.map((p) => `<option value="${p}">${p}</option>`).join("");
+  const options = state.people.map((p) => `<option value="${escapeHtml(p)}">${escapeHtml(p)}</option>`).join("");
   if (qrPaidBy) {
     qrPaidBy.innerHTML = `<option value="">Paid by</option>` + options;
     const preferred = state.currentUser && state.people.includes(state.currentUser) ? state.currentUser : state.people[0];
@@ -160,6 +264,9 @@ function renderPaidBySelect() {
 }
 
 function renderSummary() {
+  const key = JSON.stringify(state.summary);
+  if (key === summaryKey) return;
+  summaryKey = key;
   if (!state.summary.length) {
     summaryList.innerHTML = `<p class="muted">No balances yet.</p>`;
     return;
@@ -169,7 +276,7 @@ function renderSummary() {
       const netClass = row.net >= 0 ? "positive" : "negative";
       const netLabel = row.net >= 0 ? "should receive" : "owes";
       return `<div class="summary-row">
-        <div class="name">${row.name}</div>
+        <div class="name">${escapeHtml(row.name)}</div>
         <div class="muted small">Paid: EUR ${row.paid.toFixed(2)}</div>
         <div class="muted small">Joined: EUR ${row.consumed.toFixed(2)}</div>
         <div class="net ${netClass}">${netLabel} EUR ${Math.abs(row.net).toFixed(2)}</div>
@@ -178,122 +285,341 @@ function renderSummary() {
     .join("");
 }
 
-function renderReceipts() {
-  const toolbar = `
+function ensureReceiptsShell() {
+  if (receiptList) return;
+  receiptsEl.innerHTML = `
     <div class="receipts-toolbar">
       <label class="switch">
-        <input type="checkbox" id="verboseToggle" ${state.verbose ? "checked" : ""} />
+        <input type="checkbox" id="verboseToggle" />
         <span class="slider" aria-hidden="true"></span>
         <span class="label">Show verbose</span>
       </label>
     </div>
+    <p class="muted" data-empty hidden>No receipts yet. Add one above.</p>
+    <div class="receipt-list"></div>
   `;
+  verboseToggle = receiptsEl.querySelector("#verboseToggle");
+  receiptsEmpty = receiptsEl.querySelector("[data-empty]");
+  receiptList = receiptsEl.querySelector(".receipt-list");
+  verboseToggle.addEventListener("change", () => handleVerboseToggle(verboseToggle));
+  // Delegated handlers: cards and rows come and go without (re)wiring listeners.
+  receiptsEl.addEventListener("click", onReceiptsClick);
+  receiptsEl.addEventListener("change", onReceiptsChange);
+}
 
-  if (!state.receipts.length) {
-    receiptsEl.innerHTML = toolbar + `<p class="muted">No receipts yet. Add one above.</p>`;
-    wireVerboseToggle();
+function renderReceipts() {
+  ensureReceiptsShell();
+  verboseToggle.checked = state.verbose;
+  receiptsEl.classList.toggle("show-verbose", state.verbose);
+  receiptsEmpty.hidden = state.receipts.length > 0;
+  // People and the current user appear in every card (paid-by options, chips, join buttons).
+  cardContext = JSON.stringify([state.people, state.currentUser]);
+  const seen = new Set();
+  let next = receiptList.firstChild;
+  for (const receipt of state.receipts) {
+    seen.add(receipt.id);
+    let card = cards.get(receipt.id);
+    if (!card) {
+      card = createCard(receipt);
+      cards.set(receipt.id, card);
+    } else if (card.version !== receipt.version || card.context !== cardContext) {
+      patchCard(card, receipt);
+    } else {
+      card.receipt = receipt;
+    }
+    if (card.el !== next) {
+      receiptList.insertBefore(card.el, next);
+    } else {
+      next = next.nextSibling;
+    }
+  }
+  for (const [id, card] of cards) {
+    if (!seen.has(id)) {
+      dropCard(card);
+      cards.delete(id);
+    }
+  }
+}
+
+function createCard(receipt) {
+  const el = document.createElement("article");
+  el.className = "receipt-card";
+  el.dataset.receipt = receipt.id;
+  el.innerHTML = `
+    <div class="receipt-head"></div>
+    <div data-notes></div>
+    <div style="display:flex; gap:8px; margin-top:10px; flex-wrap:wrap;">
+      <button class="btn ghost" data-join-me="${escapeHtml(receipt.id)}">Join all items (me)</button>
+      <button class="btn ghost" data-bulk="all" data-receipt="${escapeHtml(receipt.id)}">Join all items for everyone</button>
+      <button class="btn ghost" data-bulk="none" data-receipt="${escapeHtml(receipt.id)}">Clear selections</button>
+    </div>
+    <table class="items-table">
+      <thead>
+        <tr>
+          <th class="mobile-join">Add</th>
+          <th style="width:35%">Item</th>
+          <th class="qty-col">Qty</th>
+          <th class="unit-col">Unit</th>
+          <th class="people-col">People</th>
+        </tr>
+      </thead>
+      <tbody></tbody>
+    </table>
+    <button type="button" class="btn ghost small more-items" data-more hidden></button>
+  `;
+  const card = {
+    el,
+    head: el.querySelector(".receipt-head"),
+    notes: el.querySelector("[data-notes]"),
+    tbody: el.querySelector("tbody"),
+    more: el.querySelector("[data-more]"),
+    rows: new Map(),
+    limit: ITEM_BATCH,
+    // Without IntersectionObserver every card renders its rows straight away.
+    visible: !cardObserver,
+    receipt,
+    version: null,
+    context: null,
+  };
+  patchCard(card, receipt);
+  cardObserver?.observe(el);
+  return card;
+}
+
+function dropCard(card) {
+  cardObserver?.unobserve(card.el);
+  moreObserver?.unobserve(card.more);
+  card.el.remove();
+}
+
+function clearCards() {
+  cards.forEach(dropCard);
+  cards.clear();
+}
+
+function patchCard(card, receipt) {
+  card.receipt = receipt;
+  card.version = receipt.version;
+  card.context = cardContext;
+  card.head.innerHTML = receiptHeadHtml(receipt);
+  card.notes.innerHTML = receipt.notes
+    ? `<p class="muted small" style="margin-top:6px;">${escapeHtml(receipt.notes)}</p>`
+    : "";
+  patchRows(card);
+}
+
+function receiptHeadHtml(r) {
+  const items = r.items || [];
+  const paidBy = r.paid_by || "";
+  const total = r.total_amount ?? 0;
+  const supplier = r.supplier ? `<span class="pill">${escapeHtml(r.supplier)}</span>` : "";
+  const receiptId = escapeHtml(r.id);
+  return `
+    <div class="meta">
+      <strong>${escapeHtml(r.title || "Receipt")}</strong>
+      <span class="muted small">${items.length} items - Total EUR ${total.toFixed(2)}</span>
+      ${supplier}
+    </div>
+    <div class="muted small">Paid by
+      <select class="paid-by" data-receipt="${receiptId}">
+        ${state.people
+          .map((p) => `<option value="${escapeHtml(p)}" ${p === paidBy ? "selected" : ""}>${escapeHtml(p)}</option>`)
+          .join("")}
+      </select>
+      <button class="btn ghost danger small" data-delete="${receiptId}" title="Delete receipt">🗑</button>
+    </div>
+  `;
+}
+
+function rowKey(item) {
+  return JSON.stringify([item.description, item.quantity, item.price, item.participants, state.currentUser]);
+}
+
+function buildRow(receiptId, item) {
+  const participants = item.participants || [];
+  const joined = state.currentUser && participants.includes(state.currentUser);
+  const ids = `data-receipt="${escapeHtml(receiptId)}" data-item="${escapeHtml(item.id)}"`;
+  const chips = participants.length
+    ? `<div class="participant-list">${participants
+        .map((p) => `<span class="chip ${p === state.currentUser ? "me" : ""}">${escapeHtml(p)}</span>`)
+        .join("")}</div>`
+    : `<span class="muted small">No one yet</span>`;
+  const joinButton = state.currentUser
+    ? `<button class="btn small ${joined ? "primary" : "ghost"}" data-join ${ids}>
+          ${joined ? "Joined — Leave" : "Join this item"}
+       </button>`
+    : `<span class="muted small">Pick who you are to join</span>`;
+  rowTemplate.innerHTML = `<tr>
+    <td class="mobile-join">
+      <input type="checkbox" data-join-checkbox data-joined="${joined ? "1" : "0"}" ${ids} ${
+        joined ? "checked" : ""
+      } aria-label="Join ${escapeHtml(item.description || "item")}">
+    </td>
+    <td>${escapeHtml(item.description || "Item")}</td>
+    <td class="qty-col">${escapeHtml(item.quantity ?? "-")}</td>
+    <td class="unit-col">EUR ${(item.price ?? 0).toFixed(2)}</td>
+    <td class="people-col">
+      <div class="join-actions">
+        ${chips}
+        ${joinButton}
+      </div>
+    </td>
+  </tr>`;
+  return rowTemplate.content.firstElementChild;
+}
+
+function patchRows(card) {
+  const items = card.receipt.items || [];
+  const shown = Math.min(items.length, card.limit);
+  if (!card.visible) {
+    // Off-screen: keep the card about as tall as it will be, but build no rows yet.
+    card.tbody.innerHTML = `<tr class="rows-placeholder"><td colspan="5" style="height:${shown * ROW_ESTIMATE_PX}px"></td></tr>`;
+    card.placeholder = true;
+    card.more.hidden = true;
     return;
   }
+  if (card.placeholder) {
+    card.tbody.textContent = "";
+    card.placeholder = false;
+  }
+  const seen = new Set();
+  let next = card.tbody.firstChild;
+  for (let pos = 0; pos < shown; pos += 1) {
+    const item = items[pos];
+    const key = rowKey(item);
+    let row = card.rows.get(item.id);
+    if (!row || row.key !== key) {
+      const el = buildRow(card.receipt.id, item);
+      if (row) {
+        if (next === row.el) next = el;
+        row.el.replaceWith(el);
+      }
+      row = { key, el };
+      card.rows.set(item.id, row);
+    }
+    seen.add(item.id);
+    if (row.el !== next) {
+      card.tbody.insertBefore(row.el, next);
+    } else {
+      next = next.nextSibling;
+    }
+  }
+  for (const [itemId, row] of card.rows) {
+    if (!seen.has(itemId)) {
+      row.el.remove();
+      card.rows.delete(itemId);
+    }
+  }
+  const rest = items.length - shown;
+  card.more.hidden = rest <= 0;
+  if (rest > 0) {
+    card.more.textContent = `Show ${Math.min(rest, ITEM_BATCH)} more (${rest} left)`;
+    moreObserver?.observe(card.more);
+  } else {
+    moreObserver?.unobserve(card.more);
+  }
+}
 
-  receiptsEl.innerHTML = toolbar + state.receipts
-    .map((r) => {
-      const items = r.items || [];
-      const paidBy = r.paid_by || "";
-      const total = r.total_amount ?? 0;
-      const supplier = r.supplier ? `<span class="pill">${r.supplier}</span>` : "";
-      const notes = r.notes ? `<p class="muted small" style="margin-top:6px;">${r.notes}</p>` : "";
-      return `
-      <article class="receipt-card ${state.verbose ? "show-verbose" : ""}" data-receipt="${r.id}">
-        <div class="receipt-head">
-          <div class="meta">
-            <strong>${r.title || "Receipt"}</strong>
-            <span class="muted small">${items.length} items - Total EUR ${total.toFixed(2)}</span>
-            ${supplier}
-          </div>
-          <div class="muted small">Paid by
-            <select class="paid-by" data-receipt="${r.id}">
-              ${state.people
-                .map((p) => `<option value="${p}" ${p === paidBy ? "selected" : ""}>${p}</option>`)
-                .join("")}
-            </select>
-            <button class="btn ghost danger small" data-delete="${r.id}" title="Delete receipt">🗑</button>
-          </div>
-        </div>
-        ${notes}
-        <div style="display:flex; gap:8px; margin-top:10px; flex-wrap:wrap;">
-          <button class="btn ghost" data-join-me="${r.id}">Join all items (me)</button>
-          <button class="btn ghost" data-bulk="all" data-receipt="${r.id}">Join all items for everyone</button>
-          <button class="btn ghost" data-bulk="none" data-receipt="${r.id}">Clear selections</button>
-        </div>
-        <table class="items-table">
-          <thead>
-            <tr>
-              <th class="mobile-join">Add</th>
-              <th style="width:35%">Item</th>
-              <th class="qty-col">Qty</th>
-              <th class="unit-col">Unit</th>
-              <th class="people-col">People</th>
-            </tr>
-          </thead>
-          <tbody>
-            ${items
-              .map((item) => {
-                const participants = item.participants || [];
-                const joined = state.currentUser && participants.includes(state.currentUser);
-                const chips = participants.length
-                  ? `<div class="participant-list">${participants
-                      .map((p) => `<span class="chip ${p === state.currentUser ? "me" : ""}">${p}</span>`)
-                      .join("")}</div>`
-                  : `<span class="muted small">No one yet</span>`;
-                const joinButton = state.currentUser
-                  ? `<button class="btn small ${joined ? "primary" : "ghost"}" data-join data-receipt="${r.id}" data-item="${item.id}">
-                        ${joined ? "Joined — Leave" : "Join this item"}
-                     </button>`
-                  : `<span class="muted small">Pick who you are to join</span>`;
-                return `<tr>
-                  <td class="mobile-join">
-                    <input type="checkbox" data-join-checkbox data-joined="${joined ? "1" : "0"}" data-receipt="${r.id}" data-item="${item.id}" ${
-                      joined ? "checked" : ""
-                    } aria-label="Join ${item.description || "item"}">
-                  </td>
-                  <td>${item.description || "Item"}</td>
-                  <td class="qty-col">${item.quantity ?? "-"}</td>
-                  <td class="unit-col">EUR ${(item.price ?? 0).toFixed(2)}</td>
-                  <td class="people-col">
-                    <div class="join-actions">
-                      ${chips}
-                      ${joinButton}
-                    </div>
-                  </td>
-                </tr>`;
-              })
-              .join("")}
-          </tbody>
-        </table>
-      </article>
-      `;
-    })
-    .join("");
+function cardFor(el) {
+  return cards.get(el.closest(".receipt-card")?.dataset.receipt);
+}
 
-  receiptsEl.querySelectorAll(".paid-by").forEach((sel) => {
-    sel.addEventListener("change", () => handlePaidBy(sel));
-  });
-  receiptsEl.querySelectorAll("[data-bulk]").forEach((btn) => {
-    btn.addEventListener("click", () => handleBulk(btn));
-  });
-  receiptsEl.querySelectorAll("[data-delete]").forEach((btn) => {
-    btn.addEventListener("click", () => handleDelete(btn.dataset.delete));
+function onCardVisible(entries) {
+  entries.forEach((entry) => {
+    if (!entry.isIntersecting) return;
+    const card = cardFor(entry.target);
+    cardObserver.unobserve(entry.target);
+    if (!card || card.visible) return;
+    card.visible = true;
+    patchRows(card);
   });
-  receiptsEl.querySelectorAll("[data-join-me]").forEach((btn) => {
-    btn.addEventListener("click", () => handleJoinMe(btn.dataset.joinMe));
-  });
-  receiptsEl.querySelectorAll("[data-join]").forEach((btn) => {
-    btn.addEventListener("click", () => handleJoin(btn));
-  });
-  receiptsEl.querySelectorAll("[data-join-checkbox]").forEach((input) => {
-    input.addEventListener("change", () => handleJoinCheckbox(input));
+}
+
+function onMoreVisible(entries) {
+  entries.forEach((entry) => {
+    if (entry.isIntersecting) showMoreItems(cardFor(entry.target));
   });
-  wireVerboseToggle();
+}
+
+function showMoreItems(card) {
+  if (!card || !card.visible) return;
+  card.limit += ITEM_BATCH;
+  patchRows(card);
+}
+
+function onReceiptsClick(e) {
+  const btn = e.target.closest("button");
+  if (!btn || !receiptsEl.contains(btn)) return;
+  const { dataset } = btn;
+  if (dataset.delete) {
+    handleDelete(dataset.delete);
+  } else if (dataset.joinMe) {
+    handleJoinMe(dataset.joinMe);
+  } else if (dataset.bulk) {
+    handleBulk(btn);
+  } else if ("join" in dataset) {
+    handleJoin(btn);
+  } else if ("more" in dataset) {
+    showMoreItems(cardFor(btn));
+  }
+}
+
+function onReceiptsChange(e) {
+  const el = e.target;
+  if (el.matches(".paid-by")) {
+    handlePaidBy(el);
+  } else if (el.matches("[data-join-checkbox]")) {
+    handleJoinCheckbox(el);
+  }
+}
+
+function findItem(receiptId, itemId) {
+  const receipt = state.receipts.find((r) => r.id === receiptId);
+  return receipt?.items?.find((it) => it.id === itemId);
+}
+
+function setItemParticipants(receiptId, itemId, participants) {
+  const pos = state.receipts.findIndex((r) => r.id === receiptId);
+  if (pos < 0) return;
+  const receipt = state.receipts[pos];
+  const items = (receipt.items || []).map((item) => (item.id === itemId ? { ...item, participants } : item));
+  state.receipts[pos] = { ...receipt, items };
+  const card = cards.get(receiptId);
+  if (card) {
+    card.receipt = state.receipts[pos];
+    patchRows(card);
+  }
+}
+
+async function saveParticipants(receiptId, itemId, participants, previous) {
+  // Optimistic: the row changes at once; a failed save puts it back unless a later tap replaced it.
+  const key = editKey(receiptId, itemId);
+  pendingEdits.set(key, participants);
+  setItemParticipants(receiptId, itemId, participants);
+  try {
+    const res = await fetch(`${API_BASE}/receipts/${receiptId}/participants`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ item_id: itemId, participants }),
+    });
+    if (!res.ok) {
+      const data = await res.json().catch(() => ({}));
+      throw new Error(data.error || data.detail || `Server error (${res.status})`);
+    }
+    return true;
+  } catch (err) {
+    if (pendingEdits.get(key) === participants) {
+      setItemParticipants(receiptId, itemId, previous);
+    }
+    showToast(`Could not save your change, it was undone: ${err.message}`);
+    return false;
+  } finally {
+    if (pendingEdits.get(key) === participants) {
+      pendingEdits.delete(key);
+    }
+    mutationSeq += 1;
+    scheduleRefresh();
+  }
 }
 
 async function toggleParticipation(receiptId, itemId, forceJoin) {
@@ -301,24 +627,19 @@ async function toggleParticipation(receiptId, itemId, forceJoin) {
     openUserOverlay();
     return false;
   }
-  const receipt = state.receipts.find((r) => r.id === receiptId);
-  const item = receipt?.items?.find((it) => it.id === itemId);
+  const item = findItem(receiptId, itemId);
   if (!item) return false;
-  let participants = Array.isArray(item.participants) ? [...item.participants] : [];
-  const alreadyIn = participants.includes(state.currentUser);
+  const previous = Array.isArray(item.participants) ? item.participants : [];
+  const alreadyIn = previous.includes(state.currentUser);
   const shouldJoin = typeof forceJoin === "boolean" ? forceJoin : !alreadyIn;
+  let participants = previous;
   if (shouldJoin && !alreadyIn) {
-    participants.push(state.currentUser);
+    participants = [...previous, state.currentUser];
   } else if (!shouldJoin && alreadyIn) {
-    participants = participants.filter((p) => p !== state.currentUser);
+    participants = previous.filter((p) => p !== state.currentUser);
   }
-  await fetch(`/api/receipts/${receiptId}/participants`, {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ item_id: itemId, participants }),
-  });
-  await loadState();
-  return true;
+  if (participants === previous) return true;
+  return saveParticipants(receiptId, itemId, participants, previous);
 }
 
 async function handleJoin(btn) {
@@ -330,7 +651,7 @@ async function handleJoinCheckbox(input) {
   const receiptId = input.dataset.receipt;
   const itemId = input.dataset.item;
   const ok = await toggleParticipation(receiptId, itemId, input.checked);
-  if (!ok) {
+  if (!ok && input.isConnected) {
     input.checked = prevJoined;
   }
 }
@@ -342,25 +663,19 @@ async function handleJoinMe(receiptId) {
   }
   const receipt = state.receipts.find((r) => r.id === receiptId);
   if (!receipt || !receipt.items?.length) return;
-  const promises = receipt.items.map((item) => {
-    const participants = Array.isArray(item.participants) ? [...item.participants] : [];
-    if (!participants.includes(state.currentUser)) {
-      participants.push(state.currentUser);
-    }
-    return fetch(`/api/receipts/${receiptId}/participants`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ item_id: item.id, participants }),
+  const saves = receipt.items
+    .filter((item) => !(item.participants || []).includes(state.currentUser))
+    .map((item) => {
+      const previous = Array.isArray(item.participants) ? item.participants : [];
+      return saveParticipants(receiptId, item.id, [...previous, state.currentUser], previous);
     });
-  });
-  await Promise.all(promises);
-  await loadState();
+  await Promise.all(saves);
 }
 
 async function handlePaidBy(sel) {
   const receiptId = sel.dataset.receipt;
   const paid_by = sel.value;
-  await fetch(`/api/receipts/${receiptId}/paid_by`, {
+  await fetch(`${API_BASE}/receipts/${receiptId}/paid_by`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({ paid_by }),
@@ -371,7 +686,7 @@ async function handlePaidBy(sel) {
 async function handleBulk(btn) {
   const receiptId = btn.dataset.receipt;
   const mode = btn.dataset.bulk;
-  await fetch(`/api/receipts/${receiptId}/bulk`, {
+  await fetch(`${API_BASE}/receipts/${receiptId}/bulk`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({ mode }),
@@ -379,16 +694,10 @@ async function handleBulk(btn) {
   await loadState();
 }
 
-function wireVerboseToggle() {
-  const verboseToggle = document.getElementById("verboseToggle");
-  if (!verboseToggle) return;
-  verboseToggle.addEventListener("change", () => handleVerboseToggle(verboseToggle), { once: true });
-}
-
 function handleVerboseToggle(input) {
   state.verbose = !!input.checked;
   localStorage.setItem(VERBOSE_KEY, state.verbose ? "1" : "0");
-  renderReceipts();
+  receiptsEl.classList.toggle("show-verbose", state.verbose);
 }
 
 personForm.addEventListener("submit", async (e) => {
@@ -495,7 +804,7 @@ async function createReceiptFromHtml(htmlText, paidBy) {
   if (paidBy) formData.append("paid_by", paidBy);
   if (invoiceTitleInput?.value) formData.append("title", invoiceTitleInput.value);
   if (notesInput?.value) formData.append("notes", notesInput.value);
-  const res = await fetch("/api/receipts", {
+  const res = await fetch(`${API_BASE}/receipts`, {
     method: "POST",
     body: formData,
   });
@@ -508,7 +817,7 @@ async function createReceiptFromHtml(htmlText, paidBy) {
 }
 
 async function handleDelete(receiptId) {
-  await fetch(`/api/receipts/${receiptId}`, { method: "DELETE" });
+  await fetch(`${API_BASE}/receipts/${receiptId}`, { method: "DELETE" });
   await loadState();
 }
 